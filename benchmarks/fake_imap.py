@@ -0,0 +1,268 @@
+import email
+import re
+import socketserver
+import threading
+import time
+
+# Teilmenge von IMAP4rev1, die die App verwendet
+CAPABILITIES = "IMAP4rev1 UIDPLUS"
+UIDVALIDITY = 1
+
+_FETCH_ITEM_RE = re.compile(r"BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+\.\d+>)?|[A-Z0-9.]+", re.IGNORECASE)
+_SECTION_RE = re.compile(r"BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", re.IGNORECASE)
+
+
+def _parse_set(value, maximum):
+    """Zerlegt eine Sequenz- oder UID-Menge wie "1:5,7,9:*"."""
+    numbers = set()
+    for part in value.split(","):
+        start, _, end = part.partition(":")
+        start = maximum if start == "*" else int(start)
+        end = start if not end else (maximum if end == "*" else int(end))
+        numbers.update(range(min(start, end), max(start, end) + 1))
+    return numbers
+
+
+def _literal(data):
+    return f"{{{len(data)}}}\r\n".encode() + data
+
+
+def _quote(value):
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _bodystructure(part):
+    """Erzeugt die BODYSTRUCTURE (RFC 3501) eines Teils, inklusive Content-Disposition."""
+    if part.is_multipart():
+        children = "".join(_bodystructure(child) for child in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())})"
+    params = " ".join(f"{_quote(key.upper())} {_quote(value)}" for key, value in (part.get_params() or [])[1:])
+    payload = part.get_payload().encode("utf-8", "surrogateescape")
+    fields = [
+        _quote(part.get_content_maintype().upper()),
+        _quote(part.get_content_subtype().upper()),
+        f"({params})" if params else "NIL",
+        "NIL",
+        "NIL",
+        _quote(part.get("Content-Transfer-Encoding", "7BIT").upper()),
+        str(len(payload)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count(b"\n")))
+    fields.append("NIL")
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        params = f'("FILENAME" {_quote(filename)})' if filename else "NIL"
+        fields.append(f"({_quote(disposition.upper())} {params})")
+    return "(" + " ".join(fields) + ")"
+
+
+def _body_part(message, section):
+    """Liefert den kodierten Inhalt eines Teils wie "1" oder "1.2"."""
+    part = message
+    for number in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+        elif number != "1":
+            return b""
+    return part.get_payload().encode("utf-8", "surrogateescape")
+
+
+class Mailbox:
+    """Ein Postfach im Speicher mit Nachrichten (UID, Flags, Datum, Rohnachricht)."""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.messages)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.selected = None
+
+    def _send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data)
+
+    def handle(self):
+        self._send("* OK [CAPABILITY %s] Benchmark IMAP ready\r\n" % CAPABILITIES)
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            tag, _, rest = line.decode("utf-8", "replace").strip().partition(" ")
+            command, _, arguments = rest.partition(" ")
+            command = command.upper()
+            self.server.stats["commands"] += 1
+            if command == "UID":
+                command, _, arguments = arguments.partition(" ")
+                command = "UID " + command.upper()
+            handler = getattr(self, "_cmd_" + command.replace(" ", "_").lower(), None)
+            if handler is None:
+                self._send(f"{tag} BAD unknown command {command}\r\n")
+                continue
+            if handler(tag, arguments) is False:
+                return
+
+    def _cmd_capability(self, tag, arguments):
+        self._send(f"* CAPABILITY {CAPABILITIES}\r\n{tag} OK CAPABILITY completed\r\n")
+
+    def _cmd_login(self, tag, arguments):
+        self._send(f"{tag} OK LOGIN completed\r\n")
+
+    def _cmd_noop(self, tag, arguments):
+        self._send(f"{tag} OK NOOP completed\r\n")
+
+    def _cmd_logout(self, tag, arguments):
+        self._send(f"* BYE logging out\r\n{tag} OK LOGOUT completed\r\n")
+        return False
+
+    def _cmd_list(self, tag, arguments):
+        for name in self.server.mailboxes:
+            self._send(f'* LIST (\\HasNoChildren) "/" "{name}"\r\n')
+        self._send(f"{tag} OK LIST completed\r\n")
+
+    def _cmd_select(self, tag, arguments):
+        name = arguments.split(" ", 1)[0].strip('"')
+        mailbox = self.server.mailbox(name)
+        if mailbox is None:
+            self._send(f"{tag} NO mailbox does not exist\r\n")
+            return
+        self.selected = mailbox.snapshot()
+        uidnext = self.selected[-1][0] + 1 if self.selected else 1
+        self._send(
+            f"* {len(self.selected)} EXISTS\r\n* 0 RECENT\r\n"
+            f"* OK [UIDVALIDITY {UIDVALIDITY}] UIDs valid\r\n* OK [UIDNEXT {uidnext}] next UID\r\n"
+            f"* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)\r\n"
+            f"{tag} OK [READ-WRITE] SELECT completed\r\n"
+        )
+
+    _cmd_examine = _cmd_select
+
+    def _cmd_search(self, tag, arguments):
+        numbers = " ".join(str(i) for i in range(1, len(self.selected) + 1))
+        self._send(f"* SEARCH {numbers}\r\n{tag} OK SEARCH completed\r\n")
+
+    def _cmd_uid_search(self, tag, arguments):
+        uids = [uid for uid, _, _, _ in self.selected]
+        match = re.search(r"UID (\S+)", arguments, re.IGNORECASE)
+        if match and uids:
+            wanted = _parse_set(match.group(1), uids[-1])
+            uids = [uid for uid in uids if uid in wanted]
+        self._send(f"* SEARCH {' '.join(map(str, uids))}\r\n{tag} OK SEARCH completed\r\n")
+
+    def _fetch(self, tag, positions, items):
+        for position in positions:
+            uid, flags, date, raw = self.selected[position - 1]
+            parts = [b"UID %d" % uid]
+            for item in _FETCH_ITEM_RE.findall(items):
+                upper = item.upper()
+                if upper == "FLAGS":
+                    parts.append(f"FLAGS ({' '.join(flags)})".encode())
+                elif upper == "INTERNALDATE":
+                    parts.append(f'INTERNALDATE "{date.strftime("%d-%b-%Y %H:%M:%S %z")}"'.encode())
+                elif upper == "RFC822.SIZE":
+                    parts.append(b"RFC822.SIZE %d" % len(raw))
+                elif upper == "BODYSTRUCTURE":
+                    parts.append(b"BODYSTRUCTURE " + _bodystructure(email.message_from_bytes(raw)).encode())
+                elif upper == "RFC822":
+                    parts.append(b"RFC822 " + _literal(raw))
+                elif upper.startswith("BODY"):
+                    parts.append(self._section(item, raw))
+            self.server.stats["messages"] += 1
+            response = b"* %d FETCH (" % position + b" ".join(parts) + b")\r\n"
+            self.server.stats["bytes"] += len(response)
+            self._send(response)
+        self._send(f"{tag} OK FETCH completed\r\n")
+
+    def _section(self, item, raw):
+        section, start, length = _SECTION_RE.match(item).groups()
+        upper = section.upper()
+        if upper.startswith("HEADER.FIELDS"):
+            names = re.search(r"\(([^)]*)\)", section).group(1).split()
+            message = email.message_from_bytes(raw)
+            data = "".join(
+                f"{name}: {message[name]}\r\n" for name in names if message[name] is not None
+            ).encode() + b"\r\n"
+        elif upper == "HEADER":
+            data = raw.split(b"\n\n", 1)[0] + b"\n\n"
+        elif section and section[0].isdigit():
+            data = _body_part(email.message_from_bytes(raw), section)
+        else:
+            data = raw
+        name = f"BODY[{section}]"
+        if start is not None:
+            data = data[int(start):int(start) + int(length)]
+            name += f"<{start}>"
+        return name.encode() + b" " + _literal(data)
+
+    def _cmd_fetch(self, tag, arguments):
+        sequence, _, items = arguments.partition(" ")
+        positions = sorted(_parse_set(sequence, len(self.selected)) & set(range(1, len(self.selected) + 1)))
+        self._fetch(tag, positions, items)
+
+    def _cmd_uid_fetch(self, tag, arguments):
+        sequence, _, items = arguments.partition(" ")
+        uids = [uid for uid, _, _, _ in self.selected]
+        if not uids:
+            self._send(f"{tag} OK FETCH completed\r\n")
+            return
+        wanted = _parse_set(sequence, uids[-1])
+        positions = [i + 1 for i, uid in enumerate(uids) if uid in wanted]
+        if not positions and sequence.endswith(":*"):
+            # "n:*" liefert laut RFC 3501 mindestens die letzte Nachricht
+            positions = [len(uids)]
+        self._fetch(tag, positions, items)
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """
+    Lokaler IMAP Server ohne TLS, der ein erzeugtes Postfach ausliefert.
+
+    Jeder Login wird akzeptiert. Unterstützt werden die Befehle, die App und Abgleich
+    verwenden (SELECT/EXAMINE, FETCH, UID FETCH, UID SEARCH, NOOP, LIST). Neben der Inbox
+    können weitere Ordner angegeben werden; latency_ms verzögert jeden Befehl wie ein
+    entfernter Server.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, messages, host="127.0.0.1", port=0, folders=None, latency_ms=0):
+        super().__init__((host, port), _Handler)
+        self.mailboxes = {"INBOX": Mailbox(messages)}
+        for name, folder_messages in (folders or {}).items():
+            self.mailboxes[name] = Mailbox(folder_messages)
+        self.latency = latency_ms / 1000
+        self.stats = {"commands": 0, "messages": 0, "bytes": 0}
+
+    def mailbox(self, name):
+        """Liefert einen Ordner, INBOX unabhängig von der Schreibweise."""
+        if name.upper() == "INBOX":
+            return self.mailboxes["INBOX"]
+        return self.mailboxes.get(name)
+
+    @property
+    def address(self):
+        """Serveradresse im Format für den IMAP Verbindungspool."""
+        host, port = self.server_address
+        return f"imap://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,210 @@
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Dimension wie bei text-embedding-ada-002
+EMBEDDING_DIMENSION = 1536
+
+
+class RateLimiter:
+    """Token Bucket für Anfragen und Tokens pro Minute wie bei der OpenAI-API (0 = unbegrenzt)."""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.available = dict(self.limits)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """
+        Bucht eine Anfrage.
+
+        Returns:
+        - float: 0 bei Erfolg, sonst die Wartezeit in Sekunden bis genug Kontingent frei ist.
+        """
+        with self.lock:
+            now = time.monotonic()
+            elapsed, self.updated = now - self.updated, now
+            wait = 0.0
+            needed = {"requests": 1, "tokens": tokens}
+            for name, limit in self.limits.items():
+                if not limit:
+                    continue
+                self.available[name] = min(limit, self.available[name] + elapsed * limit / 60)
+                if self.available[name] < needed[name]:
+                    wait = max(wait, (needed[name] - self.available[name]) * 60 / limit)
+            if wait:
+                return wait
+            for name, limit in self.limits.items():
+                if limit:
+                    self.available[name] -= needed[name]
+            return 0.0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server.count("requests")
+
+        if self.path.endswith("/embeddings"):
+            inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            tokens = sum(len(text) // 4 + 1 for text in inputs)
+        elif self.path.endswith("/chat/completions"):
+            tokens = sum(len(message["content"]) // 4 + 1 for message in request["messages"])
+            tokens += request.get("max_tokens") or 0
+        else:
+            self._json(404, {"error": {"message": f"Unbekannter Endpunkt {self.path}", "type": "invalid_request_error"}})
+            return
+
+        wait = server.rate_limiter.acquire(tokens)
+        if wait:
+            server.count("rate_limited")
+            self._json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"retry-after-ms": str(int(wait * 1000)), "retry-after": str(max(int(wait), 1))},
+            )
+            return
+        server.count("tokens", tokens)
+        time.sleep(server.latency())
+
+        if self.path.endswith("/embeddings"):
+            self._embeddings(request, inputs, tokens)
+        elif request.get("stream"):
+            self._chat_stream(request)
+        else:
+            self._chat(request)
+
+    def _embeddings(self, request, inputs, tokens):
+        vectors = self.server.embedder.embed(inputs)
+        data = []
+        for i, vector in enumerate(vectors):
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        self._json(200, {
+            "object": "list", "data": data, "model": request["model"],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _answer(self, request):
+        words = request["messages"][-1]["content"].split()
+        # Antwortlänge wie bei einer echten Zusammenfassung, begrenzt durch max_tokens
+        length = min(request.get("max_tokens") or 150, 120)
+        return " ".join(words[i % len(words)] for i in range(length)) if words else ""
+
+    @staticmethod
+    def _usage(request, answer):
+        prompt_tokens = sum(len(message["content"]) // 4 + 1 for message in request["messages"])
+        completion_tokens = len(answer) // 4 + 1
+        return {
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _chat(self, request):
+        answer = self._answer(request)
+        self._json(200, {
+            "id": "chatcmpl-benchmark", "object": "chat.completion", "created": int(time.time()),
+            "model": request["model"],
+            "choices": [{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": answer},
+            }],
+            "usage": self._usage(request, answer),
+        })
+
+    def _chat_stream(self, request):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(payload):
+            data = f"data: {payload}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        answer = self._answer(request)
+        for word in answer.split():
+            time.sleep(self.server.token_latency)
+            send(json.dumps({
+                "id": "chatcmpl-benchmark", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request["model"],
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send(json.dumps({
+                "id": "chatcmpl-benchmark", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request["model"], "choices": [], "usage": self._usage(request, answer),
+            }))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    OpenAI-kompatibler HTTP-Endpunkt für Embeddings und Chat Completions.
+
+    Antworten sind deterministisch (Embeddings per Feature Hashing), Latenz und Rate Limits
+    (429 mit retry-after) sind einstellbar. Die App verwendet ihn über OPENAI_BASE_URL.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=50, jitter_ms=10, token_latency_ms=0,
+                 requests_per_minute=0, tokens_per_minute=0, seed=0):
+        super().__init__((host, port), _Handler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_latency = token_latency_ms / 1000
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        # Erst hier importieren: utils liest die Konfiguration aus der Umgebung beim Import
+        from utils.embedding_providers import HashingEmbeddingProvider
+        self.embedder = HashingEmbeddingProvider(EMBEDDING_DIMENSION)
+        self.stats = {"requests": 0, "rate_limited": 0, "tokens": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def latency(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(self.latency_ms + jitter, 0) / 1000
+
+    @property
+    def base_url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,215 @@
+import random
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+
+# Aufbau der erzeugten Nachrichten
+MIME_PLAIN = "plain"
+MIME_HTML = "html"
+MIME_ALTERNATIVE = "alternative"
+MIME_ATTACHMENT = "attachment"
+DEFAULT_MIME_MIX = {MIME_PLAIN: 4, MIME_HTML: 2, MIME_ALTERNATIVE: 3, MIME_ATTACHMENT: 1}
+# Anteil der Antworten mit zitiertem Verlauf und Anzahl der zuletzt erzeugten Nachrichten,
+# von denen eine beantwortet wird
+DEFAULT_REPLY_RATIO = 0.3
+REPLY_WINDOW = 20
+
+SENDERS = [
+    "Anna Müller <anna.mueller@example.de>",
+    "Stadtwerke Musterstadt <rechnung@stadtwerke.example>",
+    "Bob Schmidt <bob@example.com>",
+    "Versandhandel <versand@shop.example>",
+    "Personalabteilung <hr@firma.example>",
+    "Carla Weber <carla.weber@example.org>",
+    "Newsletter <news@verein.example>",
+    "Dr. Jonas Fischer <j.fischer@praxis.example>",
+]
+
+TOPICS = {
+    "Rechnung": [
+        "anbei erhalten Sie die Rechnung {number} für den Monat",
+        "der Betrag von {amount} Euro wird am {date} abgebucht",
+        "bei Fragen zur Rechnung wenden Sie sich bitte an unseren Kundenservice",
+    ],
+    "Termin": [
+        "können wir den Termin am {date} um {hour} Uhr verschieben",
+        "das Meeting findet im Besprechungsraum im zweiten Stock statt",
+        "bitte bring die Unterlagen zum Projektstand mit",
+    ],
+    "Lieferung": [
+        "Ihre Bestellung {number} wurde versandt und kommt voraussichtlich am {date} an",
+        "die Sendungsnummer lautet {number}",
+        "das Paket wird an der Haustür abgegeben",
+    ],
+    "Urlaub": [
+        "dein Urlaubsantrag vom {date} wurde genehmigt",
+        "bitte trage die Abwesenheit in den Teamkalender ein",
+        "die Vertretung übernimmt in dieser Zeit dein Kollege",
+    ],
+    "Vereinsfest": [
+        "das Sommerfest des Vereins findet am {date} statt",
+        "wir suchen noch Helfer für den Kuchenstand",
+        "Anmeldungen bitte bis {date} an den Vorstand",
+    ],
+}
+
+FILLER = (
+    "Vielen Dank für die schnelle Rückmeldung. Ich melde mich, sobald ich mehr weiß. "
+    "Falls noch etwas fehlt, gib mir bitte kurz Bescheid. "
+)
+
+
+def _body(rng, topic, date):
+    values = {
+        "number": f"RE-{date.year}-{rng.randint(1000, 9999)}",
+        "amount": f"{rng.randint(10, 900)},{rng.randint(0, 99):02d}",
+        "date": (date + timedelta(days=rng.randint(1, 30))).strftime("%d.%m.%Y"),
+        "hour": rng.randint(8, 18),
+    }
+    sentences = [sentence.format(**values) for sentence in TOPICS[topic]]
+    rng.shuffle(sentences)
+    paragraphs = ["Hallo,", ". ".join(sentences) + ".", FILLER * rng.randint(1, 6), "Viele Grüße"]
+    return "\n\n".join(paragraphs), values["number"]
+
+
+def _html(text):
+    paragraphs = "".join(f"<p>{paragraph}</p>" for paragraph in text.split("\n\n"))
+    return f"<html><head><style>p {{ margin: 0 }}</style></head><body>{paragraphs}</body></html>"
+
+
+def _quote(parent):
+    """Zitiert die beantwortete Nachricht samt ihrem Verlauf wie ein Mailprogramm."""
+    quoted = "\n".join(f"> {line}" if line else ">" for line in parent["text"].splitlines())
+    return f"Am {parent['date'].strftime('%d.%m.%Y um %H:%M')} schrieb {parent['sender']}:\n{quoted}"
+
+
+def _build_message(rng, mime_type, date, attachment_kb=64, parent=None):
+    if parent is None:
+        topic = rng.choice(list(TOPICS))
+        text, number = _body(rng, topic, date)
+        subject = f"{topic} {number}"
+    else:
+        # Antwort auf parent: kurzer neuer Text, darunter der vollständige zitierte Verlauf
+        topic, number = parent["topic"], parent["number"]
+        reply, _ = _body(rng, topic, date)
+        text = f"{reply}\n\n{_quote(parent)}"
+        subject = parent["subject"] if parent["subject"].startswith("Re: ") else f"Re: {parent['subject']}"
+    sender = rng.choice(SENDERS)
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = sender
+    message["To"] = "benutzer@example.de"
+    message["Date"] = format_datetime(date)
+    message["Message-ID"] = make_msgid(domain="benchmark.example")
+    references = []
+    if parent is not None:
+        references = parent["references"] + [parent["message_id"]]
+        message["In-Reply-To"] = parent["message_id"]
+        message["References"] = " ".join(references)
+
+    if mime_type == MIME_HTML:
+        message.set_content(_html(text), subtype="html")
+    elif mime_type == MIME_ALTERNATIVE:
+        message.set_content(text)
+        message.add_alternative(_html(text), subtype="html")
+    else:
+        message.set_content(text)
+        if mime_type == MIME_ATTACHMENT:
+            message.add_attachment(
+                rng.randbytes(attachment_kb * 1024), maintype="application", subtype="pdf",
+                filename=f"{number}.pdf",
+            )
+    info = {
+        "message_id": message["Message-ID"], "references": references, "subject": subject, "sender": sender,
+        "date": date, "text": text, "topic": topic, "number": number,
+    }
+    return message.as_bytes(), info
+
+
+def generate_message(rng, mime_type, date, attachment_kb=64, parent=None):
+    """
+    Erzeugt eine realistische E-Mail.
+
+    Args:
+    - rng (random.Random): Zufallsgenerator.
+    - mime_type (str): MIME_PLAIN, MIME_HTML, MIME_ALTERNATIVE oder MIME_ATTACHMENT.
+    - date (datetime): Das Datum der E-Mail.
+    - attachment_kb (int): Größe des Anhangs in KB bei MIME_ATTACHMENT.
+    - parent (dict): Optional die beantwortete Nachricht (aus generate_mailbox).
+
+    Returns:
+    - bytes: Die Rohnachricht (RFC822).
+    """
+    return _build_message(rng, mime_type, date, attachment_kb, parent)[0]
+
+
+def generate_mailbox(count, mime_mix=None, attachment_kb=64, seed=0, reply_ratio=DEFAULT_REPLY_RATIO):
+    """
+    Erzeugt ein Postfach für den IMAP-Teststand.
+
+    Args:
+    - count (int): Anzahl der Nachrichten.
+    - mime_mix (dict): Gewichtung der MIME-Strukturen (Standard: DEFAULT_MIME_MIX).
+    - attachment_kb (int): Größe der Anhänge in KB.
+    - seed (int): Startwert des Zufallsgenerators, gleiche Werte liefern das gleiche Postfach.
+    - reply_ratio (float): Anteil der Nachrichten, die eine der letzten Nachrichten beantworten
+      und deren Verlauf zitieren.
+
+    Returns:
+    - list: (UID, Flags, Datum, Rohnachricht), älteste zuerst.
+    """
+    rng = random.Random(seed)
+    mime_mix = mime_mix or DEFAULT_MIME_MIX
+    types, weights = zip(*mime_mix.items())
+    start = datetime(2024, 1, 1, 8, tzinfo=timezone.utc)
+    messages = []
+    recent = []
+    date = start
+    for uid in range(1, count + 1):
+        date += timedelta(minutes=rng.randint(5, 600))
+        flags = ("\\Seen",) if rng.random() < 0.7 else ()
+        mime_type = rng.choices(types, weights)[0]
+        parent = rng.choice(recent) if recent and rng.random() < reply_ratio else None
+        raw, info = _build_message(rng, mime_type, date, attachment_kb, parent)
+        messages.append((uid, flags, date, raw))
+        # Beantwortet werden die letzten Nachrichten, so entstehen längere Verläufe
+        if parent is not None:
+            recent.remove(parent)
+        recent = (recent + [info])[-REPLY_WINDOW:]
+    return messages
+
+
+def parse_mime_mix(value):
+    """Liest eine Gewichtung wie "plain=4,html=2,alternative=3,attachment=1"."""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in DEFAULT_MIME_MIX:
+            raise ValueError(f"Unbekannter MIME-Typ: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+FOLDER_NAMES = ("Gesendet", "Archiv", "Projekte", "Newsletter", "Rechnungen", "Reisen", "Verein")
+
+
+def split_mailbox(messages, folder_count):
+    """
+    Verteilt die Nachrichten reihum auf die Inbox und weitere Ordner.
+
+    Args:
+    - messages (list): Die Nachrichten aus generate_mailbox.
+    - folder_count (int): Anzahl der Ordner einschließlich der Inbox.
+
+    Returns:
+    - tuple: (list Nachrichten der Inbox, dict Ordnername -> Nachrichten)
+    """
+    names = [
+        f"{FOLDER_NAMES[i % len(FOLDER_NAMES)]}{i // len(FOLDER_NAMES) or ''}" for i in range(folder_count - 1)
+    ]
+    folders = {name: [] for name in names}
+    inbox = []
+    for i, message in enumerate(messages):
+        position = i % max(folder_count, 1)
+        (inbox if position == 0 else folders[names[position - 1]]).append(message)
+    return inbox, folders
@@ -0,0 +1,314 @@
+"""
+End-to-end Benchmark: Login -> fetch_emails -> Abgleich -> generate_faiss_index -> Suche -> llm_query_answer,
+zuletzt llm_query_answer, während im Hintergrund embeddet wird.
+
+IMAP Server und OpenAI-API werden lokal nachgestellt, es wird nichts ins Netz gesendet.
+
+Beispiele:
+    python -m benchmarks.run --emails 2000 --attachment-kb 256
+    python -m benchmarks.run --latency-ms 300 --rpm 500 --write-baseline baseline.json
+    python -m benchmarks.run --baseline baseline.json --max-regression 0.25
+    python -m benchmarks.run --folders 4 --imap-latency-ms 20
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.fake_imap import FakeIMAPServer
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.mailbox import DEFAULT_MIME_MIX, DEFAULT_REPLY_RATIO, generate_mailbox, parse_mime_mix, split_mailbox
+
+EMAIL_ADDRESS = "benutzer@example.de"
+EMAIL_PASSWORD = "benchmark"
+OPENAI_API_KEY = "sk-benchmark"
+
+SEARCH_QUERIES = [
+    "Wann ist der nächste Termin?",
+    "Welche Rechnungen sind offen?",
+    "Wann kommt meine Bestellung an?",
+    "Wurde mein Urlaub genehmigt?",
+    "Wer hilft beim Vereinsfest?",
+    "von:anna Termin",
+    "RE-2024-1234",
+    "Rechnung letzten Monat",
+]
+
+# Kennzahlen, die bei einem Vergleich mit der Baseline schlechter werden können
+_HIGHER_IS_WORSE = ("p50_ms", "p95_ms", "peak_mb")
+_LOWER_IS_WORSE = ("throughput",)
+
+
+class Stage:
+    """Misst Laufzeiten, verarbeitete Einheiten und den Speicher-Spitzenwert einer Phase."""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.durations = []
+        self.items = 0
+        self.peak_bytes = 0
+
+    def measure(self, fn, items=1):
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = fn()
+        self.durations.append(time.perf_counter() - start)
+        self.peak_bytes = max(self.peak_bytes, tracemalloc.get_traced_memory()[1])
+        self.items += items(result) if callable(items) else items
+        return result
+
+    def report(self):
+        durations = np.array(self.durations) * 1000
+        return {
+            "runs": len(self.durations),
+            "p50_ms": round(float(np.percentile(durations, 50)), 2),
+            "p95_ms": round(float(np.percentile(durations, 95)), 2),
+            "throughput": round(self.items / max(sum(self.durations), 1e-9), 2),
+            "unit": f"{self.unit}/s",
+            "peak_mb": round(self.peak_bytes / 1024 / 1024, 2),
+        }
+
+
+def run(args):
+    # Die App-Module lesen Cache-Verzeichnis, Anbieter und OpenAI-Endpunkt beim Import
+    from streamlit import session_state
+
+    from utils.embedding_providers import get_embedding_provider
+    from utils.faiss_utils import generate_faiss_index
+    from utils.fetch_emails import fetch_emails
+    from utils.hybrid_search import hybrid_search
+    from utils.imap_pool import IMAPConnectionPool
+    from utils.mail_sync import MailboxSync
+    from utils.message_store import MessageStore
+    from utils.embedding_providers import OpenAIEmbeddingProvider
+    from utils.metrics import get_metrics
+    from utils.openai_client import PRIORITY_BULK, request_priority
+    from utils.summarize_emails import llm_query_answer
+
+    session_state.openai_model = args.model
+    stages = {}
+
+    def stage(name, unit):
+        return stages.setdefault(name, Stage(name, unit))
+
+    # Login: neue Verbindung pro Durchlauf, ohne Pool-Wiederverwendung
+    for _ in range(args.iterations):
+        pool = IMAPConnectionPool(keepalive_interval=0)
+
+        def login():
+            with pool.connection(EMAIL_ADDRESS, EMAIL_PASSWORD, args.imap_server):
+                pass
+
+        stage("login", "logins").measure(login)
+        pool.close_all()
+
+    # Listenansicht: eine Seite Header pro Durchlauf über den geteilten Pool
+    for page in range(args.iterations):
+        stage("fetch_emails", "emails").measure(
+            lambda: fetch_emails(EMAIL_ADDRESS, EMAIL_PASSWORD, args.imap_server, page=page, headers_only=True),
+            items=len,
+        )
+
+    # Erster Abgleich aller Ordner in einen leeren Store mit allen Inhalten
+    store = MessageStore(os.path.join(args.cache_dir, "benchmark.sqlite3"))
+    sync = MailboxSync(store, "*", initial_limit=args.emails)
+
+    def initial_sync():
+        new_emails, _, _ = sync.sync(EMAIL_ADDRESS, EMAIL_PASSWORD, args.imap_server)
+        sync.load_bodies(
+            [email_data["uid"] for email_data in new_emails], EMAIL_ADDRESS, EMAIL_PASSWORD, args.imap_server
+        )
+        return new_emails
+
+    stage("sync", "emails").measure(initial_sync, items=len)
+    emails = store.get_headers(store.uids())
+
+    # Index: der erste Durchlauf embeddet alles, die weiteren kommen aus dem Embedding-Cache
+    sync.faiss_index, _ = stage("generate_faiss_index", "emails").measure(
+        lambda: generate_faiss_index(emails, OPENAI_API_KEY), items=len(emails)
+    )
+    if sync.faiss_index is None:
+        raise RuntimeError("Der FAISS-Index konnte nicht erstellt werden.")
+    sync.index_provider = get_embedding_provider(OPENAI_API_KEY).name
+    for _ in range(args.iterations - 1):
+        stage("generate_faiss_index_cached", "emails").measure(
+            lambda: generate_faiss_index(emails, OPENAI_API_KEY), items=len(emails)
+        )
+
+    results = {}
+    for i in range(args.iterations):
+        query = SEARCH_QUERIES[i % len(SEARCH_QUERIES)]
+        results[query], _ = stage("handle_search", "queries").measure(
+            lambda: hybrid_search(query, sync, OPENAI_API_KEY)
+        )
+
+    # Die Anfrage wird pro Durchlauf variiert, damit keine Antwort aus dem Cache kommt
+    for i in range(args.iterations):
+        query = SEARCH_QUERIES[i % len(SEARCH_QUERIES)]
+        stage("llm_query_answer", "answers").measure(
+            lambda: llm_query_answer(f"{query} ({i})", results[query], OPENAI_API_KEY)
+        )
+
+    # Dieselben Antworten, während im Hintergrund embeddet wird wie beim Indexieren
+    stop = threading.Event()
+
+    def bulk_load():
+        provider = OpenAIEmbeddingProvider(OPENAI_API_KEY)
+        texts = [email_data["subject"] for email_data in emails]
+        with request_priority(PRIORITY_BULK):
+            for i in range(10 ** 6):
+                if stop.is_set():
+                    break
+                provider.embed([f"{text} ({i})" for text in texts])
+
+    load = threading.Thread(target=bulk_load, daemon=True)
+    load.start()
+    try:
+        for i in range(args.iterations):
+            query = SEARCH_QUERIES[i % len(SEARCH_QUERIES)]
+            stage("llm_query_answer_under_load", "answers").measure(
+                lambda: llm_query_answer(f"{query} (Last {i})", results[query], OPENAI_API_KEY)
+            )
+    finally:
+        stop.set()
+        load.join()
+
+    return {name: stage.report() for name, stage in stages.items()}, get_metrics().summary()
+
+
+def compare(report, baseline, max_regression):
+    """
+    Vergleicht einen Lauf mit der Baseline.
+
+    Returns:
+    - list: Beschreibungen aller Regressionen.
+    """
+    regressions = []
+    for name, expected in baseline.get("stages", {}).items():
+        actual = report["stages"].get(name)
+        if actual is None:
+            continue
+        for metric in _HIGHER_IS_WORSE:
+            if expected[metric] and actual[metric] > expected[metric] * (1 + max_regression):
+                regressions.append(f"{name}.{metric}: {actual[metric]} > {expected[metric]} (Baseline)")
+        for metric in _LOWER_IS_WORSE:
+            if expected[metric] and actual[metric] < expected[metric] * (1 - max_regression):
+                regressions.append(f"{name}.{metric}: {actual[metric]} < {expected[metric]} (Baseline)")
+    return regressions
+
+
+def _print_report(report):
+    print(f"{'Phase':<28}{'Läufe':>6}{'p50 ms':>10}{'p95 ms':>10}{'Durchsatz':>22}{'Peak MB':>10}")
+    for name, values in report["stages"].items():
+        throughput = f"{values['throughput']} {values['unit']}"
+        print(
+            f"{name:<28}{values['runs']:>6}{values['p50_ms']:>10}{values['p95_ms']:>10}"
+            f"{throughput:>22}{values['peak_mb']:>10}"
+        )
+    print(f"IMAP: {report['imap']}")
+    print(f"OpenAI: {report['openai']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=500, help="Anzahl Nachrichten im Postfach")
+    parser.add_argument(
+        "--mime-mix", type=parse_mime_mix, default=DEFAULT_MIME_MIX,
+        help="Gewichtung der MIME-Strukturen, z.B. plain=4,html=2,alternative=3,attachment=1",
+    )
+    parser.add_argument("--attachment-kb", type=int, default=64, help="Größe der Anhänge in KB")
+    parser.add_argument(
+        "--reply-ratio", type=float, default=DEFAULT_REPLY_RATIO,
+        help="Anteil der Antworten, die den Verlauf zitieren",
+    )
+    parser.add_argument("--folders", type=int, default=1, help="Ordner einschließlich der Inbox")
+    parser.add_argument("--imap-latency-ms", type=float, default=0, help="Latenz des IMAP Servers pro Befehl")
+    parser.add_argument("--iterations", type=int, default=10, help="Durchläufe pro Phase")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Latenz der OpenAI-Attrappe pro Anfrage")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="Schwankung der Latenz")
+    parser.add_argument("--token-latency-ms", type=float, default=0, help="Latenz pro gestreamtem Token")
+    parser.add_argument("--rpm", type=int, default=0, help="Anfragen pro Minute, 0 = unbegrenzt")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens pro Minute, 0 = unbegrenzt")
+    parser.add_argument("--model", default="gpt-4o-mini", help="Chat-Modell für llm_query_answer")
+    parser.add_argument(
+        "--embeddings", default="openai", choices=["openai", "hashing", "sentence-transformers"],
+        help="Embedding-Anbieter (MAIL_BOT_EMBEDDINGS)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Bericht als JSON speichern")
+    parser.add_argument("--baseline", help="Mit diesem Bericht vergleichen und bei Regressionen fehlschlagen")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Erlaubte Verschlechterung (0.2 = 20%%)")
+    parser.add_argument("--write-baseline", help="Bericht als neue Baseline speichern")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Frische Caches, damit jeder Lauf kalt beginnt; utils liest die Umgebung beim Import
+        os.environ["MAIL_BOT_CACHE_DIR"] = cache_dir
+        os.environ["MAIL_BOT_SUMMARY_DISK_CACHE"] = "0"
+        os.environ["MAIL_BOT_EMBEDDINGS"] = args.embeddings
+        # Die App kennt das Kontingent des Schlüssels und teilt es selbst ein
+        os.environ["MAIL_BOT_OPENAI_RPM"] = str(args.rpm)
+        os.environ["MAIL_BOT_OPENAI_TPM"] = str(args.tpm)
+        inbox, folders = split_mailbox(
+            generate_mailbox(args.emails, args.mime_mix, args.attachment_kb, args.seed, args.reply_ratio), args.folders
+        )
+        imap_server = FakeIMAPServer(inbox, folders=folders, latency_ms=args.imap_latency_ms).start()
+        openai_server = FakeOpenAIServer(
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, token_latency_ms=args.token_latency_ms,
+            requests_per_minute=args.rpm, tokens_per_minute=args.tpm, seed=args.seed,
+        ).start()
+        os.environ["OPENAI_BASE_URL"] = openai_server.base_url
+        args.cache_dir = cache_dir
+        args.imap_server = imap_server.address
+
+        tracemalloc.start()
+        try:
+            stages, spans = run(args)
+        finally:
+            tracemalloc.stop()
+            imap_server.stop()
+            openai_server.stop()
+
+    report = {
+        "config": {
+            "emails": args.emails, "mime_mix": args.mime_mix, "attachment_kb": args.attachment_kb,
+            "reply_ratio": args.reply_ratio, "folders": args.folders, "imap_latency_ms": args.imap_latency_ms,
+            "iterations": args.iterations, "latency_ms": args.latency_ms, "rpm": args.rpm, "tpm": args.tpm,
+            "embeddings": args.embeddings,
+        },
+        "stages": stages,
+        "spans": spans,
+        "imap": imap_server.stats,
+        "openai": openai_server.stats,
+    }
+    _print_report(report)
+
+    for path in (args.output, args.write_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print("Regressionen gegenüber der Baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("Keine Regressionen gegenüber der Baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,30 @@
 import streamlit as st
 import openai
 import numpy as np
-from utils.fetch_emails import fetch_emails
-from utils.summarize_emails import summarize_email, llm_query_answer, llm_suggest_email_response
-from utils.faiss_utils import generate_faiss_index, search_faiss_index
+import uuid
+from utils.mail_sync import get_mailbox_sync
+from utils.summarize_emails import summarize_email_stream, llm_query_answer_stream, llm_suggest_email_response_stream
+from utils.faiss_utils import SEARCH_TOP_K
+from utils.hybrid_search import hybrid_search
+from utils.ingestion import STATE_RETRYING
+from utils.email_body import get_email_text
+from utils.fetch_emails import decode_mailbox_name
+from utils.metrics import get_metrics
+from utils.prefetch import (
+    PREFETCH_WAIT_TIMEOUT, PRIORITY_NEXT_PAGE, PRIORITY_VISIBLE, get_prefetch_scheduler, prefetch_summaries,
+    summary_task_key
+)
 
 # App Titel
 st.title("🛩 E-Mail AI Demo ")
 
+def apply_mailbox_sync(sync):
+    """Übernimmt den Abgleich in den Session State, von den E-Mails werden nur die UIDs gehalten."""
+    st.session_state.mailbox_sync = sync
+    st.session_state.email_uids = sync.store.uids()
+    st.session_state.faiss_index = sync.faiss_index
+    st.session_state.email_vectors = sync.store
+
 # Modell-Dialog für API Key und E-Mail Zugangsdaten
 @st.dialog("🔑 Zugangsdaten Eingeben")
 def show_credentials_dialog():
@@ -17,7 +34,7 @@ def show_credentials_dialog():
             openai_api_key = st.secrets["openai_api_key"]
         except:
             openai_api_key = st.text_input("OpenAI API Key", type="password")
-        st.markdown ("Disclaimer: Zugangsdaten funktionieren nur mit web.de Konten. Auch wenn nichts geloggt, gecached oder gespeichert wird, findet die Verarbeitung auf einem Server bei streamlit in der Cloud statt. Bitte keine sensiblen Daten eingeben.")
+        st.markdown ("Disclaimer: Zugangsdaten funktionieren nur mit web.de Konten. Es wird nichts geloggt, lediglich die E-Mails und ihre Embeddings werden zur Beschleunigung auf dem Server zwischengespeichert. Die Verarbeitung findet auf einem Server bei streamlit in der Cloud statt. Bitte keine sensiblen Daten eingeben.")
         email_address = st.text_input("E-Mail-Adresse", placeholder="z.B. benutzer@web.de")
         email_password = st.text_input("Passwort", type="password", placeholder="Dein Passwort")
         submitted = st.form_submit_button("Speichern und Schließen")
@@ -25,49 +42,73 @@ def show_credentials_dialog():
             st.session_state.openai_api_key = openai_api_key
             st.session_state.email_address = email_address
             st.session_state.email_password = email_password
-            with st.spinner("E-Mails werden abgerufen und verarbeitet..."):
+            with st.spinner("E-Mails werden abgerufen..."):
                 try:
-                    st.session_state.emails = fetch_emails(email_address, email_password, "imap.web.de")
+                    sync = get_mailbox_sync(email_address, email_password, "imap.web.de")
+                    # Inhalte und Index werden im Hintergrund verarbeitet, die Liste ist sofort nutzbar
+                    worker = sync.start_ingestion(email_address, email_password, "imap.web.de", openai_api_key)
+                    worker.wait_for_headers()
+                    apply_mailbox_sync(sync)
                     st.session_state.current_page = 0
-                    if st.session_state.emails:
-                        st.session_state.faiss_index, st.session_state.email_vectors = generate_faiss_index(
-                            st.session_state.emails, openai_api_key)
-                        if st.session_state.faiss_index:
-                            st.success("FAISS-Index erfolgreich erstellt.")
-                            st.session_state.show_dialog = False
-                            st.rerun()
+                    if st.session_state.email_uids:
+                        st.session_state.show_dialog = False
+                        st.rerun()
                 except Exception as e:
                     st.error(f"Fehler beim Abrufen der E-Mails: {e}")
                     st.session_state.show_dialog = True
     
 def show_email_details(email_data):
-    message = email_data["message"]
-    content = ""
-    if message.is_multipart():
-        for part in message.walk():
-            content_type = part.get_content_type()
-            try:
-                if content_type == "text/plain":
-                    content = part.get_payload(decode=True).decode()
-                    break
-            except:
-                pass
-    else:
-        content = message.get_payload(decode=True).decode()
-    summary = summarize_email(content, openai_api_key)
+    content = get_email_text(email_data)
+    if content is None:
+        message = st.session_state.mailbox_sync.load_message(
+            email_data["uid"], email_address, email_password, imap_server)
+        content = get_email_text(email_data, message) if message is not None else ""
     st.markdown(f"### 📜 Betreff: {email_data['subject']}")
     st.markdown(f"**Von:** {email_data['sender']}")
-    st.markdown(f"**Zusammenfassung:**\n{summary}")
+    st.markdown(f"**Ordner:** {decode_mailbox_name(email_data['folder'])}")
+    attachments = st.session_state.mailbox_sync.store.get_attachments(email_data["uid"])
+    if attachments:
+        # Anhänge werden nicht geladen, nur ihre Metadaten aus der BODYSTRUCTURE angezeigt
+        st.markdown("**Anhänge:** " + ", ".join(
+            f"{item['filename'] or 'ohne Namen'} ({item['mime_type']}, {item['size'] / 1024:.0f} KB)"
+            for item in attachments
+        ))
+    thread_uids = st.session_state.mailbox_sync.store.thread_uids(email_data.thread)
+    if len(thread_uids) > 1:
+        with st.expander(f"🧵 Verlauf ({len(thread_uids)} E-Mails)"):
+            for thread_email in st.session_state.mailbox_sync.store.get_headers(thread_uids):
+                marker = "➡️ " if thread_email.uid == email_data.uid else ""
+                st.markdown(
+                    f"{marker}{thread_email.date.strftime('%d.%m.%Y %H:%M')} · {thread_email.sender} · "
+                    f"{thread_email.subject}"
+                )
+    st.markdown("**Zusammenfassung:**")
+    model = st.session_state.openai_model
+    scheduler = get_prefetch_scheduler()
+    task_key = summary_task_key(email_data, model, st.session_state.mailbox_sync.store.path)
+    prefetched = scheduler.get(task_key)
+    if prefetched is not None:
+        # Die Aufgabe läuft schon oder ist nach vorne gezogen (toggle_email_details): kurz auf
+        # sie warten statt dieselbe Zusammenfassung ein zweites Mal anzufragen
+        scheduler.promote(task_key)
+        with st.spinner("Zusammenfassung wird erstellt..."):
+            try:
+                prefetched.result(timeout=PREFETCH_WAIT_TIMEOUT)
+            except Exception:
+                # Fehlgeschlagen, verworfen oder hängt (z.B. IMAP oder 429-Pause): die
+                # Zusammenfassung wird direkt gestreamt
+                pass
+    st.write_stream(summarize_email_stream(content, openai_api_key, model=model))
     st.text_area("Inhalt der E-Mail", content, height=300)
 
     col1, col2 = st.columns([2, 1], vertical_alignment="bottom")
     with col1:
         custom_keywords = st.text_input("LLM Antwort support: ", value="", placeholder="Bitte hier Stichworte eingeben")
-        suggested_response = ""
     with col2:
-        if st.button("Vorschlag generieren"):
-            suggested_response = llm_suggest_email_response(custom_keywords, content, openai_api_key)
-    st.markdown(f"**Vorschlag für Antwort:**\n{suggested_response}")
+        generate_response = st.button("Vorschlag generieren")
+    st.markdown("**Vorschlag für Antwort:**")
+    if generate_response:
+        st.write_stream(llm_suggest_email_response_stream(content, custom_keywords, openai_api_key))
 
 # Initialisiere Zugangsdaten
 if "show_dialog" not in st.session_state:
@@ -92,27 +133,31 @@ imap_server = "imap.web.de"
 # Seitenstatus
 if "details_visible" not in st.session_state:
     st.session_state.details_visible = -1
-if "emails" not in st.session_state:
-    st.session_state.emails = []
+if "email_uids" not in st.session_state:
+    st.session_state.email_uids = []
+if "mailbox_sync" not in st.session_state:
+    st.session_state.mailbox_sync = None
 if "current_page" not in st.session_state:
     st.session_state.current_page = 0
 if "faiss_index" not in st.session_state:
     st.session_state.faiss_index = None
 if "email_vectors" not in st.session_state:
-    st.session_state.email_vectors = []
+    st.session_state.email_vectors = None
 if "search_results" not in st.session_state:
     st.session_state.search_results = []
 if "search_active" not in st.session_state:
     st.session_state.search_active = False
 if "last_search_query" not in st.session_state:
     st.session_state.last_search_query = ""
+if "prefetch_owner" not in st.session_state:
+    st.session_state.prefetch_owner = uuid.uuid4().hex
 if "active_tab" not in st.session_state:
     st.session_state.active_tab = "📧 E-Mails"
 
 
 
 
-def toggle_email_details(index, context="main"):
+def toggle_email_details(index, context="main", email_data=None):
     detail_key = f"details_visible_{context}"
     if detail_key not in st.session_state:
         st.session_state[detail_key] = -1
@@ -120,15 +165,22 @@ def toggle_email_details(index, context="main"):
         st.session_state[detail_key] = -1
     else:
         st.session_state[detail_key] = index
+        if email_data is not None:
+            # Die geöffnete E-Mail in der Prefetch-Warteschlange nach vorne ziehen
+            get_prefetch_scheduler().promote(summary_task_key(
+                email_data, st.session_state.openai_model, st.session_state.mailbox_sync.store.path
+            ))
 
 def display_email_list(emails, context="main"):
+    thread_sizes = st.session_state.mailbox_sync.store.thread_sizes([email_data.thread for email_data in emails])
     for i, email_data in enumerate(emails):
         with st.container():
             col1, col2, col3 = st.columns(3)
             with col1:
                 st.markdown(f"**Datum:** {email_data['date'].strftime('%d.%m.%Y')}")
             with col2:
-                st.markdown(f"**Betreff:** {email_data['subject']}")
+                thread_size = thread_sizes.get(email_data.thread, 1)
+                st.markdown(f"**Betreff:** {email_data['subject']}" + (f" 🧵 {thread_size}" if thread_size > 1 else ""))
             with col3:
                 st.markdown(f"**Von:** {email_data['sender']}")
             detail_key = f"details_visible_{context}"
@@ -137,30 +189,60 @@ def display_email_list(emails, context="main"):
                 button_text,
                 key=f"email_{context}_{i}",
                 on_click=toggle_email_details,
-                args=(i, context)
+                args=(i, context, email_data)
             )
             if st.session_state.get(detail_key) == i:
                 show_email_details(email_data)
             st.markdown("---")
 
+def schedule_summary_prefetch(current_page_emails):
+    """Fasst die sichtbare und die nächste Seite im Hintergrund zusammen, sobald sich die Seite ändert."""
+    prefetch_state = (st.session_state.current_page, st.session_state.openai_model, len(st.session_state.email_uids))
+    if st.session_state.get("prefetched_page") == prefetch_state:
+        return
+    st.session_state.prefetched_page = prefetch_state
+    scheduler = get_prefetch_scheduler()
+    owner = st.session_state.prefetch_owner
+    # Noch nicht gestartete Aufgaben der vorherigen Seite verwerfen
+    scheduler.cancel_stale(owner)
+    model = st.session_state.openai_model
+    sync = st.session_state.mailbox_sync
+    # Direkt nach der Anmeldung fehlen die Inhalte noch, die Aufgaben laden sie selbst
+    def load_bodies(uids):
+        sync.load_bodies(uids, email_address, email_password, imap_server)
+
+    account = sync.store.path
+    prefetch_summaries(
+        scheduler, current_page_emails, openai_api_key, model, account, PRIORITY_VISIBLE, owner, load_bodies
+    )
+    next_page_uids = st.session_state.email_uids[
+        (st.session_state.current_page + 1) * 20: (st.session_state.current_page + 2) * 20
+    ]
+    next_page_emails = sync.store.get_headers(next_page_uids)
+    prefetch_summaries(
+        scheduler, next_page_emails, openai_api_key, model, account, PRIORITY_NEXT_PAGE, owner, load_bodies
+    )
+
 def handle_search(query):
     if query and query != st.session_state.last_search_query:
         try:
-            if st.session_state.faiss_index is None:
+            if st.session_state.mailbox_sync is None:
                 st.error("Bitte erst die E-Mails abrufen und den FAISS-Index erstellen.")
                 return False
-            search_results = search_faiss_index(
+            # Stichwort- und Filteranfragen werden lokal ohne API-Aufruf beantwortet
+            search_results, local = hybrid_search(
                 query,
-                st.session_state.faiss_index,
-                st.session_state.email_vectors,
-                st.session_state.openai_api_key
+                st.session_state.mailbox_sync,
+                st.session_state.openai_api_key,
+                top_k=st.session_state.search_top_k
             )
-            llm_search_summary = llm_query_answer(query, search_results, st.session_state.openai_api_key)
             if search_results:
+                # Die LLM Antwort wird beim Anzeigen des Tabs gestreamt, lokale Treffer brauchen keine
                 st.session_state.search_results.append({
                     "query": query,
-                    "results": search_results,
-                    "llm_summary": llm_search_summary
+                    "results": [email_data["uid"] for email_data in search_results],
+                    "llm_summary": "" if local else None,
+                    "local": local
                 })
                 st.session_state.search_active = True
                 st.session_state.last_search_query = query
@@ -185,8 +267,59 @@ def remove_search_tab(tab_title):
         st.session_state.active_tab = "📧 E-Mails"
     st.rerun()
 
+# Postfach inkrementell aktualisieren
+if st.session_state.email_uids and st.sidebar.button("🔄 Postfach aktualisieren"):
+    with st.spinner("Neue E-Mails werden abgerufen..."):
+        try:
+            sync = get_mailbox_sync(email_address, email_password, imap_server)
+            worker = sync.start_ingestion(email_address, email_password, imap_server, openai_api_key)
+            worker.wait_for_headers()
+            apply_mailbox_sync(sync)
+            st.sidebar.success(f"{worker.progress()['new']} neue E-Mail(s) abgerufen.")
+        except Exception as e:
+            st.sidebar.error(f"Fehler beim Aktualisieren: {e}")
+
+@st.fragment(run_every=1)
+def show_ingestion_progress():
+    """Zeigt den Fortschritt des Hintergrund-Abgleichs und lädt die Seite nach dem Ende neu."""
+    sync = st.session_state.mailbox_sync
+    worker = sync.worker if sync is not None else None
+    if worker is None:
+        return
+    progress = worker.progress()
+    if not worker.done:
+        total = max(progress["total"], 1)
+        text = f"E-Mails werden indexiert: {progress['indexed']} von {progress['total']}"
+        if progress["state"] == STATE_RETRYING:
+            text += " (fehlgeschlagene werden erneut versucht)"
+        st.progress(min(progress["indexed"] / total, 1.0), text=text)
+        return
+    if st.session_state.get("ingestion_shown") is not worker:
+        st.session_state.ingestion_shown = worker
+        apply_mailbox_sync(sync)
+        st.rerun()
+    if progress["failed"]:
+        st.warning(
+            f"{progress['failed']} E-Mail(s) konnten nicht indexiert werden und werden beim "
+            f"nächsten Aktualisieren erneut versucht: {progress['error']}"
+        )
+    elif progress["error"]:
+        st.warning(progress["error"])
+
+# Fragmente schreiben nur über einen umschließenden Container in die Seitenleiste
+with st.sidebar:
+    show_ingestion_progress()
+
 # Suchfunktion in der Seitenleiste
 search_query = st.sidebar.text_input("🔍 Suche in E-Mails", placeholder=st.session_state.last_search_query)
+st.sidebar.caption(
+    "Filter: von:NAME, ordner:NAME, seit:TT.MM.JJJJ, bis:TT.MM.JJJJ, gestern, letzte Woche, \"wörtlich\""
+)
+if "search_top_k" not in st.session_state:
+    st.session_state.search_top_k = SEARCH_TOP_K
+st.session_state.search_top_k = st.sidebar.number_input(
+    "Anzahl Treffer", min_value=1, max_value=50, value=st.session_state.search_top_k
+)
 search_button = st.sidebar.button("Suchen")
 
 with st.spinner("Suche wird durchgeführt..."):
@@ -216,6 +349,23 @@ selected_model = st.sidebar.selectbox(
 if selected_model != st.session_state.openai_model:
     st.session_state.openai_model = selected_model
 
+# Messwerte pro Phase (Dauer, Bytes, Tokens, Cache-Treffer) mit Export
+if st.sidebar.checkbox("⏱️ Messwerte anzeigen"):
+    summary = get_metrics().summary()
+    if summary:
+        st.sidebar.dataframe(summary, hide_index=True)
+        st.sidebar.download_button(
+            "Export JSONL", get_metrics().to_jsonl(), file_name="metrics.jsonl", mime="application/jsonl"
+        )
+        st.sidebar.download_button(
+            "Export Prometheus", get_metrics().to_prometheus(), file_name="metrics.prom", mime="text/plain"
+        )
+        if st.sidebar.button("Messwerte zurücksetzen"):
+            get_metrics().reset()
+            st.rerun()
+    else:
+        st.sidebar.caption("Noch keine Messwerte.")
+
 
 
 # Tab-Titel erstellen
@@ -238,11 +388,13 @@ st.session_state.active_tab = selected_tab
 
 # Inhalt basierend auf dem aktiven Tab anzeigen
 if selected_tab == "📧 E-Mails":
-    if st.session_state.emails:
-        total_pages = (len(st.session_state.emails) + 19) // 20
-        current_page_emails = st.session_state.emails[
+    if st.session_state.email_uids:
+        total_pages = (len(st.session_state.email_uids) + 19) // 20
+        current_page_uids = st.session_state.email_uids[
             st.session_state.current_page * 20: (st.session_state.current_page + 1) * 20
         ]
+        current_page_emails = st.session_state.mailbox_sync.store.get_headers(current_page_uids)
+        schedule_summary_prefetch(current_page_emails)
         display_email_list(current_page_emails, "main")
 
         # Navigationsbuttons
@@ -261,5 +413,13 @@ else:
     if st.button("✖️ Tab schließen"):
         remove_search_tab(selected_tab)
     st.markdown("### 🔍 Suchergebnisse")
-    st.markdown(f"LLM Antwort: {result['llm_summary']}")
-    display_email_list(result["results"], f"search_{result['query']}")
\ No newline at end of file
+    result_emails = st.session_state.mailbox_sync.store.get_headers(result["results"])
+    if result.get("local"):
+        st.markdown("Treffer der lokalen Stichwortsuche.")
+    elif result["llm_summary"] is None:
+        st.markdown("LLM Antwort:")
+        result["llm_summary"] = st.write_stream(
+            llm_query_answer_stream(result["query"], result_emails, st.session_state.openai_api_key))
+    else:
+        st.markdown(f"LLM Antwort: {result['llm_summary']}")
+    display_email_list(result_emails, f"search_{result['query']}")
\ No newline at end of file
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Die App-Module lesen Cache-Verzeichnis und Embedding-Anbieter beim Import: frische Caches
+# und der lokale Hashing-Anbieter, damit nichts ins Netz gesendet wird
+os.environ["MAIL_BOT_CACHE_DIR"] = tempfile.mkdtemp(prefix="mail-bot-tests-")
+os.environ["MAIL_BOT_EMBEDDINGS"] = "hashing"
+os.environ["MAIL_BOT_SUMMARY_DISK_CACHE"] = "0"
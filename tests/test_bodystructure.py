@@ -0,0 +1,94 @@
+import base64
+from email import message_from_bytes
+
+from utils.bodystructure import body_parts, build_text_message, decode_part, parse_fetch_response, split_parts
+
+HEADER = (
+    b"From: Anna <anna@example.de>\r\nSubject: Rechnung\r\n"
+    b"Content-Type: multipart/mixed;\r\n boundary=\"b1\"\r\nMIME-Version: 1.0\r\n\r\n"
+)
+# multipart/mixed aus multipart/alternative (Text und HTML) und einem PDF-Anhang
+STRUCTURE = (
+    b'((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "QUOTED-PRINTABLE" 120 4 NIL NIL NIL NIL)'
+    b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 300 10 NIL NIL NIL NIL) "ALTERNATIVE" ("BOUNDARY" "b2") NIL NIL NIL)'
+    b'("APPLICATION" "PDF" ("NAME" "r.pdf") NIL NIL "BASE64" 4000 NIL ("ATTACHMENT" ("FILENAME" "rechnung.pdf")) NIL NIL)'
+    b' "MIXED" ("BOUNDARY" "b1") NIL NIL NIL)'
+)
+
+
+def test_parse_fetch_response_with_literals():
+    msg_data = [
+        (b"1 (UID 7 BODYSTRUCTURE " + STRUCTURE + b" BODY[HEADER] {%d}" % len(HEADER), HEADER),
+        b")",
+        (b'2 (UID 8 FLAGS (\\Seen) BODY[HEADER.FIELDS (SUBJECT)] {9}', b"Subject: "),
+        b")",
+    ]
+    first, second = parse_fetch_response(msg_data)
+    assert first["UID"] == 7
+    assert first["BODY[HEADER]"] == HEADER
+    assert first["BODYSTRUCTURE"][1][5] == "BASE64"
+    assert second["UID"] == 8
+    assert second["FLAGS"] == ["\\Seen"]
+    assert second["BODY[HEADER.FIELDS (SUBJECT)]"] == b"Subject: "
+
+
+def test_body_parts_numbers_nested_multiparts():
+    structure = parse_fetch_response([b"1 (BODYSTRUCTURE " + STRUCTURE + b")"])[0]["BODYSTRUCTURE"]
+    parts = body_parts(structure)
+    assert [(part["part"], part["type"], part["alternative"]) for part in parts] == [
+        ("1.1", "text/plain", "1"), ("1.2", "text/html", "1"), ("2", "application/pdf", None),
+    ]
+    assert parts[0]["encoding"] == "quoted-printable"
+    assert parts[0]["charset"] == "utf-8"
+    assert (parts[2]["filename"], parts[2]["disposition"], parts[2]["size"]) == ("rechnung.pdf", "attachment", 4000)
+
+    texts, attachments = split_parts(parts)
+    # Aus der multipart/alternative bleibt nur text/plain
+    assert [part["part"] for part in texts] == ["1.1"]
+    assert [part["part"] for part in attachments] == ["2"]
+
+
+def test_body_parts_single_part_message():
+    structure = parse_fetch_response(
+        [b'1 (BODYSTRUCTURE ("TEXT" "HTML" ("CHARSET" "iso-8859-1") NIL NIL "8BIT" 12 1 NIL NIL NIL NIL))']
+    )[0]["BODYSTRUCTURE"]
+    parts = body_parts(structure)
+    assert [(part["part"], part["type"], part["charset"], part["alternative"]) for part in parts] == [
+        ("1", "text/html", "iso-8859-1", None),
+    ]
+    assert split_parts(parts) == (parts, [])
+
+
+def test_split_parts_treats_named_text_as_attachment():
+    parts = [
+        {"part": "1", "type": "text/html", "disposition": None, "filename": None, "alternative": None},
+        {"part": "2", "type": "text/plain", "disposition": "attachment", "filename": "notiz.txt", "alternative": None},
+    ]
+    texts, attachments = split_parts(parts)
+    assert [part["part"] for part in texts] == ["1"]
+    assert [part["part"] for part in attachments] == ["2"]
+
+
+def test_decode_part():
+    encoded = base64.encodebytes("Grüße aus Köln".encode("utf-8"))
+    assert decode_part(encoded, "base64", "utf-8") == "Grüße aus Köln"
+    # Abgeschnittene Daten werden auf ganze Gruppen gekürzt
+    assert decode_part(encoded[:-3], "base64", "utf-8").startswith("Grüße")
+    assert decode_part(b"Gr=C3=BC=C3=9Fe=\r\n aus K=C3=B6ln", "quoted-printable", "utf-8") == "Grüße aus Köln"
+    assert decode_part("Grüße".encode("iso-8859-1"), "8bit", "iso-8859-1") == "Grüße"
+    assert decode_part("Grüße".encode("iso-8859-1"), "8bit", "x-unbekannt") == "Grüße"
+
+
+def test_build_text_message_replaces_content_headers():
+    raw = build_text_message(HEADER, [("plain", "Grüße"), ("html", "<p>Hallo</p>")])
+    message = message_from_bytes(raw)
+    assert message["Subject"] == "Rechnung"
+    assert message.get_content_type() == "multipart/mixed"
+    assert message.get_boundary() != "b1"
+    parts = [part for part in message.walk() if not part.is_multipart()]
+    assert [part.get_content_type() for part in parts] == ["text/plain", "text/html"]
+    assert parts[0].get_payload(decode=True).decode("utf-8") == "Grüße"
+
+    single = message_from_bytes(build_text_message(HEADER, [("plain", "Hallo")]))
+    assert single.get_content_type() == "text/plain"
+    assert single.get_payload() == "Hallo"
@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+from email.message import EmailMessage
+
+from utils.email_body import get_email_text, strip_quotes_and_signature
+from utils.message_store import MessageStore
+
+
+def _store(tmp_path, name, text=None):
+    store = MessageStore(str(tmp_path / f"{name}.sqlite3"))
+    store.add_headers([{
+        "uid": 1, "message_id": "<gleich@example.de>", "subject": "Hallo", "sender": "a@example.de",
+        "date": datetime(2024, 1, 1, tzinfo=timezone.utc), "size": 1, "flags": (), "folder": "INBOX",
+    }])
+    if text is not None:
+        _put_body(store, text)
+    return store
+
+
+def _put_body(store, text):
+    message = EmailMessage()
+    message["Message-ID"] = "<gleich@example.de>"
+    message.set_content(text)
+    store.put_raw_messages({1: message.as_bytes()})
+
+
+def test_text_cache_is_not_shared_by_message_id(tmp_path):
+    first = _store(tmp_path, "konto1", "Text von Konto eins")
+    second = _store(tmp_path, "konto2", "Text von Konto zwei")
+    assert get_email_text(first[1]).strip() == "Text von Konto eins"
+    assert get_email_text(second[1]).strip() == "Text von Konto zwei"
+
+
+def test_text_is_loaded_once_the_body_arrives(tmp_path):
+    store = _store(tmp_path, "konto")
+    assert get_email_text(store[1]) is None
+    _put_body(store, "Jetzt mit Inhalt")
+    assert get_email_text(store[1]).strip() == "Jetzt mit Inhalt"
+
+
+def test_strip_quotes_and_signature():
+    text = "Passt mir gut.\n\nViele Grüße\nAnna\n\nAm 01.01.2024 schrieb Bob:\n> Passt es dir?"
+    assert strip_quotes_and_signature(text) == "Passt mir gut."
+    assert strip_quotes_and_signature("> nur ein Zitat") == "> nur ein Zitat"
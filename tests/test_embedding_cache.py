@@ -0,0 +1,61 @@
+import multiprocessing
+
+import numpy as np
+
+from utils.embedding_cache import EmbeddingCache
+
+DIMENSION = 8
+
+
+def _vector(key):
+    return np.full(DIMENSION, sum(map(ord, key)), dtype=np.float32)
+
+
+def _put(directory, prefix, batches=30):
+    cache = EmbeddingCache(directory, "test-model")
+    for batch in range(batches):
+        keys = [f"{prefix}-{batch}-{i}" for i in range(5)] + [f"gemeinsam-{batch}"]
+        cache.put_many(keys, np.array([_vector(key) for key in keys]))
+
+
+def _assert_consistent(directory):
+    cache = EmbeddingCache(directory, "test-model")
+    keys = list(cache._rows)
+    hits, misses = cache.get_many(keys)
+    assert not misses
+    for i, key in enumerate(keys):
+        np.testing.assert_array_equal(hits[i], _vector(key))
+    return cache
+
+
+def test_two_instances_append_in_turn(tmp_path):
+    first = EmbeddingCache(str(tmp_path), "test-model")
+    second = EmbeddingCache(str(tmp_path), "test-model")
+    first.put_many(["a", "b"], np.array([_vector("a"), _vector("b")]))
+    second.put_many(["b", "c"], np.array([_vector("b"), _vector("c")]))
+    first.put_many(["d"], np.array([_vector("d")]))
+    assert len(_assert_consistent(str(tmp_path))) == 4
+
+
+def test_processes_append_concurrently(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_put, args=(str(tmp_path), name)) for name in ("eins", "zwei")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert len(_assert_consistent(str(tmp_path))) == 2 * 30 * 5 + 30
+
+
+def test_interrupted_write_is_truncated_to_complete_rows(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "test-model")
+    cache.put_many(["a", "b"], np.array([_vector("a"), _vector("b")]))
+    # Abbruch: ein Vektor ohne Schlüssel und ein halber Schlüssel ohne Vektor
+    with open(cache.vectors_path, "ab") as f:
+        f.write(_vector("c").tobytes()[:20])
+    with open(cache.keys_path, "a", encoding="ascii") as f:
+        f.write("c\nd")
+    reopened = _assert_consistent(str(tmp_path))
+    assert len(reopened) == 2
+    reopened.put_many(["e"], np.array([_vector("e")]))
+    assert len(_assert_consistent(str(tmp_path))) == 3
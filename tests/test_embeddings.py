@@ -0,0 +1,12 @@
+from utils.embeddings import build_batches
+
+
+def test_build_batches_respects_token_and_input_limits():
+    assert build_batches([40, 30, 30, 50, 10], max_batch_tokens=100, max_batch_inputs=10) == [[0, 1, 2], [3, 4]]
+    assert build_batches([1] * 5, max_batch_tokens=100, max_batch_inputs=2) == [[0, 1], [2, 3], [4]]
+
+
+def test_build_batches_keeps_oversized_text_alone():
+    # Ein Text über dem Limit bekommt einen eigenen Batch, statt verloren zu gehen
+    assert build_batches([10, 150, 10], max_batch_tokens=100) == [[0], [1], [2]]
+    assert build_batches([]) == []
@@ -0,0 +1,48 @@
+import faiss
+import numpy as np
+import pytest
+
+from utils import faiss_utils
+from utils.faiss_utils import INDEX_FLAT, INDEX_HNSW, _create_index, _filtered_search
+
+
+def _index(index_type, count=500, dimension=32):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((count, dimension)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    # UIDs wie im MessageStore: Ordner in den oberen 32 Bit
+    uids = (np.int64(3) << 32) | np.arange(1, count + 1, dtype=np.int64)
+    faiss_index = _create_index(index_type, vectors)
+    faiss_index.add_with_ids(vectors, uids)
+    query = rng.standard_normal((1, dimension)).astype(np.float32)
+    faiss.normalize_L2(query)
+    return faiss_index, vectors, uids, query
+
+
+def _exact(vectors, uids, query, allowed_uids, top_k):
+    allowed = np.isin(uids, list(allowed_uids))
+    scores = vectors[allowed] @ query[0]
+    return list(uids[allowed][np.argsort(-scores)[:top_k]])
+
+
+@pytest.mark.parametrize("index_type", [INDEX_FLAT, INDEX_HNSW])
+def test_filtered_search_matches_brute_force(index_type):
+    faiss_index, vectors, uids, query = _index(index_type)
+    allowed_uids = set(uids[::7].tolist()) | {(3 << 32) | 100_000}
+    found = _filtered_search(faiss_index, query, 5, allowed_uids)
+    assert list(found[0]) == _exact(vectors, uids, query, allowed_uids, 5)
+
+
+def test_filtered_search_hnsw_with_selector(monkeypatch):
+    # Große Filter laufen über den IDSelector im HNSW-Graphen
+    monkeypatch.setattr(faiss_utils, "FILTERED_EXACT_MAX", 0)
+    faiss_index, vectors, uids, query = _index(INDEX_HNSW)
+    allowed_uids = set(uids[::2].tolist())
+    found = [uid for uid in _filtered_search(faiss_index, query, 5, allowed_uids)[0] if uid != -1]
+    assert set(found) <= allowed_uids
+    assert found[0] == _exact(vectors, uids, query, allowed_uids, 1)[0]
+
+
+def test_filtered_search_without_indexed_uids():
+    faiss_index, _, _, query = _index(INDEX_HNSW, count=50)
+    assert list(_filtered_search(faiss_index, query, 3, {42})[0]) == [-1, -1, -1]
@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+from email import message_from_bytes
+from email.message import EmailMessage
+
+import pytest
+
+from benchmarks.fake_imap import FakeIMAPServer
+from utils.email_body import extract_text
+from utils.fetch_emails import decode_mailbox_name, fetch_text_messages_by_uid, parse_list_response
+from utils.imap_pool import IMAPConnectionPool
+
+
+@pytest.fixture
+def long_message():
+    # Länger als ein Teil, den ein partieller FETCH früher geladen hat, mit Umlauten am Ende
+    text = "Sehr lange Nachricht. " * 5000 + "Schluss mit Grüßen aus Köln."
+    message = EmailMessage()
+    message["Subject"] = "Protokoll"
+    message["From"] = "anna.mueller@example.de"
+    message["Message-ID"] = "<lang@example.de>"
+    message.set_content(text, cte="quoted-printable")
+    message.add_attachment(b"%PDF" * 1000, maintype="application", subtype="pdf", filename="protokoll.pdf")
+    return text, message.as_bytes()
+
+
+def test_fetch_text_messages_loads_complete_text_parts(long_message):
+    text, raw = long_message
+    server = FakeIMAPServer([(1, (), datetime(2024, 1, 1, tzinfo=timezone.utc), raw)]).start()
+    pool = IMAPConnectionPool(keepalive_interval=0)
+    try:
+        with pool.connection("benutzer@example.de", "test", server.address) as mail:
+            mail.select("INBOX", readonly=True)
+            messages, attachments = fetch_text_messages_by_uid(mail, [1])
+    finally:
+        pool.close_all()
+        server.stop()
+    assert extract_text(message_from_bytes(messages[1])).strip() == text
+    # Anhänge werden nicht geladen, nur ihre Metadaten
+    assert [(item["filename"], item["mime_type"]) for item in attachments[1]] == [("protokoll.pdf", "application/pdf")]
+
+
+def test_parse_list_response():
+    msg_data = [
+        (
+            b'3 (UID 17 FLAGS (\\Seen \\Flagged) INTERNALDATE "14-Mar-2024 09:15:00 +0100" RFC822.SIZE 2048 '
+            b"BODY[HEADER.FIELDS (SUBJECT FROM DATE MESSAGE-ID IN-REPLY-TO REFERENCES)] {155}",
+            b"Subject: =?utf-8?q?Gr=C3=BC=C3=9Fe?=\r\nFrom: Anna <anna@example.de>\r\n"
+            b"Message-ID: <b@example.de>\r\nReferences: <a@example.de>\r\nIn-Reply-To: <a@example.de>\r\n\r\n",
+        ),
+        b")",
+    ]
+    [email_data] = parse_list_response(msg_data)
+    assert email_data["uid"] == 17
+    assert email_data["flags"] == ("\\Seen", "\\Flagged")
+    assert email_data["size"] == 2048
+    assert email_data["subject"] == "Grüße"
+    assert email_data["sender"] == "Anna <anna@example.de>"
+    assert email_data["references"] == ["<a@example.de>"]
+    assert email_data["in_reply_to"] == ["<a@example.de>"]
+    # Ohne Date-Header gilt INTERNALDATE
+    assert email_data["date"] == datetime(2024, 3, 14, 8, 15, tzinfo=timezone.utc)
+    assert email_data["message"] is None
+
+
+def test_decode_mailbox_name():
+    assert decode_mailbox_name("INBOX") == "INBOX"
+    assert decode_mailbox_name("Entw&APw-rfe") == "Entwürfe"
+    assert decode_mailbox_name("Ablage/&AMQ-rger/Gel&APY-scht") == "Ablage/Ärger/Gelöscht"
+    assert decode_mailbox_name("Tom &- Jerry") == "Tom & Jerry"
+    assert decode_mailbox_name("&ZeVnLIqe-") == "日本語"
+    # "," steht in modifiziertem UTF-7 für "/"
+    assert decode_mailbox_name("&,38-") == "\uff7f"
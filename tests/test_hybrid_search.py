@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+
+from utils.hybrid_search import parse_query, reciprocal_rank_fusion
+
+# Donnerstag, 14. März 2024
+NOW = datetime(2024, 3, 14, 15, 30, tzinfo=timezone.utc)
+
+
+def _day(year, month, day):
+    return datetime(year, month, day, tzinfo=timezone.utc)
+
+
+def test_parse_query_filters():
+    parsed = parse_query('von:"Max Mustermann" ordner:Archiv Rechnung Strom', NOW)
+    assert parsed.sender == "Max Mustermann"
+    assert parsed.folder == "Archiv"
+    assert parsed.text == "Rechnung Strom"
+    assert not parsed.exact
+    assert parsed.has_filters
+    assert not parsed.is_keyword_query
+
+
+def test_parse_query_absolute_dates_include_until_day():
+    parsed = parse_query("seit:01.03.2024 bis:2024-03-10 Angebot", NOW)
+    assert parsed.since == datetime(2024, 3, 1).astimezone()
+    assert parsed.until == datetime(2024, 3, 11).astimezone()
+    assert parsed.text == "Angebot"
+
+
+def test_parse_query_keeps_invalid_date_in_text():
+    parsed = parse_query("seit:morgen Angebot", NOW)
+    assert parsed.since is None
+    assert parsed.text == "seit:morgen Angebot"
+
+
+def test_parse_query_relative_dates():
+    assert (parse_query("gestern", NOW).since, parse_query("gestern", NOW).until) == (
+        _day(2024, 3, 13), _day(2024, 3, 14)
+    )
+    last_week = parse_query("Protokoll letzte Woche", NOW)
+    assert (last_week.since, last_week.until) == (_day(2024, 3, 4), _day(2024, 3, 11))
+    assert last_week.text == "Protokoll"
+    last_month = parse_query("last month invoice", NOW)
+    assert (last_month.since, last_month.until) == (_day(2024, 2, 1), _day(2024, 3, 1))
+    this_week = parse_query("diese Woche", NOW)
+    assert (this_week.since, this_week.until) == (_day(2024, 3, 11), None)
+    assert this_week.text == ""
+
+
+def test_parse_query_exact_and_identifier_queries():
+    parsed = parse_query('in:INBOX "RE-2024-0815"', NOW)
+    assert parsed.folder == "INBOX"
+    assert parsed.exact
+    assert parsed.text == "RE-2024-0815"
+    assert parse_query("RE-2024-0815 max@example.de", NOW).is_keyword_query
+
+
+def test_reciprocal_rank_fusion_prefers_hits_in_both_rankings():
+    assert reciprocal_rank_fusion([[1, 2, 3], [3, 4]]) == [3, 1, 4, 2]
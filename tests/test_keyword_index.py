@@ -0,0 +1,54 @@
+from email.message import EmailMessage
+
+from utils.keyword_index import KeywordIndex, tokenize
+
+
+def _email(uid, subject, text=None, sender="info@example.de"):
+    message = None
+    if text is not None:
+        message = EmailMessage()
+        message.set_content(text)
+    return {"uid": uid, "subject": subject, "sender": sender, "message": message}
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("Rechnung RE-2024-0815 an Max@Example.de.") == [
+        "rechnung", "re-2024-0815", "re", "2024", "0815", "an", "max@example.de", "max", "example", "de",
+    ]
+
+
+def test_search_ranks_rare_terms_and_subject_higher():
+    index = KeywordIndex()
+    index.add([
+        _email(1, "Rechnung März", "Ihre Rechnung für den Strom."),
+        _email(2, "Newsletter", "Neuigkeiten und eine Rechnung im Anhang."),
+        _email(3, "Termin", "Treffen am Montag zum Strom-Tarif."),
+    ])
+    assert len(index) == 3
+    # "rechnung" steht bei 1 im Betreff und zählt dort stärker
+    assert [uid for uid, _ in index.search("rechnung")] == [1, 2]
+    # 1 enthält beide Begriffe
+    assert [uid for uid, _ in index.search("rechnung strom")][0] == 1
+    assert [uid for uid, _ in index.search("strom", allowed_uids={2, 3})] == [3]
+    assert index.search("unbekannt") == []
+
+
+def test_add_replaces_and_remove_deletes_document():
+    index = KeywordIndex()
+    index.add([_email(1, "Angebot"), _email(2, "Angebot Küche")])
+    # Ohne Inhalt nur Betreff und Absender, nach dem Laden auch der Text
+    assert index.search("montage") == []
+    index.add([_email(1, "Angebot", "Die Montage erfolgt am Freitag.")])
+    assert len(index) == 2
+    assert [uid for uid, _ in index.search("montage")] == [1]
+    assert "freitag" in index.terms(1)
+
+    index.remove([1])
+    assert len(index) == 1
+    assert index.search("montage") == []
+    assert index.terms(1) == set()
+    assert [uid for uid, _ in index.search("angebot")] == [2]
+    index.remove([2, 99])
+    assert len(index) == 0
+    assert index.search("angebot") == []
+    assert not index._postings and index._total_length == 0
@@ -0,0 +1,130 @@
+import os
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+
+import pytest
+
+from benchmarks.fake_imap import FakeIMAPServer
+from utils.mail_sync import FolderSync, MailboxSync
+from utils.message_store import MessageStore
+
+EMAIL_ADDRESS = "benutzer@example.de"
+EMAIL_PASSWORD = "test"
+
+
+def _message(uid, subject, text):
+    date = datetime(2024, 3, uid, 9, tzinfo=timezone.utc)
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = "Anna Müller <anna.mueller@example.de>"
+    message["To"] = EMAIL_ADDRESS
+    message["Date"] = format_datetime(date)
+    message["Message-ID"] = make_msgid(domain="test.example")
+    message.set_content(text)
+    return uid, (), date, message.as_bytes()
+
+
+@pytest.fixture
+def imap_server():
+    server = FakeIMAPServer([_message(1, "Lieferung", "Der Zebrafisch kommt morgen im Aquarium an.")]).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def sync(tmp_path):
+    return MailboxSync(MessageStore(str(tmp_path / "store.sqlite3")))
+
+
+def _keyword_uids(sync, query):
+    return [uid for uid, _ in sync.keyword_index.search(query)]
+
+
+def test_keyword_index_contains_bodies_after_ingestion(sync, imap_server):
+    # Der Stichwort-Index existiert schon vor dem Abgleich, z.B. nach einer ersten Suche
+    assert _keyword_uids(sync, "zebrafisch") == []
+    sync.refresh(EMAIL_ADDRESS, EMAIL_PASSWORD, imap_server.address, "")
+    assert _keyword_uids(sync, "zebrafisch") == [1]
+
+
+def test_keyword_index_contains_bodies_of_refreshed_emails(sync, imap_server):
+    sync.refresh(EMAIL_ADDRESS, EMAIL_PASSWORD, imap_server.address, "")
+    assert _keyword_uids(sync, "giraffe") == []
+    inbox = imap_server.mailbox("INBOX")
+    with inbox.lock:
+        inbox.messages.append(_message(2, "Zoo", "Die Giraffe hat ein neues Gehege bekommen."))
+    assert sync.refresh(EMAIL_ADDRESS, EMAIL_PASSWORD, imap_server.address, "") == 1
+    assert _keyword_uids(sync, "giraffe") == [2]
+    assert _keyword_uids(sync, "zebrafisch") == [1]
+
+
+def test_unchanged_index_is_not_rewritten(tmp_path, imap_server):
+    store = MessageStore(str(tmp_path / "store.sqlite3"))
+    index_path = str(tmp_path / "store.faiss")
+    MailboxSync(store, index_path=index_path).refresh(EMAIL_ADDRESS, EMAIL_PASSWORD, imap_server.address, "")
+    written = os.stat(index_path).st_ino
+
+    # Neu gestartet, per Memory-Map geladen und ohne Änderungen abgeglichen: nur die Metadaten
+    sync = MailboxSync(store, index_path=index_path)
+    assert sync.faiss_index is not None
+    assert sync.refresh(EMAIL_ADDRESS, EMAIL_PASSWORD, imap_server.address, "") == 0
+    assert os.stat(index_path).st_ino == written
+    assert MailboxSync(store, index_path=index_path).faiss_index is not None
+
+    inbox = imap_server.mailbox("INBOX")
+    with inbox.lock:
+        inbox.messages.append(_message(2, "Zoo", "Die Giraffe hat ein neues Gehege bekommen."))
+    assert sync.refresh(EMAIL_ADDRESS, EMAIL_PASSWORD, imap_server.address, "") == 1
+    assert os.stat(index_path).st_ino != written
+    assert MailboxSync(store, index_path=index_path).faiss_index.ntotal == 2
+
+
+class ScriptedMail:
+    """IMAP-Verbindung mit festem Ordnerstand (CONDSTORE), merkt sich die UID-Befehle."""
+
+    def __init__(self, uids, highestmodseq, changed_flags=()):
+        self.uids = uids
+        self.highestmodseq = highestmodseq
+        self.changed_flags = changed_flags
+        self.commands = []
+
+    def select(self, mailbox, readonly=False):
+        return "OK", [str(len(self.uids)).encode()]
+
+    def response(self, code):
+        return code, [str({"UIDVALIDITY": 7, "HIGHESTMODSEQ": self.highestmodseq}[code]).encode()]
+
+    def uid(self, command, *args):
+        self.commands.append(command)
+        if command == "SEARCH":
+            return "OK", [" ".join(str(uid) for uid in self.uids).encode()]
+        if command == "FETCH" and args[1] == "(UID FLAGS)":
+            return "OK", [f"{uid} (UID {uid} FLAGS ({flags}))".encode() for uid, flags in self.changed_flags]
+        return "OK", [None]
+
+
+@pytest.fixture
+def folder_sync(tmp_path):
+    store = MessageStore(str(tmp_path / "store.sqlite3"))
+    store.add_headers([{
+        "uid": uid, "message_id": f"<{uid}@example.de>", "subject": "Hallo", "sender": "a@example.de",
+        "date": datetime(2024, 1, uid, tzinfo=timezone.utc), "size": 1, "flags": (), "folder": "INBOX",
+    } for uid in (1, 2, 3)])
+    folder_sync = FolderSync(store, "INBOX")
+    folder_sync.uidvalidity, folder_sync.last_uid, folder_sync.exists, folder_sync.highestmodseq = 7, 3, 3, 10
+    return folder_sync
+
+
+def test_flag_changes_do_not_search_all_uids(folder_sync):
+    mail = ScriptedMail([1, 2, 3], 11, changed_flags=[(2, "\\Seen")])
+    assert folder_sync.sync(mail) == ([], [], [2])
+    assert "SEARCH" not in mail.commands
+    assert folder_sync.store[2]["flags"] == ("\\Seen",)
+
+
+def test_expunge_is_detected_from_the_message_count(folder_sync):
+    mail = ScriptedMail([1, 3], 11)
+    assert folder_sync.sync(mail) == ([], [2], [])
+    assert "SEARCH" in mail.commands
+    assert folder_sync.store.uids() == [3, 1]
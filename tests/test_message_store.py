@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta, timezone
+
+from utils.message_store import MessageStore
+
+BERLIN = timezone(timedelta(hours=1))
+
+
+def _store(tmp_path):
+    store = MessageStore(str(tmp_path / "store.sqlite3"))
+    store.add_headers([
+        {"uid": uid, "message_id": f"<{uid}@example.de>", "subject": "Hallo", "sender": sender, "date": date,
+         "size": 1, "flags": (), "folder": folder}
+        for uid, sender, date, folder in (
+            (1, "Anna <anna@example.de>", datetime(2024, 3, 1, 8, tzinfo=timezone.utc), "INBOX"),
+            # 00:30 in Berlin ist noch der 29. Februar in UTC
+            (2, "Bernd <bernd@example.de>", datetime(2024, 3, 1, 0, 30, tzinfo=BERLIN), "INBOX"),
+            (3, "Anna <anna@example.de>", datetime(2024, 3, 5, 12, tzinfo=BERLIN), "Archiv"),
+            (4, "100%_rabatt@shop.de", datetime(2024, 3, 10, tzinfo=timezone.utc), "INBOX"),
+        )
+    ])
+    return store
+
+
+def test_filter_uids_compares_dates_across_time_zones(tmp_path):
+    store = _store(tmp_path)
+    march = datetime(2024, 3, 1, tzinfo=timezone.utc)
+    assert store.filter_uids(since=march) == {1, 3, 4}
+    assert store.filter_uids(until=march) == {2}
+    assert store.filter_uids(since=march, until=datetime(2024, 3, 10, tzinfo=timezone.utc)) == {1, 3}
+    assert store.filter_uids() == {1, 2, 3, 4}
+
+
+def test_filter_uids_combines_date_sender_and_folder(tmp_path):
+    store = _store(tmp_path)
+    assert store.filter_uids(sender="ANNA") == {1, 3}
+    assert store.filter_uids(sender="anna", folder="archiv") == {3}
+    assert store.filter_uids(sender="anna", until=datetime(2024, 3, 2, tzinfo=timezone.utc)) == {1}
+    # % und _ gelten als Zeichen, nicht als Platzhalter
+    assert store.filter_uids(sender="100%_") == {4}
+    assert store.filter_uids(sender="0%r") == set()
+
+
+def test_filter_uids_uses_timestamp_index(tmp_path):
+    store = _store(tmp_path)
+    statements = []
+    store._db.set_trace_callback(statements.append)
+    store.filter_uids(since=datetime(2024, 3, 1, tzinfo=timezone.utc), until=datetime(2024, 3, 2, tzinfo=timezone.utc))
+    store._db.set_trace_callback(None)
+    # Das Datum wird in SQL gefiltert, nicht pro Zeile in Python
+    [statement] = statements
+    plan = " ".join(row[-1] for row in store._db.execute(f"EXPLAIN QUERY PLAN {statement}"))
+    assert "headers_timestamp" in plan
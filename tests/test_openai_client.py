@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils.openai_client import PRIORITY_BULK, RequestScheduler
+
+
+def _chunks(used_tokens):
+    yield SimpleNamespace(usage=None, content="Hallo")
+    yield SimpleNamespace(usage=None, content=" Welt")
+    yield SimpleNamespace(usage=SimpleNamespace(total_tokens=used_tokens), content=None)
+
+
+def test_stream_holds_slot_until_fully_read():
+    scheduler = RequestScheduler(tokens_per_minute=10_000, max_bulk_in_flight=1)
+    stream = scheduler.run(lambda: _chunks(100), tokens=1000, priority=PRIORITY_BULK, stream=True)
+    assert scheduler._bulk_in_flight == 1
+    chunks = iter(stream)
+    next(chunks)
+    # Während gelesen wird, darf keine weitere Hintergrundanfrage starten
+    assert scheduler._wait_time({"requests": 1, "tokens": 1}, PRIORITY_BULK, 0) is None
+    assert [chunk.content for chunk in chunks] == [" Welt", None]
+    assert scheduler._bulk_in_flight == 0
+    # Verrechnet wird die Nutzung aus dem letzten Chunk statt der Schätzung
+    assert scheduler._available["tokens"] == pytest.approx(10_000 - 100, abs=5)
+
+
+def test_closed_stream_releases_slot_once():
+    scheduler = RequestScheduler(tokens_per_minute=10_000, max_bulk_in_flight=1)
+    chunks = _chunks(100)
+    with scheduler.run(lambda: chunks, tokens=1000, priority=PRIORITY_BULK, stream=True) as stream:
+        next(iter(stream))
+    stream.close()
+    assert scheduler._bulk_in_flight == 0
+    # Ohne Nutzungsangabe bleibt die Schätzung gebucht
+    assert scheduler._available["tokens"] == pytest.approx(10_000 - 1000, abs=5)
+    # Der zugrunde liegende Stream wurde geschlossen
+    assert next(chunks, None) is None
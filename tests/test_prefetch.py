@@ -0,0 +1,82 @@
+import threading
+from datetime import datetime, timezone
+from email.message import EmailMessage
+
+import pytest
+
+from utils import prefetch
+from utils.message_store import MessageStore
+from utils.prefetch import PRIORITY_NEXT_PAGE, PRIORITY_VISIBLE, PrefetchScheduler, prefetch_summaries, summary_task_key
+
+
+@pytest.fixture
+def scheduler():
+    # Ohne Worker: die Tests holen die Futures, bevor die Aufgaben laufen
+    return PrefetchScheduler(max_workers=0)
+
+
+def _start_worker(scheduler):
+    threading.Thread(target=scheduler._worker, daemon=True).start()
+
+
+def test_promoted_task_runs_first(scheduler):
+    order = []
+    first = scheduler.submit("sichtbar", lambda: order.append("sichtbar"), PRIORITY_VISIBLE)
+    second = scheduler.submit("geklickt", lambda: order.append("geklickt"), PRIORITY_NEXT_PAGE)
+    scheduler.promote("geklickt")
+    _start_worker(scheduler)
+    first.result(timeout=5)
+    second.result(timeout=5)
+    assert order == ["geklickt", "sichtbar"]
+
+
+def test_prefetch_loads_missing_bodies_once(tmp_path, scheduler, monkeypatch):
+    monkeypatch.setattr(prefetch, "summarize_email", lambda content, key, model: f"Kurz: {content.strip()}")
+    store = MessageStore(str(tmp_path / "store.sqlite3"))
+    store.add_headers([{
+        "uid": uid, "message_id": f"<{uid}@example.de>", "subject": "Hallo", "sender": "a@example.de",
+        "date": datetime(2024, 1, uid, tzinfo=timezone.utc), "size": 1, "flags": (), "folder": "INBOX",
+    } for uid in (1, 2, 3)])
+    calls = []
+
+    def load_bodies(uids):
+        calls.append(uids)
+        raw_messages = {}
+        for uid in uids:
+            message = EmailMessage()
+            message.set_content(f"Text {uid}")
+            raw_messages[uid] = message.as_bytes()
+        store.put_raw_messages(raw_messages)
+
+    emails = store.get_headers([1, 2, 3])
+    prefetch_summaries(scheduler, emails, "sk-test", "gpt-4o-mini", store.path, load_bodies=load_bodies)
+    futures = [scheduler.get(summary_task_key(email_data, "gpt-4o-mini", store.path)) for email_data in emails]
+    _start_worker(scheduler)
+    _start_worker(scheduler)
+    assert [future.result(timeout=5) for future in futures] == ["Kurz: Text 1", "Kurz: Text 2", "Kurz: Text 3"]
+    assert calls == [[1, 2, 3]]
+
+
+def test_prefetch_tasks_are_separate_per_account(tmp_path, scheduler, monkeypatch):
+    monkeypatch.setattr(prefetch, "summarize_email", lambda content, key, model: f"{key}: {content.strip()}")
+    stores = []
+    for name in ("konto1", "konto2"):
+        store = MessageStore(str(tmp_path / f"{name}.sqlite3"))
+        # Gleiche UID ohne Message-ID in beiden Konten
+        store.add_headers([{
+            "uid": 7, "message_id": None, "subject": "Hallo", "sender": "a@example.de",
+            "date": datetime(2024, 1, 1, tzinfo=timezone.utc), "size": 1, "flags": (), "folder": "INBOX",
+        }])
+        message = EmailMessage()
+        message.set_content(f"Text von {name}")
+        store.put_raw_messages({7: message.as_bytes()})
+        stores.append(store)
+
+    for store, openai_api_key in zip(stores, ("sk-eins", "sk-zwei")):
+        prefetch_summaries(scheduler, store.get_headers([7]), openai_api_key, "gpt-4o-mini", store.path, owner=store.path)
+    # Blättern im ersten Konto verwirft nicht die Aufgabe des zweiten
+    scheduler.cancel_stale(stores[0].path)
+    future = scheduler.get(summary_task_key(stores[1][7], "gpt-4o-mini", stores[1].path))
+    assert scheduler.get(summary_task_key(stores[0][7], "gpt-4o-mini", stores[0].path)) is None
+    _start_worker(scheduler)
+    assert future.result(timeout=5) == "sk-zwei: Text von konto2"
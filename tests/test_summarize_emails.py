@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from utils import summarize_emails
+from utils.message_store import MessageStore
+from utils.summarize_emails import _query_cache_key, llm_query_answer, llm_query_answer_stream
+from utils.summary_cache import get_summary_cache
+
+DATE = datetime(2024, 3, 1, tzinfo=timezone.utc)
+HITS = [
+    {"uid": 1, "message_id": "<1@example.de>", "subject": "Rechnung", "sender": "a@example.de", "date": DATE,
+     "body_hash": "a"},
+    {"uid": 2, "message_id": "<2@example.de>", "subject": "Mahnung", "sender": "b@example.de", "date": DATE,
+     "body_hash": "b"},
+]
+
+
+@pytest.fixture(autouse=True)
+def no_context(monkeypatch):
+    monkeypatch.setattr(summarize_emails, "get_openai_model", lambda: "gpt-4o-mini")
+
+    def build_search_context(*args, **kwargs):
+        raise AssertionError("Der Kontext darf bei einem Cache-Treffer nicht aufgebaut werden")
+
+    monkeypatch.setattr(summarize_emails, "build_search_context", build_search_context)
+
+
+def test_query_cache_key_depends_on_hits_and_content():
+    key = _query_cache_key("Rechnung", HITS, "gpt-4o-mini")
+    assert key == _query_cache_key("Rechnung", [dict(hit) for hit in HITS], "gpt-4o-mini")
+    assert key != _query_cache_key("Rechnung", HITS[::-1], "gpt-4o-mini")
+    assert key != _query_cache_key("Rechnung", [HITS[0], dict(HITS[1], body_hash=None)], "gpt-4o-mini")
+    assert key != _query_cache_key("Termin", HITS, "gpt-4o-mini")
+
+
+def test_cached_answer_skips_the_search_context():
+    get_summary_cache().put(_query_cache_key("Rechnung", HITS, "gpt-4o-mini"), "Die Rechnung ist bezahlt.")
+    assert llm_query_answer("Rechnung", HITS, "sk-test") == "Die Rechnung ist bezahlt."
+    assert list(llm_query_answer_stream("Rechnung", HITS, "sk-test")) == ["Die Rechnung ist bezahlt."]
+
+
+def _header_only_store(tmp_path, name, subject):
+    store = MessageStore(str(tmp_path / f"{name}.sqlite3"))
+    store.add_headers([{
+        "uid": 5, "message_id": f"<{name}@example.de>", "subject": subject, "sender": f"{name}@example.de",
+        "date": DATE, "size": 1, "flags": (), "folder": "INBOX",
+    }])
+    return store
+
+
+def test_query_cache_key_separates_accounts_without_bodies(tmp_path):
+    # Gleiche UID ohne geladenen Inhalt in zwei Konten: die Antworten dürfen sich nicht mischen
+    first = _header_only_store(tmp_path, "konto1", "Gehaltsabrechnung")
+    second = _header_only_store(tmp_path, "konto2", "Newsletter")
+    hits = [first[5]], [second[5]]
+    assert hits[0][0]["body_hash"] is None and hits[1][0]["body_hash"] is None
+    assert _query_cache_key("Abrechnung", hits[0], "gpt-4o-mini") != _query_cache_key(
+        "Abrechnung", hits[1], "gpt-4o-mini"
+    )
@@ -0,0 +1,44 @@
+from email.message import EmailMessage
+
+from utils.context_builder import _unique_contents
+from utils.threads import find_duplicates, parse_message_ids, thread_root
+
+INVOICE = (
+    "Hallo,\n\nanbei erhalten Sie die Rechnung {number} für den Monat März. "
+    "Der Betrag von {amount} Euro wird am 15.03.2024 abgebucht.\n\n"
+    "Bei Fragen zur Rechnung wenden Sie sich bitte an unseren Kundenservice."
+)
+
+
+def _email(uid, text):
+    message = EmailMessage()
+    message.set_content(text)
+    return {"uid": uid, "message_id": f"<{uid}@example.de>", "message": message}
+
+
+def test_parse_message_ids():
+    assert parse_message_ids("<a@x> <b@y>\r\n <c@z>") == ["<a@x>", "<b@y>", "<c@z>"]
+    assert parse_message_ids(None) == []
+
+
+def test_thread_root_prefers_references():
+    assert thread_root("<c>", ["<b>"], ["<a>", "<b>"]) == "<a>"
+    assert thread_root("<c>", ["<b>"], []) == "<b>"
+    assert thread_root("<c>") == "<c>"
+
+
+def test_find_duplicates_merges_only_identical_content():
+    first = INVOICE.format(number="RE-2024-1234", amount="49,90")
+    other = INVOICE.format(number="RE-2024-1235", amount="49,90")
+    assert find_duplicates([first, other, "  " + first.replace("\n\n", "\n")]) == [0, 1, 0]
+
+
+def test_unique_contents_keeps_templated_emails():
+    emails = [
+        _email(1, INVOICE.format(number="RE-2024-1234", amount="49,90")),
+        _email(2, INVOICE.format(number="RE-2024-1235", amount="52,10")),
+        _email(3, INVOICE.format(number="RE-2024-1234", amount="49,90")),
+    ]
+    unique = _unique_contents(emails)
+    assert [email_data["uid"] for email_data, _ in unique] == [1, 2]
+    assert "RE-2024-1235" in unique[1][1]
@@ -0,0 +1,250 @@
+import base64
+import binascii
+import quopri
+import re
+import uuid
+
+# Header, die beim Zusammensetzen der Textnachricht durch eigene ersetzt werden
+_CONTENT_HEADERS = {b"content-type", b"content-transfer-encoding", b"mime-version"}
+_DIGITS_RE = re.compile(rb"^-?\d+$")
+
+
+def _tokenize(data):
+    """Zerlegt eine IMAP-Antwort in Klammern, Strings (str), Literale (bytes), Zahlen und Atome."""
+    i, length = 0, len(data)
+    while i < length:
+        char = data[i:i + 1]
+        if char in b" \r\n":
+            i += 1
+        elif char in b"()":
+            yield char
+            i += 1
+        elif char == b'"':
+            value = bytearray()
+            i += 1
+            while i < length and data[i:i + 1] != b'"':
+                if data[i:i + 1] == b"\\":
+                    i += 1
+                value += data[i:i + 1]
+                i += 1
+            yield value.decode("utf-8", "replace")
+            i += 1
+        elif char == b"{":
+            end = data.index(b"}", i)
+            size = int(data[i + 1:end])
+            start = end + 1
+            if data[start:start + 2] == b"\r\n":
+                start += 2
+            yield bytes(data[start:start + size])
+            i = start + size
+        else:
+            start = i
+            depth = 0
+            # Atome wie BODY[HEADER.FIELDS (FROM)]<0> enthalten Klammern und Leerzeichen
+            while i < length and (depth or data[i:i + 1] not in b' ()"\r\n'):
+                if data[i:i + 1] == b"[":
+                    depth += 1
+                elif data[i:i + 1] == b"]":
+                    depth -= 1
+                i += 1
+            atom = bytes(data[start:i])
+            if atom.upper() == b"NIL":
+                yield None
+            elif _DIGITS_RE.match(atom):
+                yield int(atom)
+            else:
+                yield atom.decode("utf-8", "replace")
+
+
+def _parse(tokens):
+    items = []
+    for token in tokens:
+        if token == b"(":
+            items.append(_parse(tokens))
+        elif token == b")":
+            return items
+        else:
+            items.append(token)
+    return items
+
+
+def parse_fetch_response(msg_data):
+    """
+    Zerlegt die Antwort eines FETCH in ein dict pro Nachricht.
+
+    Args:
+    - msg_data (list): Die Antwort von imaplib (bytes und Tupel mit Literalen).
+
+    Returns:
+    - list: dicts Datenelement (z.B. "UID", "BODYSTRUCTURE", "BODY[1]<0>") -> Wert
+    """
+    stream = bytearray()
+    for response_part in msg_data:
+        if isinstance(response_part, tuple):
+            stream += response_part[0] + b"\r\n" + response_part[1]
+        elif response_part:
+            stream += response_part + b"\r\n"
+    items = _parse(iter(_tokenize(bytes(stream))))
+    # Pro Nachricht: Sequenznummer, danach die Liste der Datenelemente
+    responses = []
+    for value in items:
+        if isinstance(value, list):
+            responses.append({
+                str(value[i]).upper(): value[i + 1] for i in range(0, len(value) - 1, 2)
+            })
+    return responses
+
+
+def _params(values):
+    """Liest eine Parameterliste wie ("CHARSET" "utf-8") als dict mit kleinen Schlüsseln."""
+    if not isinstance(values, list):
+        return {}
+    return {
+        str(values[i]).lower(): values[i + 1]
+        for i in range(0, len(values) - 1, 2)
+        if isinstance(values[i], str)
+    }
+
+
+def _leaf(structure, number, alternative):
+    maintype, subtype = str(structure[0]).lower(), str(structure[1]).lower()
+    params = _params(structure[2])
+    # Die Erweiterungsdaten beginnen bei text/* nach der Zeilenzahl, bei message/rfc822 nach
+    # Umschlag, Struktur und Zeilenzahl
+    extension = 7
+    if maintype == "text":
+        extension = 8
+    elif (maintype, subtype) == ("message", "rfc822"):
+        extension = 10
+    disposition = structure[extension + 1] if len(structure) > extension + 1 else None
+    disposition_type = str(disposition[0]).lower() if isinstance(disposition, list) and disposition else None
+    disposition_params = _params(disposition[1]) if isinstance(disposition, list) and len(disposition) > 1 else {}
+    return {
+        "part": number,
+        "type": f"{maintype}/{subtype}",
+        "charset": params.get("charset"),
+        "encoding": str(structure[5] or "7bit").lower(),
+        "size": structure[6] if isinstance(structure[6], int) else 0,
+        "filename": disposition_params.get("filename") or params.get("name"),
+        "disposition": disposition_type,
+        "alternative": alternative,
+    }
+
+
+def body_parts(structure, number="", alternative=None):
+    """
+    Listet die Teile einer BODYSTRUCTURE mit IMAP-Teilenummern.
+
+    Args:
+    - structure (list): Die BODYSTRUCTURE aus parse_fetch_response.
+
+    Returns:
+    - list: dicts mit part, type, charset, encoding, size, filename, disposition und
+      alternative (Teilenummer der umschließenden multipart/alternative oder None).
+    """
+    if structure and isinstance(structure[0], list):
+        # Die Teile stehen vorne, danach folgen Subtyp und Erweiterungsdaten
+        children = []
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            children.append(child)
+        subtype = str(structure[len(children)]).lower() if len(structure) > len(children) else "mixed"
+        if subtype == "alternative":
+            alternative = number or "0"
+        parts = []
+        for index, child in enumerate(children, 1):
+            parts += body_parts(child, f"{number}.{index}" if number else str(index), alternative)
+        return parts
+    # Eine Nachricht ohne multipart hat genau den Teil 1
+    return [_leaf(structure, number or "1", alternative)]
+
+
+def split_parts(parts):
+    """
+    Teilt die Teile in Text für Vorschau und Embedding und in Anhänge.
+
+    Aus einer multipart/alternative wird text/plain bevorzugt, sonst text/html verwendet.
+
+    Returns:
+    - tuple: (list Textteile, list Anhänge)
+    """
+    texts, attachments = [], []
+    for part in parts:
+        is_text = part["type"] in ("text/plain", "text/html")
+        if is_text and part["disposition"] != "attachment" and not part["filename"]:
+            texts.append(part)
+        else:
+            attachments.append(part)
+    plain_alternatives = {part["alternative"] for part in texts if part["type"] == "text/plain"}
+    texts = [
+        part for part in texts
+        if part["type"] == "text/plain" or part["alternative"] is None or part["alternative"] not in plain_alternatives
+    ]
+    return texts, attachments
+
+
+def decode_part(data, encoding, charset):
+    """Dekodiert einen per BODY[<teil>] geladenen Teil mit Transferkodierung und Zeichensatz zu Text."""
+    if encoding == "base64":
+        data = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+        # Fehlerhafte Daten auf ganze 4-Byte-Gruppen kürzen
+        data = data[:len(data) - len(data) % 4]
+        try:
+            data = base64.b64decode(data)
+        except binascii.Error:
+            data = b""
+    elif encoding == "quoted-printable":
+        data = quopri.decodestring(data)
+    try:
+        return data.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return data.decode("latin-1")
+
+
+def _strip_headers(header_bytes, names):
+    lines = []
+    skipping = False
+    for line in header_bytes.splitlines(keepends=True):
+        if line[:1] in (b" ", b"\t"):
+            # Fortsetzungszeile des vorherigen Headers
+            if not skipping:
+                lines.append(line)
+            continue
+        if not line.strip():
+            break
+        skipping = line.split(b":", 1)[0].strip().lower() in names
+        if not skipping:
+            lines.append(line)
+    return b"".join(lines)
+
+
+def build_text_message(header_bytes, texts):
+    """
+    Setzt aus den Headern und den geladenen Textteilen eine RFC822-Nachricht zusammen.
+
+    Args:
+    - header_bytes (bytes): Der Header der Nachricht (BODY[HEADER]).
+    - texts (list): (Subtyp "plain" oder "html", str Text) pro Textteil.
+
+    Returns:
+    - bytes: Die Nachricht ohne Anhänge, Texte in UTF-8.
+    """
+    header = _strip_headers(header_bytes, _CONTENT_HEADERS).rstrip(b"\r\n")
+    header = (header + b"\r\n" if header else b"") + b"MIME-Version: 1.0\r\n"
+
+    def text_part(subtype, text):
+        return (
+            f"Content-Type: text/{subtype}; charset=utf-8\r\nContent-Transfer-Encoding: 8bit\r\n\r\n".encode()
+            + text.encode("utf-8")
+        )
+
+    if len(texts) <= 1:
+        subtype, text = texts[0] if texts else ("plain", "")
+        return header + text_part(subtype, text)
+    boundary = f"mail-bot-{uuid.uuid4().hex}".encode()
+    body = b"".join(b"--" + boundary + b"\r\n" + text_part(subtype, text) + b"\r\n" for subtype, text in texts)
+    return (
+        header + b'Content-Type: multipart/mixed; boundary="' + boundary + b'"\r\n\r\n'
+        + body + b"--" + boundary + b"--\r\n"
+    )
@@ -0,0 +1,198 @@
+import re
+
+import numpy as np
+
+from utils.email_body import get_email_content
+from utils.faiss_utils import embed_texts_cached
+from utils.threads import find_duplicates
+from utils.tokens import count_tokens, truncate_to_tokens
+
+# Kontextfenster der auswählbaren Modelle
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128_000,
+    "gpt-4-1106-preview": 128_000,
+    "gpt-4": 8_192,
+    "gpt-3.5-turbo": 16_385,
+}
+DEFAULT_CONTEXT_WINDOW = 8_192
+
+# Obergrenze für den E-Mail-Kontext, unabhängig vom Kontextfenster (Kosten und Latenz)
+MAX_CONTEXT_TOKENS = 6_000
+# Platz für Systemprompt, Anweisungen und Antwort
+RESERVED_TOKENS = 1_000
+
+# Ungefähre Größe eines Textabschnitts
+PASSAGE_TOKENS = 150
+# Mindestens so viele Tokens erhält ein Treffer, sonst wird er weggelassen
+MIN_TOKENS_PER_HIT = 80
+
+
+def context_budget(model, max_tokens=500):
+    """
+    Liefert das Token-Budget für den E-Mail-Kontext eines Modells.
+
+    Args:
+    - model (str): Das Chat-Modell.
+    - max_tokens (int): Die maximale Länge der Antwort.
+
+    Returns:
+    - int: Anzahl der Tokens, die der E-Mail-Kontext höchstens belegen darf.
+    """
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return max(min(window - max_tokens - RESERVED_TOKENS, MAX_CONTEXT_TOKENS), MIN_TOKENS_PER_HIT)
+
+
+def _paragraphs(text, model, passage_tokens):
+    """Liefert die Absätze eines Textes, zu lange Absätze werden an Zeilen bzw. Zeichen geteilt."""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph, model) <= passage_tokens:
+            yield paragraph
+            continue
+        for line in paragraph.splitlines():
+            line = line.strip()
+            # Grob 4 Zeichen pro Token
+            for start in range(0, len(line), passage_tokens * 4):
+                yield line[start:start + passage_tokens * 4]
+
+
+def split_passages(text, model, passage_tokens=PASSAGE_TOKENS):
+    """Teilt einen Text an Absätzen in Abschnitte von ungefähr passage_tokens Tokens."""
+    passages = []
+    current = []
+    current_tokens = 0
+    for paragraph in _paragraphs(text, model, passage_tokens):
+        tokens = count_tokens(paragraph, model)
+        if current and current_tokens + tokens > passage_tokens:
+            passages.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        passages.append("\n\n".join(current))
+    return passages
+
+
+def _email_header(email_data):
+    return (
+        f"Datum: {email_data['date'].strftime('%d.%m.%Y')}\n"
+        f"Betreff: {email_data['subject']}\n"
+        f"Von: {email_data['sender']}\n"
+        f"Inhalt: "
+    )
+
+
+def _unique_contents(search_results):
+    """
+    Liefert die Treffer mit neuem Inhalt, jeweils ohne bereits gesendete Absätze.
+
+    Gleiche E-Mails (z.B. in mehreren Ordnern) und Absätze, die wörtlich schon in einem besser
+    platzierten Treffer stehen (z.B. weitergeleiteter Text), werden weggelassen. Fast gleiche
+    E-Mails wie Rechnungen mit anderer Nummer bleiben erhalten.
+
+    Returns:
+    - list: (E-Mail, Inhalt) pro verbleibendem Treffer, bester zuerst.
+    """
+    bodies = [get_email_content(email_data) for email_data in search_results]
+    representatives = find_duplicates(bodies)
+    seen = set()
+    unique = []
+    for i, (email_data, body) in enumerate(zip(search_results, bodies)):
+        if representatives[i] != i:
+            continue
+        paragraphs = []
+        for paragraph in re.split(r"\n\s*\n", body):
+            normalized = " ".join(paragraph.split()).lower()
+            if normalized and normalized not in seen:
+                seen.add(normalized)
+                paragraphs.append(paragraph.strip())
+        if paragraphs or not body:
+            unique.append((email_data, "\n\n".join(paragraphs)))
+    return unique
+
+
+def _rank_passages(query, passages_per_hit, openai_api_key):
+    """Bewertet alle Abschnitte nach Kosinus-Ähnlichkeit zur Suchanfrage."""
+    flat = [passage for passages in passages_per_hit for passage in passages]
+    try:
+        vectors = embed_texts_cached([query] + flat, openai_api_key)
+    except Exception:
+        # Ohne Embeddings die Reihenfolge im Text beibehalten
+        return [list(range(len(passages))) for passages in passages_per_hit]
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    scores = vectors[1:] @ vectors[0]
+
+    rankings = []
+    offset = 0
+    for passages in passages_per_hit:
+        hit_scores = scores[offset:offset + len(passages)]
+        rankings.append(list(np.argsort(-hit_scores)))
+        offset += len(passages)
+    return rankings
+
+
+def build_search_context(query, search_results, model, openai_api_key, max_tokens=500):
+    """
+    Baut den E-Mail-Kontext für llm_query_answer innerhalb eines festen Token-Budgets.
+
+    Zitate und Signaturen werden entfernt, jeder Inhalt wird nur einmal gesendet (siehe
+    _unique_contents). Passt nicht alles ins Budget, werden pro Treffer die zur Suchanfrage
+    passendsten Abschnitte gewählt und die am schlechtesten platzierten Treffer zuerst weggelassen.
+
+    Args:
+    - query (str): Die Suchanfrage.
+    - search_results (list): Die Treffer, bester zuerst.
+    - model (str): Das Chat-Modell.
+    - openai_api_key (str): Der API-Schlüssel für OpenAI.
+    - max_tokens (int): Die maximale Länge der Antwort.
+
+    Returns:
+    - list: Ein Text pro verwendetem Treffer.
+    """
+    budget = context_budget(model, max_tokens)
+    unique = _unique_contents(search_results)
+    headers = [_email_header(email_data) for email_data, _ in unique]
+    bodies = [body for _, body in unique]
+    header_tokens = [count_tokens(header, model) for header in headers]
+    body_tokens = [count_tokens(body, model) for body in bodies]
+
+    if sum(header_tokens) + sum(body_tokens) <= budget:
+        return [header + body for header, body in zip(headers, bodies)]
+
+    passages_per_hit = [split_passages(body, model) for body in bodies]
+    rankings = _rank_passages(query, passages_per_hit, openai_api_key)
+
+    # Die am schlechtesten platzierten Treffer weglassen, bis jeder verbleibende genug Platz hat
+    hit_count = len(headers)
+    while hit_count > 1 and budget // hit_count - max(header_tokens[:hit_count]) < MIN_TOKENS_PER_HIT:
+        hit_count -= 1
+
+    email_contents = []
+    remaining = budget
+    for i in range(hit_count):
+        header, passages, ranking = headers[i], passages_per_hit[i], rankings[i]
+        # Das verbleibende Budget gleichmäßig auf die restlichen Treffer verteilen,
+        # nicht benötigte Tokens kurzer E-Mails kommen den folgenden Treffern zugute
+        hit_budget = max(remaining // (hit_count - i) - header_tokens[i], 0)
+
+        chosen = []
+        used = 0
+        for position in ranking:
+            tokens = count_tokens(passages[position], model)
+            if used + tokens > hit_budget:
+                if not chosen:
+                    # Ein einzelner zu langer Abschnitt wird gekürzt
+                    chosen.append((position, truncate_to_tokens(passages[position], hit_budget, model)))
+                    used = hit_budget
+                continue
+            chosen.append((position, passages[position]))
+            used += tokens
+
+        # Abschnitte in der ursprünglichen Reihenfolge ausgeben
+        text = "\n[...]\n".join(passage for _, passage in sorted(chosen))
+        email_contents.append(header + text)
+        remaining -= header_tokens[i] + used
+    return email_contents
@@ -0,0 +1,149 @@
+import re
+import threading
+from collections import OrderedDict
+
+from bs4 import BeautifulSoup
+
+from utils import metrics
+
+# Anzahl der im Speicher gehaltenen Texte
+BODY_CACHE_SIZE = 1024
+
+# Beginn eines zitierten Verlaufs (deutsch und englisch)
+_QUOTE_HEADER_RE = re.compile(
+    r"^\s*(Am .+ schrieb .+:|On .+ wrote:|-+\s*(Ursprüngliche Nachricht|Original Message)\s*-+|_{5,})\s*$",
+    re.IGNORECASE,
+)
+# Beginn einer Signatur
+_SIGNATURE_RE = re.compile(
+    r"^(-- ?|Gesendet von meinem .+|Sent from my .+|Mit freundlichen Grüßen,?|Viele Grüße,?|Best regards,?)\s*$",
+    re.IGNORECASE,
+)
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _decode_part(part):
+    """Dekodiert den Inhalt eines MIME-Teils mit dem angegebenen Zeichensatz."""
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return ""
+    charset = part.get_content_charset() or "utf-8"
+    try:
+        return payload.decode(charset, errors="replace")
+    except LookupError:
+        # Unbekannter Zeichensatz
+        return payload.decode("latin-1")
+
+
+def html_to_text(html):
+    """Wandelt HTML in lesbaren Text um."""
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "head"]):
+        tag.decompose()
+    lines = (line.strip() for line in soup.get_text("\n").splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def extract_text(message):
+    """
+    Extrahiert den Text einer E-Mail.
+
+    Bevorzugt wird der erste text/plain Teil, sonst wird der erste text/html Teil in Text
+    umgewandelt. Anhänge werden übersprungen.
+
+    Args:
+    - message (email.message.Message): Die E-Mail.
+
+    Returns:
+    - str: Der Text der E-Mail.
+    """
+    html_part = None
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_disposition() == "attachment":
+            continue
+        content_type = part.get_content_type()
+        if content_type == "text/plain":
+            return _decode_part(part)
+        if content_type == "text/html" and html_part is None:
+            html_part = part
+    if html_part is not None:
+        return html_to_text(_decode_part(html_part))
+    return ""
+
+
+def get_email_text(email_data, message=None):
+    """
+    Liefert den Text einer E-Mail, pro Inhalt nur einmal dekodiert.
+
+    Der Cache ist nach einem Hash der gespeicherten Rohnachricht ("body_hash") geordnet: gleiche
+    Message-IDs verschiedener Nachrichten oder Konten teilen sich keinen Eintrag, und ein später
+    geladener oder ersetzter Inhalt wird neu dekodiert. E-Mails ohne Hash werden nicht gecacht.
+
+    Args:
+    - email_data (dict): Die E-Mail mit "message" und optional "body_hash" (EmailHeader).
+    - message (email.message.Message): Optional die bereits geladene Nachricht.
+
+    Returns:
+    - str: Der Text oder None, wenn der Inhalt der E-Mail nicht geladen ist.
+    """
+    key = email_data.get("body_hash")
+    if key:
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                metrics.get_metrics().count("extract_text", cache_hits=1)
+                return _cache[key]
+
+    with metrics.span("extract_text") as current:
+        if message is None:
+            message = email_data["message"]
+        if message is None:
+            return None
+        text = extract_text(message)
+        current.add("cache_misses")
+        current.add("chars", len(text))
+
+    if key:
+        with _cache_lock:
+            _cache[key] = text
+            if len(_cache) > BODY_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return text
+
+
+def strip_quotes_and_signature(text):
+    """
+    Entfernt zitierte Antworten und Signaturen aus einem E-Mail-Text.
+
+    Args:
+    - text (str): Der E-Mail-Text.
+
+    Returns:
+    - str: Der Text ohne Zitate und Signatur.
+    """
+    lines = []
+    for line in text.splitlines():
+        if _QUOTE_HEADER_RE.match(line) or _SIGNATURE_RE.match(line):
+            # Alles danach ist Verlauf oder Signatur
+            break
+        if line.lstrip().startswith(">"):
+            continue
+        lines.append(line.rstrip())
+    stripped = "\n".join(lines).strip()
+    # Besteht die E-Mail nur aus Zitat, lieber den Originaltext behalten
+    return stripped or text.strip()
+
+
+def get_email_content(email_data):
+    """
+    Liefert den neuen Inhalt einer E-Mail ohne zitierten Verlauf und Signatur.
+
+    In einem Verlauf wiederholt jede Antwort die vorherigen Nachrichten; diese stehen schon
+    in den beantworteten E-Mails und werden so nicht mehrfach embeddet oder an das LLM gesendet.
+
+    Returns:
+    - str: Der Inhalt ("" wenn der Inhalt der E-Mail nicht geladen ist).
+    """
+    return strip_quotes_and_signature(get_email_text(email_data) or "")
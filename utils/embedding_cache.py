@@ -0,0 +1,195 @@
+import hashlib
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Ohne fcntl (Windows) schützt die Sperre nur innerhalb eines Prozesses
+    fcntl = None
+
+from utils.storage import get_cache_dir
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def embedding_key(message_id, content, model):
+    """
+    Erzeugt den Cache-Schlüssel aus Message-ID, Hash des Inhalts und Modellname.
+
+    Args:
+    - message_id (str): Die Message-ID der E-Mail (darf leer sein).
+    - content (str): Der Text, der embedded wird.
+    - model (str): Das Embedding-Modell.
+
+    Returns:
+    - str: Hex-Schlüssel.
+    """
+    content_hash = hashlib.sha256(content.encode("utf-8", "surrogatepass")).hexdigest()
+    return hashlib.sha256(f"{model}\0{message_id or ''}\0{content_hash}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistenter Embedding-Speicher für ein Modell.
+
+    Die Vektoren liegen als float32-Matrix in `<modell>.f32` und werden per Memory-Map gelesen,
+    die Schlüssel stehen zeilenweise in `<modell>.keys` (erste Zeile: Dimension). Zeile i der Schlüsseldatei gehört zu
+    Zeile i der Matrix. Beide Dateien werden nur angehängt, unter einer Dateisperre (`<modell>.lock`), damit
+    mehrere Prozesse (z.B. Streamlit-Worker und Benchmark) denselben Cache verwenden können.
+    """
+
+    def __init__(self, directory, model):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        self.vectors_path = os.path.join(directory, f"{name}.f32")
+        self.keys_path = os.path.join(directory, f"{name}.keys")
+        self.lock_path = os.path.join(directory, f"{name}.lock")
+        self._lock = threading.Lock()
+        self._rows = {}
+        # Anzahl der Zeilen; andere Prozesse können denselben Schlüssel ein weiteres Mal anhängen
+        self._count = 0
+        # Bis zu dieser Position (Bytes) ist die Schlüsseldatei eingelesen
+        self._keys_offset = 0
+        self._dimension = None
+        self._vectors = None
+        with self._lock, self._file_lock():
+            self._read_new_rows()
+
+    @contextmanager
+    def _file_lock(self):
+        """Sperrt die Dateien des Caches auch gegenüber anderen Prozessen."""
+        with open(self.lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def _read_new_rows(self):
+        """
+        Übernimmt die seit dem letzten Lesen angehängten Zeilen, auch die anderer Prozesse.
+
+        Nach einem Abbruch beim Schreiben werden beide Dateien auf die vollständigen Zeilen
+        gekürzt. Nur unter _file_lock aufrufen.
+        """
+        if not os.path.exists(self.keys_path) or not os.path.exists(self.vectors_path):
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        if self._dimension is None:
+            header, newline, data = data.partition(b"\n")
+            if not newline:
+                return
+            self._dimension = int(header)
+            self._keys_offset = len(header) + 1
+        # Nur vollständige Zeilen, zu denen auch ein Vektor geschrieben wurde
+        keys = data[:data.rfind(b"\n") + 1].decode("ascii").split("\n")[:-1]
+        row_size = self._dimension * 4
+        keys = keys[:max(os.path.getsize(self.vectors_path) // row_size - self._count, 0)]
+        for key in keys:
+            self._rows[key] = self._count
+            self._count += 1
+        self._keys_offset += sum(len(key) + 1 for key in keys)
+        if os.path.getsize(self.keys_path) > self._keys_offset:
+            os.truncate(self.keys_path, self._keys_offset)
+        if os.path.getsize(self.vectors_path) > self._count * row_size:
+            os.truncate(self.vectors_path, self._count * row_size)
+        if keys:
+            self._map_vectors()
+
+    def _map_vectors(self):
+        if self._count:
+            self._vectors = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r", shape=(self._count, self._dimension)
+            )
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get_many(self, keys):
+        """
+        Sucht mehrere Schlüssel im Cache.
+
+        Args:
+        - keys (list): Die Cache-Schlüssel.
+
+        Returns:
+        - tuple: (dict Position -> Vektor für Treffer, list Positionen der Fehlschläge)
+        """
+        hits = {}
+        misses = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                row = self._rows.get(key)
+                if row is None:
+                    misses.append(i)
+                else:
+                    hits[i] = np.array(self._vectors[row])
+        return hits, misses
+
+    def put_many(self, keys, vectors):
+        """
+        Speichert neue Vektoren im Cache.
+
+        Args:
+        - keys (list): Die Cache-Schlüssel.
+        - vectors (np.ndarray): float32-Matrix mit einer Zeile pro Schlüssel.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            # Zeilen anderer Prozesse übernehmen, damit die eigenen dahinter angehängt werden
+            self._read_new_rows()
+            if self._dimension is None:
+                self._dimension = vectors.shape[1]
+                header = f"{self._dimension}\n".encode("ascii")
+                with open(self.vectors_path, "wb"), open(self.keys_path, "wb") as f:
+                    f.write(header)
+                self._keys_offset = len(header)
+            elif vectors.shape[1] != self._dimension:
+                raise ValueError(
+                    f"Dimension {vectors.shape[1]} passt nicht zum Cache ({self._dimension})."
+                )
+
+            new_keys = []
+            new_rows = []
+            seen = set()
+            for key, vector in zip(keys, vectors):
+                if key not in self._rows and key not in seen:
+                    seen.add(key)
+                    new_keys.append(key)
+                    new_rows.append(vector)
+            if not new_keys:
+                return
+
+            # Zuerst die Vektoren, danach die Schlüssel schreiben
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.array(new_rows, dtype=np.float32).tobytes())
+            data = "".join(f"{key}\n" for key in new_keys).encode("ascii")
+            with open(self.keys_path, "ab") as f:
+                f.write(data)
+            self._keys_offset += len(data)
+
+            for key in new_keys:
+                self._rows[key] = self._count
+                self._count += 1
+            self._map_vectors()
+
+
+def get_embedding_cache(model):
+    """
+    Liefert den prozessweit geteilten Embedding-Cache für ein Modell.
+
+    Args:
+    - model (str): Das Embedding-Modell.
+
+    Returns:
+    - EmbeddingCache: Der Cache.
+    """
+    with _caches_lock:
+        if model not in _caches:
+            _caches[model] = EmbeddingCache(get_cache_dir("embeddings"), model)
+        return _caches[model]
@@ -0,0 +1,166 @@
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from utils.embeddings import EMBEDDING_MODEL, embed_texts
+
+# Embedding-Anbieter: "openai" (Standard), "hashing" oder "sentence-transformers"
+PROVIDER_OPENAI = "openai"
+PROVIDER_HASHING = "hashing"
+PROVIDER_SENTENCE_TRANSFORMERS = "sentence-transformers"
+EMBEDDING_PROVIDER = os.environ.get("MAIL_BOT_EMBEDDINGS", PROVIDER_OPENAI)
+
+OPENAI_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+HASHING_DIMENSION = 1024
+SENTENCE_TRANSFORMER_MODEL = os.environ.get("MAIL_BOT_SENTENCE_TRANSFORMER", "all-MiniLM-L6-v2")
+SENTENCE_TRANSFORMER_BATCH_SIZE = 64
+
+_WORD_RE = re.compile(r"\w+")
+
+_local_providers = {}
+_local_providers_lock = threading.Lock()
+
+
+class EmbeddingProvider:
+    """
+    Schnittstelle für Embedding-Anbieter.
+
+    name identifiziert Anbieter und Modell, z.B. im Embedding-Cache und in den Metadaten eines
+    gespeicherten Index. Vektoren verschiedener Anbieter dürfen nie gemischt werden.
+    """
+
+    name = None
+    dimension = None
+    # Ob ein OpenAI API-Schlüssel benötigt wird
+    requires_api_key = False
+
+    def embed(self, texts):
+        """
+        Erzeugt Embeddings.
+
+        Args:
+        - texts (list): Die Texte.
+
+        Returns:
+        - np.ndarray: float32-Matrix mit einer Zeile pro Text.
+        """
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings über die OpenAI-API, in Batches und parallel (siehe embed_texts)."""
+
+    requires_api_key = True
+
+    def __init__(self, openai_api_key, model=EMBEDDING_MODEL):
+        self.model = model
+        # Der bisherige Modellname bleibt der Name, damit vorhandene Caches gültig bleiben
+        self.name = model
+        self.dimension = OPENAI_DIMENSIONS.get(model)
+        self._openai_api_key = openai_api_key
+
+    def embed(self, texts):
+        return embed_texts(self._openai_api_key, texts, model=self.model)
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Lokale Embeddings per Feature Hashing über Wörter und Zeichen-Trigramme.
+
+    Braucht weder Netzwerk noch zusätzliche Pakete und liefert eine Anfrage in wenigen
+    Millisekunden, findet aber nur lexikalisch ähnliche Texte.
+    """
+
+    def __init__(self, dimension=HASHING_DIMENSION):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def _features(self, text):
+        words = _WORD_RE.findall(text.lower())
+        for word in words:
+            yield word
+            padded = f"#{word}#"
+            for start in range(len(padded) - 2):
+                yield padded[start:start + 3]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                hashed = zlib.crc32(feature.encode("utf-8"))
+                # Das Vorzeichen aus einem weiteren Bit gleicht Kollisionen im Mittel aus
+                vectors[row, hashed % self.dimension] += 1.0 if hashed & 0x80000000 else -1.0
+        # Logarithmisch dämpfen, damit häufige Begriffe nicht dominieren
+        np.copysign(np.log1p(np.abs(vectors)), vectors, out=vectors)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        return vectors
+
+
+class SentenceTransformerEmbeddingProvider(EmbeddingProvider):
+    """Lokale Embeddings mit einem kleinen sentence-transformers Modell auf der CPU."""
+
+    def __init__(self, model=SENTENCE_TRANSFORMER_MODEL):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "Für lokale Embeddings mit sentence-transformers bitte 'pip install sentence-transformers' ausführen."
+            ) from e
+        self._model = SentenceTransformer(model, device="cpu")
+        self.dimension = self._model.get_sentence_embedding_dimension()
+        self.name = f"st-{model}"
+
+    def embed(self, texts):
+        vectors = self._model.encode(
+            list(texts), batch_size=SENTENCE_TRANSFORMER_BATCH_SIZE, convert_to_numpy=True,
+            normalize_embeddings=True, show_progress_bar=False,
+        )
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dimension)
+
+
+def provider_name(provider=None):
+    """
+    Liefert den Namen, unter dem der konfigurierte Anbieter Caches und Indizes kennzeichnet,
+    ohne ihn zu erzeugen (und z.B. ein Modell zu laden).
+    """
+    provider = provider or EMBEDDING_PROVIDER
+    if provider == PROVIDER_HASHING:
+        return f"hashing-{HASHING_DIMENSION}"
+    if provider == PROVIDER_SENTENCE_TRANSFORMERS:
+        return f"st-{SENTENCE_TRANSFORMER_MODEL}"
+    return EMBEDDING_MODEL
+
+
+def get_embedding_provider(openai_api_key=None, provider=None):
+    """
+    Liefert den konfigurierten Embedding-Anbieter.
+
+    Lokale Anbieter werden prozessweit geteilt, damit ein Modell nur einmal geladen wird.
+
+    Args:
+    - openai_api_key (str): Der API-Schlüssel für OpenAI (nur für "openai").
+    - provider (str): "openai", "hashing" oder "sentence-transformers" (Standard: EMBEDDING_PROVIDER).
+
+    Returns:
+    - EmbeddingProvider: Der Anbieter.
+    """
+    provider = provider or EMBEDDING_PROVIDER
+    if provider == PROVIDER_OPENAI:
+        return OpenAIEmbeddingProvider(openai_api_key)
+    if provider not in (PROVIDER_HASHING, PROVIDER_SENTENCE_TRANSFORMERS):
+        raise ValueError(f"Unbekannter Embedding-Anbieter: {provider}")
+    with _local_providers_lock:
+        if provider not in _local_providers:
+            if provider == PROVIDER_HASHING:
+                _local_providers[provider] = HashingEmbeddingProvider()
+            else:
+                _local_providers[provider] = SentenceTransformerEmbeddingProvider()
+        return _local_providers[provider]
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openai
+
+from utils import metrics
+from utils.openai_client import current_priority, openai_request
+from utils.tokens import count_tokens, truncate_to_tokens
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Limits pro Anfrage an die Embeddings-API
+MAX_INPUT_TOKENS = 8191
+MAX_BATCH_TOKENS = 100_000
+MAX_BATCH_INPUTS = 512
+
+# Anzahl gleichzeitig laufender Anfragen
+MAX_IN_FLIGHT = 4
+
+
+def build_batches(token_counts, max_batch_tokens=MAX_BATCH_TOKENS, max_batch_inputs=MAX_BATCH_INPUTS):
+    """
+    Teilt Texte anhand ihrer Token-Anzahl in Batches auf.
+
+    Die Reihenfolge bleibt erhalten, jeder Batch enthält aufeinanderfolgende Positionen.
+
+    Args:
+    - token_counts (list): Token-Anzahl pro Text.
+    - max_batch_tokens (int): Maximale Summe an Tokens pro Batch.
+    - max_batch_inputs (int): Maximale Anzahl an Texten pro Batch.
+
+    Returns:
+    - list: Liste von Listen mit Positionen der Texte.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, tokens in enumerate(token_counts):
+        if current and (current_tokens + tokens > max_batch_tokens or len(current) >= max_batch_inputs):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _embed_batch(openai_api_key, texts, token_counts, model, priority):
+    """
+    Erzeugt die Embeddings für einen Batch.
+
+    Kontingent und Wiederholungen bei temporären Fehlern übernimmt der RequestScheduler des
+    Schlüssels. Lehnt der Server den Batch ab, wird er halbiert und die Hälften werden
+    einzeln angefragt.
+    """
+    try:
+        response = openai_request(
+            openai_api_key,
+            lambda client: client.embeddings.create(model=model, input=texts),
+            sum(token_counts),
+            priority,
+        )
+    except openai.BadRequestError:
+        if len(texts) == 1:
+            raise
+        middle = len(texts) // 2
+        return (
+            _embed_batch(openai_api_key, texts[:middle], token_counts[:middle], model, priority)
+            + _embed_batch(openai_api_key, texts[middle:], token_counts[middle:], model, priority)
+        )
+    data = sorted(response.data, key=lambda item: item.index)
+    return [item.embedding for item in data]
+
+
+def embed_texts(openai_api_key, texts, model=EMBEDDING_MODEL, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Erzeugt Embeddings für viele Texte mit wenigen, parallelen Anfragen.
+
+    Args:
+    - openai_api_key (str): Der API-Schlüssel für OpenAI.
+    - texts (list): Die zu embeddenden Texte.
+    - model (str): Das Embedding-Modell.
+    - max_in_flight (int): Maximale Anzahl gleichzeitig laufender Anfragen.
+
+    Returns:
+    - np.ndarray: float32-Matrix mit einer Zeile pro Text, in der Reihenfolge von texts.
+    """
+    # Leere Eingaben werden von der API abgelehnt, zu lange Eingaben werden gekürzt
+    inputs = [truncate_to_tokens(text or " ", MAX_INPUT_TOKENS, model) for text in texts]
+    token_counts = [count_tokens(text, model) for text in inputs]
+    batches = build_batches(token_counts)
+    metrics.add("prompt_tokens", sum(token_counts))
+    metrics.add("requests", len(batches))
+    # Die Worker-Threads erben den Kontext nicht, die Priorität wird mitgegeben
+    priority = current_priority()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = [
+            executor.submit(
+                _embed_batch, openai_api_key, [inputs[i] for i in batch], [token_counts[i] for i in batch],
+                model, priority,
+            )
+            for batch in batches
+        ]
+        embeddings = []
+        for future in futures:
+            embeddings.extend(future.result())
+
+    return np.array(embeddings, dtype=np.float32)
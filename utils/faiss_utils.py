@@ -1,84 +1,430 @@
-import openai
+import json
+import math
+import os
+
 import faiss
 import numpy as np
 import streamlit as st
 
-def generate_faiss_index(emails, openai_api_key):
+from utils import metrics
+from utils.email_body import get_email_content
+from utils.embedding_cache import embedding_key, get_embedding_cache
+from utils.embedding_providers import get_embedding_provider
+from utils.threads import find_duplicates
+
+# Index-Typen, "auto" wählt anhand der Anzahl der E-Mails (überschreibbar mit MAIL_BOT_FAISS_INDEX)
+INDEX_AUTO = "auto"
+INDEX_FLAT = "flat"
+INDEX_HNSW = "hnsw"
+INDEX_IVFPQ = "ivfpq"
+INDEX_TYPE = os.environ.get("MAIL_BOT_FAISS_INDEX", INDEX_AUTO)
+
+# Ab dieser Anzahl Vektoren wird bei "auto" HNSW bzw. IVF-PQ verwendet
+HNSW_MIN_VECTORS = 20_000
+IVFPQ_MIN_VECTORS = 100_000
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+IVFPQ_BITS = 8
+IVFPQ_NPROBE = 16
+# IVF-PQ braucht etwa 39 Trainingsvektoren pro Liste bzw. pro PQ-Zentroid
+IVF_TRAINING_POINTS_PER_LIST = 39
+IVFPQ_MIN_TRAINING_VECTORS = IVF_TRAINING_POINTS_PER_LIST * 2 ** IVFPQ_BITS
+
+# Bei Änderungen am embeddeten Text erhöhen, gespeicherte Indexe werden dann neu aufgebaut
+EMBEDDING_TEXT_VERSION = 3
+
+# Standardanzahl der Treffer einer Suche
+SEARCH_TOP_K = 5
+# Gefilterte Suche: bis zu dieser Anzahl erlaubter E-Mails exakt statt im HNSW-Graphen suchen
+FILTERED_EXACT_MAX = 10_000
+FILTERED_EF_FACTOR = 4
+
+
+def _embed_with_cache(provider, message_ids, contents):
+    # Nur Texte embedden, die noch nicht im Cache liegen
+    cache = get_embedding_cache(provider.name)
+    keys = [
+        embedding_key(message_id, content, provider.name)
+        for message_id, content in zip(message_ids, contents)
+    ]
+    cached, misses = cache.get_many(keys)
+    metrics.add("cache_hits", len(cached))
+    metrics.add("cache_misses", len(misses))
+    if misses:
+        # Embeddings in Batches generieren
+        new_embeddings = provider.embed([contents[i] for i in misses])
+        cache.put_many([keys[i] for i in misses], new_embeddings)
+        cached.update(zip(misses, new_embeddings))
+    return np.array([cached[i] for i in range(len(contents))], dtype=np.float32)
+
+
+def _embed_emails(emails, provider):
+    # Nur der neue Inhalt jeder E-Mail, der zitierte Verlauf steckt in den beantworteten E-Mails
+    contents = [get_email_content(email_data) for email_data in emails]
+    # Gleiche Inhalte (z.B. dieselbe E-Mail in zwei Ordnern) nur einmal embedden;
+    # der Cache-Schlüssel hängt nur vom Inhalt ab, damit auch spätere Kopien ihn finden
+    representatives = find_duplicates(contents)
+    unique = sorted(set(representatives))
+    metrics.add("duplicates", len(contents) - len(unique))
+    embeddings = _embed_with_cache(provider, [""] * len(unique), [contents[i] for i in unique])
+    rows = {index: row for row, index in enumerate(unique)}
+    return embeddings[[rows[index] for index in representatives]]
+
+
+def has_api_key(provider, openai_api_key):
+    """Prüft, ob der Anbieter ohne API-Schlüssel auskommt oder ein OpenAI-Schlüssel vorliegt."""
+    return not provider.requires_api_key or (openai_api_key and openai_api_key.startswith("sk-"))
+
+
+def _check_dimension(faiss_index, embeddings, provider):
+    if embeddings.shape[1] != faiss_index.d:
+        raise ValueError(
+            f"Der Index hat die Dimension {faiss_index.d}, {provider.name} liefert {embeddings.shape[1]}. "
+            "Bitte den Index mit dem aktuellen Embedding-Anbieter neu aufbauen."
+        )
+
+
+def embed_texts_cached(texts, openai_api_key, provider=None):
+    """
+    Erzeugt Embeddings für beliebige Texte (z.B. Suchanfragen oder Textabschnitte) über den Embedding-Cache.
+
+    Args:
+    - texts (list): Die Texte.
+    - openai_api_key (str): Der API-Schlüssel für OpenAI.
+    - provider (EmbeddingProvider): Der Embedding-Anbieter (Standard: get_embedding_provider).
+
+    Returns:
+    - np.ndarray: float32-Matrix mit einer Zeile pro Text.
+    """
+    provider = provider or get_embedding_provider(openai_api_key)
+    return _embed_with_cache(provider, [""] * len(texts), texts)
+
+
+def _email_ids(emails):
+    return np.array([email_data["uid"] for email_data in emails], dtype=np.int64)
+
+
+def choose_index_type(vector_count, index_type=None):
+    """
+    Wählt den Index-Typ für eine Anzahl an Vektoren.
+
+    Args:
+    - vector_count (int): Anzahl der zu indexierenden Vektoren.
+    - index_type (str): "auto", "flat", "hnsw" oder "ivfpq" (Standard: INDEX_TYPE).
+
+    Returns:
+    - str: Der Index-Typ.
+    """
+    index_type = index_type or INDEX_TYPE
+    if index_type == INDEX_AUTO:
+        if vector_count >= IVFPQ_MIN_VECTORS:
+            return INDEX_IVFPQ
+        if vector_count >= HNSW_MIN_VECTORS:
+            return INDEX_HNSW
+        return INDEX_FLAT
+    if index_type not in (INDEX_FLAT, INDEX_HNSW, INDEX_IVFPQ):
+        raise ValueError(f"Unbekannter Index-Typ: {index_type}")
+    return index_type
+
+
+def index_type_of(faiss_index):
+    """Liefert den Index-Typ eines mit generate_faiss_index erstellten Index."""
+    if isinstance(faiss_index, faiss.IndexIVF):
+        return INDEX_IVFPQ
+    if isinstance(faiss.downcast_index(faiss_index.index), faiss.IndexHNSW):
+        return INDEX_HNSW
+    return INDEX_FLAT
+
+
+def needs_upgrade(faiss_index, index_type=None):
+    """
+    Prüft, ob der Index für seine aktuelle Größe auf einen skalierbareren Typ umgestellt werden sollte.
+
+    Args:
+    - faiss_index (faiss.Index): Der Index aus generate_faiss_index.
+    - index_type (str): "auto", "flat", "hnsw" oder "ivfpq" (Standard: INDEX_TYPE).
+
+    Returns:
+    - bool: True, wenn der Index neu aufgebaut werden sollte.
+    """
+    order = [INDEX_FLAT, INDEX_HNSW, INDEX_IVFPQ]
+    wanted = choose_index_type(faiss_index.ntotal, index_type)
+    if wanted == INDEX_IVFPQ and faiss_index.ntotal < IVFPQ_MIN_TRAINING_VECTORS:
+        # Zu wenige Vektoren zum Trainieren, _create_index fällt auf einen flachen Index zurück
+        return False
+    return order.index(wanted) > order.index(index_type_of(faiss_index))
+
+
+def _pq_subquantizers(dimension):
+    # Die Dimension muss durch die Anzahl der Subquantisierer teilbar sein
+    for m in (64, 48, 32, 16, 8, 4, 2, 1):
+        if dimension % m == 0:
+            return m
+
+
+def _create_index(index_type, embeddings):
+    dimension = embeddings.shape[1]
+    if index_type == INDEX_HNSW:
+        # Inneres Produkt über normierte Vektoren entspricht der Kosinus-Ähnlichkeit
+        base = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        base.hnsw.efSearch = HNSW_EF_SEARCH
+        return faiss.IndexIDMap2(base)
+    if index_type == INDEX_IVFPQ and len(embeddings) >= IVFPQ_MIN_TRAINING_VECTORS:
+        nlist = min(int(4 * math.sqrt(len(embeddings))), len(embeddings) // IVF_TRAINING_POINTS_PER_LIST)
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, _pq_subquantizers(dimension), IVFPQ_BITS)
+        index.train(embeddings)
+        index.nprobe = min(IVFPQ_NPROBE, nlist)
+        # IVF speichert die IDs selbst; ein IndexIDMap2 darum würde beim Löschen die Zuordnung verlieren
+        return index
+    # Bei zu wenigen Trainingsvektoren für IVF-PQ ein flacher Index
+    return faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
+
+def generate_faiss_index(emails, openai_api_key, index_type=None, provider=None):
+    """
+    Erstellt einen FAISS-Index über die E-Mails, adressiert über ihre UIDs.
+
+    Args:
+    - emails (list): E-Mails mit geladenem Inhalt ("message") und "uid".
+    - openai_api_key (str): Der API-Schlüssel für OpenAI.
+    - index_type (str): "auto", "flat", "hnsw" oder "ivfpq" (Standard: INDEX_TYPE).
+    - provider (EmbeddingProvider): Der Embedding-Anbieter (Standard: get_embedding_provider).
+
+    Returns:
+    - tuple: (faiss.Index, dict UID -> E-Mail)
+    """
     try:
-        if not openai_api_key or not openai_api_key.startswith("sk-"):
+        provider = provider or get_embedding_provider(openai_api_key)
+        if not has_api_key(provider, openai_api_key):
             st.error("⚠️ Kein gültiger OpenAI API Key vorhanden.")
-            return
-        
-        client = openai.OpenAI(api_key=openai_api_key)
-        embeddings = []
-        for email_data in emails:
-            message = email_data["message"]
-            if message.is_multipart():
-                for part in message.walk():
-                    content_type = part.get_content_type()
-                    try:
-                        if content_type == "text/plain":
-                            content = part.get_payload(decode=True).decode()
-                            break
-                    except:
-                        pass
-            else:
-                content = message.get_payload(decode=True).decode()
-            
-            # Generieren des Embeddings mit den neuen Parametern
-            response = client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=content,
-            )
-            embedding = response.data[0].embedding
-            embeddings.append(embedding)
-
-        # FAISS Index initialisieren
-        dimension = len(embeddings[0])
-        index = faiss.IndexFlatL2(dimension)
-        index.add(np.array(embeddings, dtype=np.float32))
-
-        return index, emails
+            return None, None
+
+        with metrics.span("generate_faiss_index", provider=provider.name) as current:
+            current.add("emails", len(emails))
+            embeddings = _embed_emails(emails, provider)
+            faiss.normalize_L2(embeddings)
+
+            # FAISS Index initialisieren, die IDs sind die UIDs der E-Mails
+            index = _create_index(choose_index_type(len(emails), index_type), embeddings)
+            index.add_with_ids(embeddings, _email_ids(emails))
+
+        return index, {email_data["uid"]: email_data for email_data in emails}
     except Exception as e:
         st.error(f"Fehler beim Erstellen des FAISS-Indexes: {e}")
         return None, None
 
 
-def search_faiss_index(search_query, faiss_index, email_vectors, openai_api_key):
+def _remove_ids(faiss_index, ids):
+    try:
+        faiss_index.remove_ids(ids)
+        return faiss_index
+    except RuntimeError:
+        # HNSW unterstützt kein Löschen: ohne die gelöschten IDs neu aufbauen
+        all_ids = faiss.vector_to_array(faiss_index.id_map)
+        keep = ~np.isin(all_ids, ids)
+        vectors = faiss_index.index.reconstruct_n(0, faiss_index.ntotal)[keep]
+        rebuilt = _create_index(index_type_of(faiss_index), vectors)
+        rebuilt.add_with_ids(vectors, all_ids[keep])
+        return rebuilt
+
+
+def update_faiss_index(faiss_index, new_emails, removed_uids, openai_api_key, provider=None):
+    """
+    Aktualisiert einen bestehenden FAISS-Index, ohne ihn neu aufzubauen.
+
+    Args:
+    - faiss_index (faiss.Index): Der Index aus generate_faiss_index.
+    - new_emails (list): Neue E-Mails mit geladenem Inhalt.
+    - removed_uids (list): UIDs gelöschter E-Mails.
+    - openai_api_key (str): Der API-Schlüssel für OpenAI.
+    - provider (EmbeddingProvider): Der Embedding-Anbieter, mit dem der Index erstellt wurde.
+
+    Returns:
+    - faiss.Index: Der aktualisierte Index, bei HNSW nach dem Löschen ein neues Objekt.
+    """
+    if removed_uids:
+        faiss_index = _remove_ids(faiss_index, np.array(list(removed_uids), dtype=np.int64))
+
+    if new_emails:
+        provider = provider or get_embedding_provider(openai_api_key)
+        with metrics.span("update_faiss_index", provider=provider.name) as current:
+            current.add("emails", len(new_emails))
+            embeddings = _embed_emails(new_emails, provider)
+            _check_dimension(faiss_index, embeddings, provider)
+            faiss.normalize_L2(embeddings)
+            faiss_index.add_with_ids(embeddings, _email_ids(new_emails))
+
+    return faiss_index
+
+
+def embed_emails(emails, openai_api_key, provider=None):
+    """
+    Berechnet normalisierte Embeddings für E-Mails, ohne einen Index zu verändern.
+
+    Zusammen mit add_embeddings kann so außerhalb einer Sperre embeddet und nur das
+    Hinzufügen zum Index gesperrt werden.
+
+    Args:
+    - emails (list): E-Mails mit geladenem Inhalt.
+    - openai_api_key (str): Der API-Schlüssel für OpenAI.
+    - provider (EmbeddingProvider): Der Embedding-Anbieter (Standard: get_embedding_provider).
+
+    Returns:
+    - np.ndarray: float32-Matrix mit einer Zeile pro E-Mail.
+    """
+    provider = provider or get_embedding_provider(openai_api_key)
+    with metrics.span("embed_emails", provider=provider.name) as current:
+        current.add("emails", len(emails))
+        embeddings = _embed_emails(emails, provider)
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def add_embeddings(faiss_index, embeddings, emails, provider, index_type=None):
+    """
+    Fügt mit embed_emails berechnete Embeddings zum Index hinzu.
+
+    Args:
+    - faiss_index (faiss.Index): Der Index oder None, dann wird ein neuer erstellt.
+    - embeddings (np.ndarray): Die Embeddings aus embed_emails.
+    - emails (list): Die zugehörigen E-Mails.
+    - provider (EmbeddingProvider): Der Embedding-Anbieter der Embeddings.
+    - index_type (str): Typ eines neuen Index (Standard: INDEX_TYPE).
+
+    Returns:
+    - faiss.Index: Der Index.
+    """
+    if faiss_index is None:
+        faiss_index = _create_index(choose_index_type(len(emails), index_type), embeddings)
+    else:
+        _check_dimension(faiss_index, embeddings, provider)
+    faiss_index.add_with_ids(embeddings, _email_ids(emails))
+    return faiss_index
+
+
+def save_faiss_index(faiss_index, path, **metadata):
+    """
+    Speichert einen Index mit faiss.write_index und Metadaten als JSON daneben.
+
+    Args:
+    - faiss_index (faiss.Index): Der Index.
+    - path (str): Der Dateipfad.
+    - metadata: Zusätzliche Angaben, z.B. die UIDVALIDITY.
+    """
+    # Erst in eine temporäre Datei schreiben, damit nie ein halber Index gelesen wird
+    faiss.write_index(faiss_index, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+    save_index_metadata(faiss_index, path, **metadata)
+
+
+def save_index_metadata(faiss_index, path, **metadata):
+    """
+    Schreibt nur die Metadaten eines unveränderten, bereits gespeicherten Index neu.
+
+    Args:
+    - faiss_index (faiss.Index): Der Index, wie er unter path gespeichert ist.
+    - path (str): Der Dateipfad des Index.
+    - metadata: Zusätzliche Angaben, z.B. der Abgleich-Stand der Ordner.
+    """
+    with open(f"{path}.json.tmp", "w", encoding="utf-8") as f:
+        json.dump({"index_type": index_type_of(faiss_index), "ntotal": faiss_index.ntotal, **metadata}, f)
+    os.replace(f"{path}.json.tmp", f"{path}.json")
+
+
+def load_faiss_index(path, mmap=True):
+    """
+    Lädt einen mit save_faiss_index gespeicherten Index.
+
+    Mit mmap=True wird der Index per Memory-Map gelesen und darf nicht verändert werden;
+    vor Änderungen mit mmap=False neu laden.
+
+    Args:
+    - path (str): Der Dateipfad.
+    - mmap (bool): Memory-Map statt vollständigem Einlesen.
+
+    Returns:
+    - tuple: (faiss.Index, dict Metadaten) oder (None, None), wenn keine Datei existiert.
+    """
+    if not os.path.exists(path) or not os.path.exists(f"{path}.json"):
+        return None, None
+    with open(f"{path}.json", "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    faiss_index = faiss.read_index(path, faiss.IO_FLAG_MMAP if mmap else 0)
+    return faiss_index, metadata
+
+
+def _search_parameters(faiss_index, allowed_uids):
+    """Suchparameter, die die Suche auf allowed_uids beschränken."""
+    selector = faiss.IDSelectorBatch(np.fromiter(allowed_uids, dtype=np.int64, count=len(allowed_uids)))
+    index_type = index_type_of(faiss_index)
+    if index_type == INDEX_IVFPQ:
+        # Alle Listen durchsuchen, sonst bleiben bei engen Filtern kaum Treffer übrig
+        return faiss.SearchParametersIVF(sel=selector, nprobe=faiss_index.nlist)
+    if index_type == INDEX_HNSW:
+        hnsw = faiss.downcast_index(faiss_index.index).hnsw
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=hnsw.efSearch * FILTERED_EF_FACTOR)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _filtered_search(faiss_index, query_embedding, top_k, allowed_uids):
+    if index_type_of(faiss_index) == INDEX_HNSW and len(allowed_uids) <= FILTERED_EXACT_MAX:
+        # Im HNSW-Graphen sind wenige erlaubte Knoten schwer erreichbar, daher exakt vergleichen;
+        # die Vektoren holt FAISS in einem Aufruf
+        uids = np.fromiter(allowed_uids, dtype=np.int64, count=len(allowed_uids))
+        uids = uids[np.isin(uids, faiss.vector_to_array(faiss_index.id_map))]
+        if not len(uids):
+            return np.full((1, top_k), -1, dtype=np.int64)
+        scores = faiss_index.reconstruct_batch(uids) @ query_embedding[0]
+        order = np.argsort(-scores)[:top_k]
+        return uids[order][np.newaxis, :]
+    _, I = faiss_index.search(query_embedding, k=top_k, params=_search_parameters(faiss_index, allowed_uids))
+    return I
+
+
+def search_faiss_index(search_query, faiss_index, email_vectors, openai_api_key, top_k=SEARCH_TOP_K,
+                       allowed_uids=None, provider=None):
     """
     Sucht relevante E-Mails im FAISS-Index basierend auf der Suchanfrage.
 
     Args:
     - search_query (str): Die Suchanfrage des Benutzers.
     - faiss_index (faiss.Index): Der FAISS-Index, in dem gesucht wird.
-    - email_vectors (list): Liste der E-Mails, die Vektoren enthalten.
+    - email_vectors (Mapping): UID -> E-Mail, z.B. der MessageStore des Kontos.
     - openai_api_key (str): Der API-Schlüssel für OpenAI.
+    - top_k (int): Maximale Anzahl Treffer.
+    - allowed_uids (set): Optional nur unter diesen UIDs suchen (z.B. nach Datum gefiltert).
+    - provider (EmbeddingProvider): Der Embedding-Anbieter, mit dem der Index erstellt wurde.
 
     Returns:
     - list: Eine Liste relevanter E-Mails.
     """
 
-    if not openai_api_key or not openai_api_key.startswith("sk-"):
+    provider = provider or get_embedding_provider(openai_api_key)
+    if not has_api_key(provider, openai_api_key):
         st.error("⚠️ Kein gültiger OpenAI API Key vorhanden.")
         return
 
+    if allowed_uids is not None and not allowed_uids:
+        return []
 
-    # Erzeuge OpenAI Client
-    client = openai.OpenAI(api_key=openai_api_key)
-
-    # Generiere das Embedding für die Suchanfrage
-    response = client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=search_query,
-    )
-    search_embedding = response.data[0].embedding
-    search_embedding = np.array([search_embedding], dtype=np.float32)
+    # Generiere das Embedding für die Suchanfrage (wiederholte Anfragen kommen aus dem Cache)
+    with metrics.span("embed_query", provider=provider.name):
+        search_embedding = embed_texts_cached([search_query], openai_api_key, provider)
+    _check_dimension(faiss_index, search_embedding, provider)
+    faiss.normalize_L2(search_embedding)
 
-    # Suche im FAISS-Index
-    D, I = faiss_index.search(search_embedding, k=5)
+    # Suche im FAISS-Index, vorgefilterte UIDs werden schon beim Suchen eingeschränkt
+    with metrics.span("search_faiss_index", index_type=index_type_of(faiss_index), filtered=allowed_uids is not None):
+        if allowed_uids is not None:
+            I = _filtered_search(faiss_index, search_embedding, top_k, allowed_uids)
+        else:
+            D, I = faiss_index.search(search_embedding, k=top_k)
 
     # Finde relevante E-Mails basierend auf den Indexen, die vom FAISS-Index zurückgegeben wurden
-    search_results = [email_vectors[i] for i in I[0] if i != -1]
+    search_results = [email_vectors[i] for i in I[0] if i != -1 and i in email_vectors]
 
     return search_results
-
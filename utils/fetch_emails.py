@@ -1,53 +1,334 @@
-import imaplib
+import base64
 import email
+import os
+import re
+from datetime import datetime, timezone
 from email.header import decode_header
 import streamlit as st
 
-def fetch_emails(email_address, email_password, imap_server, page=0, page_size=20):
+from utils import metrics
+from utils.bodystructure import body_parts, build_text_message, decode_part, parse_fetch_response, split_parts
+from utils.imap_pool import get_imap_pool
+from utils.threads import parse_message_ids
+
+# Für die Listenansicht werden nur Metadaten und wenige Header abgerufen
+LIST_FETCH_ITEMS = (
+    "(UID FLAGS INTERNALDATE RFC822.SIZE "
+    "BODY.PEEK[HEADER.FIELDS (SUBJECT FROM DATE MESSAGE-ID IN-REPLY-TO REFERENCES)])"
+)
+
+_UID_RE = re.compile(rb"UID (\d+)")
+_SIZE_RE = re.compile(rb"RFC822\.SIZE (\d+)")
+_INTERNALDATE_RE = re.compile(rb'INTERNALDATE "([^"]+)"')
+_FLAGS_RE = re.compile(rb"FLAGS \(([^)]*)\)")
+_LIST_RE = re.compile(rb'\((?P<flags>[^)]*)\) (?P<delimiter>"[^"]*"|NIL) (?P<name>.+)')
+_UTF7_RE = re.compile(r"&([^-]*)-")
+
+# Inhalte nur über die Textteile laden (BODYSTRUCTURE), Anhänge werden nicht übertragen
+PARTIAL_BODY_FETCH = os.environ.get("MAIL_BOT_PARTIAL_FETCH", "1") != "0"
+
+# Ordner mit diesen Attributen (RFC 6154) werden beim Abgleich aller Ordner übersprungen
+SKIPPED_FOLDER_FLAGS = ("\\noselect", "\\nonexistent", "\\junk", "\\trash")
+
+
+def _decode_header_value(value):
+    """Dekodiert einen (ggf. RFC 2047 kodierten) Header vollständig zu einem String."""
+    if value is None:
+        return ""
+    parts = []
+    for text, charset in decode_header(value):
+        if isinstance(text, bytes):
+            try:
+                text = text.decode(charset or "utf-8", errors="replace")
+            except LookupError:
+                text = text.decode("utf-8", errors="replace")
+        parts.append(text)
+    return "".join(parts)
+
+
+def _parse_date(date_str, internaldate=None):
+    """Liest das Datum aus dem Date-Header, ersatzweise aus INTERNALDATE."""
+    if date_str:
+        try:
+            return email.utils.parsedate_to_datetime(date_str)
+        except (TypeError, ValueError):
+            pass
+    if internaldate:
+        return datetime.strptime(internaldate.strip(), "%d-%b-%Y %H:%M:%S %z")
+    return datetime.fromtimestamp(0, tz=timezone.utc)
+
+
+def _email_from_headers(msg, uid=None, size=None, internaldate=None, flags=()):
+    return {
+        "uid": uid,
+        "flags": flags,
+        "message_id": msg["Message-ID"],
+        "in_reply_to": parse_message_ids(msg["In-Reply-To"]),
+        "references": parse_message_ids(msg["References"]),
+        "subject": _decode_header_value(msg["Subject"]),
+        "sender": _decode_header_value(msg["From"]),
+        "date": _parse_date(msg["Date"], internaldate),
+        "size": size,
+        "message": None,
+    }
+
+
+def parse_flags(meta):
+    """Liest die FLAGS aus einer FETCH-Antwortzeile."""
+    flags = _FLAGS_RE.search(meta)
+    return tuple(flags.group(1).decode().split()) if flags else ()
+
+
+def quote_mailbox(name):
+    """Setzt einen Ordnernamen für IMAP-Befehle in Anführungszeichen (imaplib tut das nicht)."""
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def decode_mailbox_name(name):
+    """Dekodiert einen Ordnernamen in modifiziertem UTF-7 (RFC 3501), z.B. "Entw&APw-rfe"."""
+    def decode(match):
+        if not match.group(1):
+            return "&"
+        data = match.group(1).replace(",", "/")
+        return base64.b64decode(data + "=" * (-len(data) % 4)).decode("utf-16-be")
+    return _UTF7_RE.sub(decode, name)
+
+
+def list_folders(mail, skipped_flags=SKIPPED_FOLDER_FLAGS):
+    """
+    Listet die Ordner eines Kontos per LIST.
+
+    Args:
+    - mail (imaplib.IMAP4): Eine angemeldete Verbindung.
+    - skipped_flags (tuple): Ordner mit einem dieser Attribute auslassen (klein geschrieben).
+
+    Returns:
+    - list: Die Ordnernamen, wie sie für SELECT verwendet werden.
+    """
+    _, data = mail.list()
+    folders = []
+    for line in data:
+        name = None
+        if isinstance(line, tuple):
+            # Namen mit Sonderzeichen kommen als Literal
+            line, name = line[0], line[1].decode("utf-8", "replace")
+        match = _LIST_RE.match(line or b"")
+        if match is None:
+            continue
+        flags = match.group("flags").decode().lower().split()
+        if any(flag in skipped_flags for flag in flags):
+            continue
+        if name is None:
+            name = match.group("name").decode("utf-8", "replace")
+            if name.startswith('"') and name.endswith('"'):
+                name = name[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+        folders.append(name)
+    return folders
+
+
+def _response_bytes(msg_data):
+    """Größe einer FETCH-Antwort in Bytes."""
+    size = 0
+    for response_part in msg_data:
+        if isinstance(response_part, tuple):
+            size += sum(len(part) for part in response_part)
+        elif isinstance(response_part, bytes):
+            size += len(response_part)
+    return size
+
+
+def parse_list_response(msg_data):
+    """Zerlegt die Antwort eines FETCH mit LIST_FETCH_ITEMS in E-Mail Einträge."""
+    metrics.add("bytes", _response_bytes(msg_data))
+    emails = []
+    for response_part in msg_data:
+        if not isinstance(response_part, tuple):
+            continue
+        meta, header_bytes = response_part
+        uid = _UID_RE.search(meta)
+        size = _SIZE_RE.search(meta)
+        internaldate = _INTERNALDATE_RE.search(meta)
+        msg = email.message_from_bytes(header_bytes)
+        emails.append(_email_from_headers(
+            msg,
+            uid=int(uid.group(1)) if uid else None,
+            size=int(size.group(1)) if size else None,
+            internaldate=internaldate.group(1).decode() if internaldate else None,
+            flags=parse_flags(meta),
+        ))
+    return emails
+
+
+def _fetch_page(mail, page, page_size, headers_only, mailbox):
+    status, select_data = mail.select(quote_mailbox(mailbox))
+
+    if headers_only:
+        # SELECT liefert die Anzahl der Nachrichten, ein SEARCH ist nicht nötig
+        total_messages = int(select_data[0])
+        end = total_messages - page * page_size
+        start = max(end - page_size, 0)
+        if end <= 0:
+            return []
+        _, msg_data = mail.fetch(f"{start + 1}:{end}", LIST_FETCH_ITEMS)
+        return parse_list_response(msg_data)
+
+    # Nachrichten abrufen
+    status, messages = mail.search(None, "ALL")
+    messages = messages[0].split()
+
+    # Pagination berechnen
+    total_messages = len(messages)
+    start = total_messages - (page + 1) * page_size
+    end = start + page_size
+    if start < 0:
+        start = 0
+
+    emails = []
+    for i in range(start, end):
+        if i < 0 or i >= total_messages:
+            continue
+        _, msg_data = mail.fetch(messages[i], "(UID RFC822)")
+        metrics.add("bytes", _response_bytes(msg_data))
+        for response_part in msg_data:
+            if isinstance(response_part, tuple):
+                msg = email.message_from_bytes(response_part[1])
+                uid = _UID_RE.search(response_part[0])
+                email_data = _email_from_headers(msg, uid=int(uid.group(1)) if uid else None)
+                email_data["message"] = msg
+                emails.append(email_data)
+
+    return emails
+
+
+def fetch_emails(email_address, email_password, imap_server, page=0, page_size=20, headers_only=False,
+                 mailbox="INBOX"):
+    """
+    Ruft eine Seite E-Mails aus einem Ordner (Standard: Inbox) ab.
+
+    Args:
+    - email_address (str): Die E-Mail-Adresse.
+    - email_password (str): Das Passwort.
+    - imap_server (str): Der IMAP Server.
+    - page (int): Die Seite, von den neuesten E-Mails aus gezählt.
+    - page_size (int): Anzahl der E-Mails pro Seite.
+    - headers_only (bool): Nur Betreff, Absender, Datum, Message-ID und Verlauf in einem einzigen FETCH abrufen.
+      Der Inhalt ("message") bleibt None und kann mit fetch_messages_by_uid nachgeladen werden.
+    - mailbox (str): Der Ordner.
+
+    Returns:
+    - list: Eine Liste von E-Mails als dict.
+    """
     try:
-        # IMAP Verbindung aufbauen
-        mail = imaplib.IMAP4_SSL(imap_server)
-        mail.login(email_address, email_password)
-        mail.select("inbox")
-
-        # Nachrichten abrufen
-        status, messages = mail.search(None, "ALL")
-        messages = messages[0].split()
-
-        # Pagination berechnen
-        total_messages = len(messages)
-        start = total_messages - (page + 1) * page_size
-        end = start + page_size
-        if start < 0:
-            start = 0
-
-        emails = []
-        for i in range(start, end):
-            if i < 0 or i >= total_messages:
-                continue
-            _, msg_data = mail.fetch(messages[i], "(RFC822)")
-            for response_part in msg_data:
-                if isinstance(response_part, tuple):
-                    msg = email.message_from_bytes(response_part[1])
-                    subject = decode_header(msg["Subject"])[0][0]
-                    sender = decode_header(msg["From"])[0][0]
-                    # Korrekte Datums-Extraktion
-                    date_str = msg["Date"]
-                    # Optional: Konvertierung in datetime-Objekt
-                    date = email.utils.parsedate_to_datetime(date_str)
-                    if isinstance(subject, bytes):
-                        subject = subject.decode()
-                    if isinstance(sender, bytes):
-                        sender = sender.decode()
-
-                    emails.append({
-                        "subject": subject,
-                        "sender": sender,
-                        "date": date,
-                        "message": msg
-                    })
-
-        return emails
+        # Angemeldete IMAP Verbindung aus dem Pool verwenden
+        with metrics.span("fetch_emails", headers_only=headers_only) as current:
+            with get_imap_pool().connection(email_address, email_password, imap_server) as mail:
+                emails = _fetch_page(mail, page, page_size, headers_only, mailbox)
+            current.add("emails", len(emails))
+            return emails
     except Exception as e:
         st.error(f"Fehler beim Abrufen der E-Mails: {e}")
         return []
+
+
+def fetch_raw_messages_by_uid(mail, uids):
+    """
+    Lädt vollständige Rohnachrichten mit einem einzigen UID FETCH.
+
+    Args:
+    - mail (imaplib.IMAP4): Verbindung mit ausgewähltem Postfach.
+    - uids (list): Die UIDs der Nachrichten.
+
+    Returns:
+    - dict: UID -> RFC822 bytes
+    """
+    if not uids:
+        return {}
+    with metrics.span("imap_fetch_bodies") as current:
+        _, msg_data = mail.uid("FETCH", ",".join(str(uid) for uid in uids), "(UID BODY.PEEK[])")
+        current.add("bytes", _response_bytes(msg_data))
+        current.add("emails", len(uids))
+    messages = {}
+    for response_part in msg_data:
+        if isinstance(response_part, tuple):
+            uid = _UID_RE.search(response_part[0])
+            if uid:
+                messages[int(uid.group(1))] = response_part[1]
+    return messages
+
+
+def fetch_messages_by_uid(mail, uids):
+    """
+    Lädt vollständige Nachrichten mit einem einzigen UID FETCH.
+
+    Args:
+    - mail (imaplib.IMAP4): Verbindung mit ausgewähltem Postfach.
+    - uids (list): Die UIDs der Nachrichten.
+
+    Returns:
+    - dict: UID -> email.message.Message
+    """
+    return {uid: email.message_from_bytes(raw) for uid, raw in fetch_raw_messages_by_uid(mail, uids).items()}
+
+
+def fetch_text_messages_by_uid(mail, uids):
+    """
+    Lädt nur die Textteile von Nachrichten, ohne Anhänge.
+
+    Zuerst werden BODYSTRUCTURE und Header abgerufen, danach pro Gruppe gleich aufgebauter
+    Nachrichten die Teile text/plain bzw. text/html vollständig mit BODY.PEEK[<teil>].
+    Aus Header und Textteilen wird eine Nachricht ohne Anhänge zusammengesetzt; sie wird
+    angezeigt und zusammengefasst und darf daher nicht gekürzt sein.
+
+    Args:
+    - mail (imaplib.IMAP4): Verbindung mit ausgewähltem Postfach.
+    - uids (list): Die UIDs der Nachrichten.
+
+    Returns:
+    - tuple: (dict UID -> RFC822 bytes ohne Anhänge, dict UID -> list Anhänge als dict mit
+      filename, mime_type und size). Nachrichten mit nicht lesbarer Struktur fehlen in beiden.
+    """
+    if not uids:
+        return {}, {}
+    with metrics.span("imap_fetch_bodies", partial=True) as current:
+        _, msg_data = mail.uid(
+            "FETCH", ",".join(str(uid) for uid in uids), "(UID BODYSTRUCTURE BODY.PEEK[HEADER])"
+        )
+        current.add("bytes", _response_bytes(msg_data))
+        structures = {}
+        for response in parse_fetch_response(msg_data):
+            try:
+                texts, attachments = split_parts(body_parts(response["BODYSTRUCTURE"]))
+                structures[int(response["UID"])] = (response["BODY[HEADER]"], texts, attachments)
+            except (KeyError, IndexError, TypeError, ValueError):
+                # Nicht lesbare Struktur: die Nachricht wird vollständig geladen
+                continue
+
+        # Nachrichten mit denselben Teilenummern teilen sich einen FETCH
+        groups = {}
+        for uid, (_, texts, _) in structures.items():
+            groups.setdefault(tuple(part["part"] for part in texts), []).append(uid)
+        contents = {}
+        for numbers, group in groups.items():
+            if not numbers:
+                continue
+            items = " ".join(f"BODY.PEEK[{number}]" for number in numbers)
+            _, msg_data = mail.uid("FETCH", ",".join(str(uid) for uid in group), f"(UID {items})")
+            current.add("bytes", _response_bytes(msg_data))
+            for response in parse_fetch_response(msg_data):
+                contents[int(response["UID"])] = response
+        current.add("emails", len(structures))
+
+    messages, attachments = {}, {}
+    for uid, (header, texts, parts) in structures.items():
+        response = contents.get(uid, {})
+        bodies = []
+        for part in texts:
+            data = response.get(f"BODY[{part['part']}]") or b""
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            bodies.append((part["type"].split("/")[1], decode_part(data, part["encoding"], part["charset"])))
+        messages[uid] = build_text_message(header if isinstance(header, bytes) else b"", bodies)
+        attachments[uid] = [
+            {"filename": part["filename"], "mime_type": part["type"], "size": part["size"]} for part in parts
+        ]
+    return messages, attachments
@@ -0,0 +1,228 @@
+import re
+from datetime import datetime, timedelta
+
+from utils import metrics
+from utils.embedding_providers import get_embedding_provider
+from utils.faiss_utils import SEARCH_TOP_K, search_faiss_index
+from utils.keyword_index import tokenize
+
+# Konstante der Reciprocal Rank Fusion
+RRF_K = 60
+# Aus beiden Verfahren werden mehr Kandidaten geholt, als am Ende angezeigt werden
+CANDIDATE_FACTOR = 4
+
+_SENDER_RE = re.compile(r"\b(?:von|from):(\"[^\"]+\"|\S+)", re.IGNORECASE)
+_SINCE_RE = re.compile(r"\b(?:seit|ab|after|since):(\S+)", re.IGNORECASE)
+_UNTIL_RE = re.compile(r"\b(?:bis|before|until):(\S+)", re.IGNORECASE)
+_FOLDER_RE = re.compile(r"\b(?:ordner|folder|in):(\"[^\"]+\"|\S+)", re.IGNORECASE)
+_QUOTED_RE = re.compile(r"\"([^\"]+)\"")
+
+# Relative Zeitangaben -> (Beginn, Ende) relativ zum heutigen Tag
+_RELATIVE_DATES = [
+    (re.compile(r"\b(heute|today)\b", re.IGNORECASE), lambda today: (today, None)),
+    (re.compile(r"\b(gestern|yesterday)\b", re.IGNORECASE), lambda today: (today - timedelta(days=1), today)),
+    (
+        re.compile(r"\b(diese woche|this week)\b", re.IGNORECASE),
+        lambda today: (today - timedelta(days=today.weekday()), None),
+    ),
+    (
+        re.compile(r"\b(letzte[rn]? woche|vergangene[rn]? woche|last week)\b", re.IGNORECASE),
+        lambda today: (
+            today - timedelta(days=today.weekday() + 7), today - timedelta(days=today.weekday())
+        ),
+    ),
+    (
+        re.compile(r"\b(diese[nm]? monat|this month)\b", re.IGNORECASE),
+        lambda today: (today.replace(day=1), None),
+    ),
+    (
+        re.compile(r"\b(letzte[nm]? monat|vergangene[nm]? monat|last month)\b", re.IGNORECASE),
+        lambda today: ((today.replace(day=1) - timedelta(days=1)).replace(day=1), today.replace(day=1)),
+    ),
+]
+
+
+class SearchQuery:
+    """Eine zerlegte Suchanfrage: Freitext und Filter nach Datum, Absender und Ordner."""
+
+    def __init__(self, text, since=None, until=None, sender=None, exact=False, folder=None):
+        self.text = text
+        self.since = since
+        self.until = until
+        self.sender = sender
+        self.folder = folder
+        # Begriffe in Anführungszeichen sollen wörtlich gefunden werden
+        self.exact = exact
+
+    @property
+    def has_filters(self):
+        return (
+            self.since is not None or self.until is not None or self.sender is not None
+            or self.folder is not None
+        )
+
+    @property
+    def is_keyword_query(self):
+        """
+        True, wenn die Anfrage ohne Embedding beantwortet werden kann: nur Filter, ein
+        wörtlicher Begriff oder Kennungen wie Rechnungsnummern und E-Mail-Adressen.
+        """
+        terms = self.text.split()
+        if not terms or self.exact:
+            return True
+        return all(any(char.isdigit() for char in term) or "@" in term for term in terms)
+
+
+def _parse_date(value):
+    for date_format in ("%d.%m.%Y", "%Y-%m-%d", "%d.%m.%y"):
+        try:
+            return datetime.strptime(value, date_format).astimezone()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_query(query, now=None):
+    """
+    Zerlegt eine Suchanfrage in Freitext und Filter.
+
+    Unterstützt werden "von:NAME" bzw. "from:NAME", "ordner:NAME" bzw. "in:NAME",
+    "seit:DATUM" und "bis:DATUM" (TT.MM.JJJJ oder JJJJ-MM-TT) sowie relative Angaben wie
+    "gestern" oder "letzte Woche".
+
+    Args:
+    - query (str): Die Suchanfrage.
+    - now (datetime): Bezugszeitpunkt für relative Angaben (Standard: jetzt).
+
+    Returns:
+    - SearchQuery: Die zerlegte Anfrage.
+    """
+    now = now or datetime.now().astimezone()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    since = until = sender = folder = None
+
+    match = _SENDER_RE.search(query)
+    if match:
+        sender = match.group(1).strip('"')
+        query = query[:match.start()] + query[match.end():]
+    match = _FOLDER_RE.search(query)
+    if match:
+        folder = match.group(1).strip('"')
+        query = query[:match.start()] + query[match.end():]
+    match = _SINCE_RE.search(query)
+    if match and _parse_date(match.group(1)):
+        since = _parse_date(match.group(1))
+        query = query[:match.start()] + query[match.end():]
+    match = _UNTIL_RE.search(query)
+    if match and _parse_date(match.group(1)):
+        # "bis" schließt den angegebenen Tag ein
+        until = _parse_date(match.group(1)) + timedelta(days=1)
+        query = query[:match.start()] + query[match.end():]
+    for pattern, date_range in _RELATIVE_DATES:
+        match = pattern.search(query)
+        if match:
+            since, until = date_range(today)
+            query = query[:match.start()] + query[match.end():]
+            break
+
+    exact = bool(_QUOTED_RE.search(query))
+    text = " ".join(_QUOTED_RE.sub(r"\1", query).split())
+    return SearchQuery(text, since, until, sender, exact, folder)
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Führt mehrere Trefferlisten über ihre Ränge zusammen.
+
+    Args:
+    - rankings (list): Listen von UIDs, bester Treffer zuerst.
+    - k (int): Dämpfungskonstante.
+
+    Returns:
+    - list: UIDs nach fusionierter Punktzahl, bester zuerst.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, uid in enumerate(ranking):
+            scores[uid] = scores.get(uid, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda uid: (-scores[uid], -uid))
+
+
+def group_by_thread(emails, top_k):
+    """
+    Fasst Treffer pro Verlauf zusammen: von jedem Verlauf bleibt der beste Treffer.
+
+    Args:
+    - emails (list): EmailHeader, bester Treffer zuerst.
+    - top_k (int): Maximale Anzahl Verläufe.
+
+    Returns:
+    - list: Höchstens top_k EmailHeader aus verschiedenen Verläufen.
+    """
+    threads = set()
+    grouped = []
+    for email_data in emails:
+        if email_data.thread in threads:
+            continue
+        threads.add(email_data.thread)
+        grouped.append(email_data)
+        if len(grouped) == top_k:
+            break
+    return grouped
+
+
+def hybrid_search(query, sync, openai_api_key, top_k=SEARCH_TOP_K):
+    """
+    Sucht E-Mails mit Stichwortsuche (BM25) und FAISS und fusioniert die Ränge.
+
+    Filter nach Datum und Absender schränken beide Suchen vorab ein. Reine Stichwort- oder
+    Filteranfragen werden lokal ohne API-Aufruf beantwortet. Pro Verlauf wird nur der beste
+    Treffer geliefert (group_by_thread).
+
+    Args:
+    - query (str): Die Suchanfrage.
+    - sync (MailboxSync): Der Abgleich-Zustand des Kontos mit Store, FAISS- und Stichwort-Index.
+    - openai_api_key (str): Der API-Schlüssel für OpenAI.
+    - top_k (int): Maximale Anzahl Treffer (Verläufe).
+
+    Returns:
+    - tuple: (list Treffer als EmailHeader, bool lokal beantwortet)
+    """
+    parsed = parse_query(query)
+    candidates = top_k * CANDIDATE_FACTOR
+    allowed_uids = None
+    if parsed.has_filters:
+        allowed_uids = sync.store.filter_uids(parsed.since, parsed.until, parsed.sender, parsed.folder)
+
+    if not parsed.text:
+        # Nur Filter: die neuesten passenden E-Mails
+        uids = sync.store.uids()
+        if allowed_uids is not None:
+            uids = [uid for uid in uids if uid in allowed_uids]
+        return group_by_thread(sync.store.get_headers(uids[:candidates]), top_k), True
+
+    # Der Hintergrund-Abgleich ändert die Indexe nur unter sync.lock
+    with sync.lock, metrics.span("keyword_search"):
+        keyword_uids = [uid for uid, _ in sync.keyword_index.search(parsed.text, candidates, allowed_uids)]
+    if parsed.exact:
+        # Wörtliche Suche: alle Begriffe müssen vorkommen
+        terms = set(tokenize(parsed.text))
+        keyword_uids = [uid for uid in keyword_uids if terms <= sync.keyword_index.terms(uid)]
+    if parsed.is_keyword_query or sync.faiss_index is None:
+        return group_by_thread(sync.store.get_headers(keyword_uids), top_k), True
+
+    provider = get_embedding_provider(openai_api_key)
+    if sync.index_provider != provider.name:
+        raise ValueError(
+            f"Der Index wurde mit {sync.index_provider} erstellt, konfiguriert ist {provider.name}. "
+            "Bitte das Postfach aktualisieren, um den Index neu aufzubauen."
+        )
+    with sync.lock:
+        if sync.faiss_index is None:
+            # Der Index wird gerade neu aufgebaut
+            return group_by_thread(sync.store.get_headers(keyword_uids), top_k), True
+        vector_results = search_faiss_index(
+            parsed.text, sync.faiss_index, sync.store, openai_api_key, candidates, allowed_uids, provider
+        ) or []
+    fused = reciprocal_rank_fusion([keyword_uids, [email_data["uid"] for email_data in vector_results]])
+    return group_by_thread(sync.store.get_headers(fused), top_k), False
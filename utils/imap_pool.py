@@ -0,0 +1,208 @@
+import atexit
+import hashlib
+import imaplib
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+
+# Maximale Anzahl gleichzeitiger Verbindungen pro Konto
+MAX_CONNECTIONS_PER_ACCOUNT = 3
+# Verbindungen, die länger ungenutzt waren, werden bei der Ausgabe per NOOP geprüft
+HEALTH_CHECK_AFTER = 5
+# Intervall, in dem ungenutzte Verbindungen per NOOP am Leben gehalten werden
+KEEPALIVE_INTERVAL = 60
+# Ungenutzte Verbindungen werden danach geschlossen (Server trennen meist nach 30 Minuten)
+MAX_IDLE_TIME = 25 * 60
+# Maximale Wartezeit auf eine freie Verbindung
+CHECKOUT_TIMEOUT = 30
+
+_CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+class _PooledConnection:
+    __slots__ = ("mail", "last_used")
+
+    def __init__(self, mail):
+        self.mail = mail
+        self.last_used = time.monotonic()
+
+
+class _AccountSlot:
+    def __init__(self):
+        self.idle = []
+        self.in_use = 0
+
+
+class IMAPConnectionPool:
+    """
+    Prozessweiter Pool angemeldeter IMAP Verbindungen.
+
+    Verbindungen werden pro Konto (Adresse, Server und Passwort-Hash) wiederverwendet,
+    bei der Ausgabe geprüft, im Hintergrund per NOOP am Leben gehalten und bei
+    Verbindungsabbruch neu aufgebaut.
+    """
+
+    def __init__(self, max_per_account=MAX_CONNECTIONS_PER_ACCOUNT, keepalive_interval=KEEPALIVE_INTERVAL):
+        self.max_per_account = max_per_account
+        self._slots = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        if keepalive_interval:
+            thread = threading.Thread(target=self._keepalive_loop, args=(keepalive_interval,), daemon=True)
+            thread.start()
+
+    @staticmethod
+    def _key(email_address, email_password, imap_server):
+        # Das Passwort gehört zum Schlüssel, damit niemand mit falschem Passwort eine angemeldete Verbindung erhält
+        password_hash = hashlib.sha256(email_password.encode("utf-8")).hexdigest()
+        return (email_address.lower(), imap_server, password_hash)
+
+    @staticmethod
+    def _open(email_address, email_password, imap_server):
+        mail = _connect(imap_server)
+        try:
+            mail.login(email_address, email_password)
+        except Exception:
+            _close(mail)
+            raise
+        return _PooledConnection(mail)
+
+    @staticmethod
+    def _is_healthy(pooled):
+        try:
+            status, _ = pooled.mail.noop()
+            return status == "OK"
+        except _CONNECTION_ERRORS + (imaplib.IMAP4.error,):
+            return False
+
+    def _checkout(self, key):
+        deadline = time.monotonic() + CHECKOUT_TIMEOUT
+        with self._condition:
+            slot = self._slots.setdefault(key, _AccountSlot())
+            while not slot.idle and slot.in_use >= self.max_per_account:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Keine freie IMAP Verbindung verfügbar.")
+                self._condition.wait(remaining)
+            slot.in_use += 1
+            return slot.idle.pop() if slot.idle else None
+
+    def _release(self, key, pooled):
+        with self._condition:
+            slot = self._slots[key]
+            slot.in_use -= 1
+            if pooled is not None and not self._closed:
+                pooled.last_used = time.monotonic()
+                slot.idle.append(pooled)
+                pooled = None
+            self._condition.notify()
+        if pooled is not None:
+            _close(pooled.mail)
+
+    @contextmanager
+    def connection(self, email_address, email_password, imap_server):
+        """
+        Leiht eine angemeldete IMAP Verbindung aus dem Pool aus.
+
+        Args:
+        - email_address (str): Die E-Mail-Adresse.
+        - email_password (str): Das Passwort.
+        - imap_server (str): Der IMAP Server.
+
+        Yields:
+        - imaplib.IMAP4_SSL: Die angemeldete Verbindung.
+        """
+        key = self._key(email_address, email_password, imap_server)
+        pooled = self._checkout(key)
+        try:
+            if pooled is not None and time.monotonic() - pooled.last_used > HEALTH_CHECK_AFTER:
+                if not self._is_healthy(pooled):
+                    _close(pooled.mail)
+                    pooled = None
+            if pooled is None:
+                pooled = self._open(email_address, email_password, imap_server)
+        except BaseException:
+            self._release(key, None)
+            raise
+
+        try:
+            yield pooled.mail
+        except _CONNECTION_ERRORS:
+            # Abgebrochene Verbindungen nicht zurück in den Pool legen
+            self._release(key, None)
+            _close(pooled.mail)
+            raise
+        except BaseException:
+            self._release(key, pooled)
+            raise
+        else:
+            self._release(key, pooled)
+
+    def _keepalive_loop(self, interval):
+        while not self._closed:
+            time.sleep(interval)
+            self.keepalive()
+
+    def keepalive(self):
+        """Sendet NOOP auf länger ungenutzten Verbindungen und schließt abgelaufene oder tote Verbindungen."""
+        now = time.monotonic()
+        with self._condition:
+            due = []
+            for key, slot in self._slots.items():
+                for pooled in list(slot.idle):
+                    if now - pooled.last_used >= KEEPALIVE_INTERVAL:
+                        slot.idle.remove(pooled)
+                        slot.in_use += 1
+                        due.append((key, pooled))
+
+        for key, pooled in due:
+            if now - pooled.last_used > MAX_IDLE_TIME or not self._is_healthy(pooled):
+                _close(pooled.mail)
+                self._release(key, None)
+            else:
+                # NOOP zählt nicht als Nutzung, damit MAX_IDLE_TIME weiter greift
+                last_used = pooled.last_used
+                self._release(key, pooled)
+                pooled.last_used = last_used
+
+    def close_all(self):
+        """Meldet alle ungenutzten Verbindungen ab."""
+        with self._condition:
+            self._closed = True
+            idle = [pooled for slot in self._slots.values() for pooled in slot.idle]
+            for slot in self._slots.values():
+                slot.idle.clear()
+            self._condition.notify_all()
+        for pooled in idle:
+            _close(pooled.mail)
+
+
+def _connect(imap_server):
+    """
+    Baut die Verbindung zu einem IMAP Server auf.
+
+    "host" oder "host:port" verbinden per SSL, "imap://host:port" ohne Verschlüsselung
+    (nur für lokale Testserver, z.B. in den Benchmarks).
+    """
+    if imap_server.startswith("imap://"):
+        host, _, port = imap_server[len("imap://"):].partition(":")
+        return imaplib.IMAP4(host, int(port or imaplib.IMAP4_PORT))
+    host, _, port = imap_server.removeprefix("imaps://").partition(":")
+    return imaplib.IMAP4_SSL(host, int(port or imaplib.IMAP4_SSL_PORT))
+
+
+def _close(mail):
+    try:
+        mail.logout()
+    except Exception:
+        pass
+
+
+@st.cache_resource
+def get_imap_pool():
+    """Liefert den prozessweit geteilten IMAP Verbindungspool."""
+    pool = IMAPConnectionPool()
+    atexit.register(pool.close_all)
+    return pool
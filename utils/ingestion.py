@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+
+from utils.embedding_providers import get_embedding_provider
+from utils.faiss_utils import has_api_key
+from utils.openai_client import PRIORITY_BULK, request_priority
+
+# E-Mails pro Batch: nach jedem Batch ist der Index um diese E-Mails durchsuchbar
+INGEST_BATCH_SIZE = int(os.environ.get("MAIL_BOT_INGEST_BATCH_SIZE", "50"))
+# Fehlgeschlagene E-Mails werden einzeln erneut versucht, mit wachsender Wartezeit
+INGEST_RETRIES = 3
+INGEST_RETRY_DELAY = 2.0
+
+STATE_PENDING = "pending"
+STATE_SYNCING = "syncing"
+STATE_INDEXING = "indexing"
+STATE_RETRYING = "retrying"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+class IngestionWorker:
+    """
+    Gleicht ein Postfach im Hintergrund ab und baut den FAISS-Index schrittweise auf.
+
+    Zuerst werden die Header abgeglichen, danach sind die E-Mails sichtbar. Die Inhalte werden
+    dann in Batches (neueste zuerst) geladen, in den Stichwort-Index aufgenommen, embeddet und
+    zum FAISS-Index hinzugefügt, sodass die Suche nach dem ersten Batch die neuesten E-Mails
+    findet. Schlägt ein Batch fehl, werden seine E-Mails am Ende einzeln erneut
+    versucht; was dann noch fehlt, übernimmt der nächste Abgleich.
+    """
+
+    def __init__(self, sync, email_address, email_password, imap_server, openai_api_key,
+                 batch_size=INGEST_BATCH_SIZE):
+        self.sync = sync
+        self.email_address = email_address
+        self.email_password = email_password
+        self.imap_server = imap_server
+        self.openai_api_key = openai_api_key
+        self.batch_size = batch_size
+        self._progress = {
+            "state": STATE_PENDING, "new": 0, "total": 0, "indexed": 0, "failed": 0, "error": None,
+        }
+        self._lock = threading.Lock()
+        self._headers_ready = threading.Event()
+        self._thread = None
+
+    def _update(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                if key in ("indexed", "failed"):
+                    self._progress[key] += value
+                else:
+                    self._progress[key] = value
+
+    def progress(self):
+        """
+        Liefert den aktuellen Stand.
+
+        Returns:
+        - dict: state, new (neue E-Mails), total (zu indexieren), indexed, failed und error.
+        """
+        with self._lock:
+            return dict(self._progress)
+
+    @property
+    def done(self):
+        return self.progress()["state"] in (STATE_DONE, STATE_FAILED)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wait_for_headers(self, timeout=None):
+        """
+        Wartet, bis die Header abgeglichen sind und die E-Mails angezeigt werden können.
+
+        Raises:
+        - RuntimeError: Wenn der Abgleich fehlgeschlagen ist.
+        """
+        self._headers_ready.wait(timeout)
+        progress = self.progress()
+        if progress["state"] == STATE_FAILED:
+            raise RuntimeError(progress["error"])
+
+    def _folder_errors(self):
+        errors = self.sync.folder_errors
+        if not errors:
+            return None
+        return "Ordner nicht abgeglichen: " + ", ".join(f"{folder} ({error})" for folder, error in errors.items())
+
+    def _index(self, uids, provider):
+        """Lädt die Inhalte und indexiert sie; liefert die UIDs ohne ladbaren Inhalt."""
+        self.sync.load_bodies(uids, self.email_address, self.email_password, self.imap_server)
+        missing = set(self.sync.store.missing_bodies(uids))
+        emails = self.sync.store.get_headers([uid for uid in uids if uid not in missing])
+        if emails:
+            self.sync.index_emails(emails, self.openai_api_key, provider)
+        self._update(indexed=len(emails))
+        return [uid for uid in uids if uid in missing]
+
+    def run(self):
+        """Führt den Abgleich im aufrufenden Thread aus."""
+        # Embeddings beim Indexieren weichen interaktiven Anfragen (Suche, Zusammenfassung)
+        with request_priority(PRIORITY_BULK):
+            provider = get_embedding_provider(self.openai_api_key)
+            try:
+                self._update(state=STATE_SYNCING)
+                new_emails, index_uids = self.sync.prepare(
+                    self.email_address, self.email_password, self.imap_server, self.openai_api_key, provider
+                )
+                self._update(
+                    state=STATE_INDEXING, new=len(new_emails), total=len(index_uids), error=self._folder_errors()
+                )
+                self._headers_ready.set()
+
+                if not has_api_key(provider, self.openai_api_key):
+                    # Ohne Schlüssel bleibt die Stichwortsuche über die Inhalte, der Index folgt
+                    # beim nächsten Abgleich
+                    for start in range(0, len(index_uids), self.batch_size):
+                        self.sync.load_bodies(
+                            index_uids[start:start + self.batch_size],
+                            self.email_address, self.email_password, self.imap_server,
+                        )
+                    self.sync.finish_index(self.openai_api_key, provider, index_uids)
+                    self._update(state=STATE_DONE, error="Kein gültiger OpenAI API Key vorhanden.")
+                    return
+
+                failed = []
+                for start in range(0, len(index_uids), self.batch_size):
+                    batch = index_uids[start:start + self.batch_size]
+                    try:
+                        failed.extend(self._index(batch, provider))
+                    except Exception as e:
+                        self._update(error=str(e))
+                        failed.extend(batch)
+
+                for attempt in range(INGEST_RETRIES):
+                    if not failed:
+                        break
+                    self._update(state=STATE_RETRYING)
+                    time.sleep(INGEST_RETRY_DELAY * 2 ** attempt)
+                    retry, failed = failed, []
+                    for uid in retry:
+                        try:
+                            failed.extend(self._index([uid], provider))
+                        except Exception as e:
+                            self._update(error=str(e))
+                            failed.append(uid)
+
+                self.sync.finish_index(self.openai_api_key, provider, failed)
+                self._update(state=STATE_DONE, failed=len(failed))
+                if not failed:
+                    self._update(error=self._folder_errors())
+            except Exception as e:
+                self._update(state=STATE_FAILED, error=str(e))
+            finally:
+                self._headers_ready.set()
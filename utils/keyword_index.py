@@ -0,0 +1,125 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from utils.email_body import get_email_text
+
+# BM25-Parameter
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Betreff und Absender zählen stärker als der Text
+SUBJECT_WEIGHT = 3
+SENDER_WEIGHT = 2
+
+_TOKEN_RE = re.compile(r"[\w@.\-]+")
+
+
+def tokenize(text):
+    """
+    Zerlegt einen Text in kleingeschriebene Suchbegriffe.
+
+    E-Mail-Adressen und Nummern wie "RE-2024-0815" bleiben als Ganzes erhalten, zusätzlich
+    werden ihre Bestandteile als eigene Begriffe aufgenommen.
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        token = token.strip(".-")
+        if not token:
+            continue
+        tokens.append(token)
+        parts = [part for part in re.split(r"[@.\-]", token) if part]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class KeywordIndex:
+    """
+    Invertierter Index mit BM25-Bewertung über Betreff, Absender und Text der E-Mails.
+
+    Dokumente werden über ihre UID adressiert und können einzeln hinzugefügt und entfernt werden.
+    """
+
+    def __init__(self):
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def _document_terms(self, email_data):
+        text = get_email_text(email_data) or ""
+        terms = Counter(tokenize(text))
+        for term in tokenize(email_data["subject"] or ""):
+            terms[term] += SUBJECT_WEIGHT
+        for term in tokenize(email_data["sender"] or ""):
+            terms[term] += SENDER_WEIGHT
+        return terms
+
+    def add(self, emails):
+        """Nimmt E-Mails auf, ohne geladenen Inhalt nur mit Betreff und Absender."""
+        documents = [(email_data["uid"], self._document_terms(email_data)) for email_data in emails]
+        with self._lock:
+            for uid, terms in documents:
+                self._remove(uid)
+                for term, count in terms.items():
+                    self._postings[term][uid] = count
+                self._doc_terms[uid] = terms
+                self._doc_lengths[uid] = sum(terms.values())
+                self._total_length += self._doc_lengths[uid]
+
+    def _remove(self, uid):
+        terms = self._doc_terms.pop(uid, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(uid, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(uid)
+
+    def remove(self, uids):
+        with self._lock:
+            for uid in uids:
+                self._remove(uid)
+
+    def terms(self, uid):
+        """Liefert die Begriffe einer E-Mail."""
+        with self._lock:
+            return set(self._doc_terms.get(uid, ()))
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def search(self, query, k=10, allowed_uids=None):
+        """
+        Sucht E-Mails mit BM25.
+
+        Args:
+        - query (str): Die Suchbegriffe.
+        - k (int): Maximale Anzahl Treffer.
+        - allowed_uids (set): Optional nur diese UIDs berücksichtigen.
+
+        Returns:
+        - list: (UID, Punktzahl), bester Treffer zuerst.
+        """
+        terms = set(tokenize(query))
+        scores = defaultdict(float)
+        with self._lock:
+            count = len(self._doc_terms)
+            if not count or not terms:
+                return []
+            average_length = self._total_length / count
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for uid, frequency in postings.items():
+                    if allowed_uids is not None and uid not in allowed_uids:
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_lengths[uid] / average_length)
+                    scores[uid] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))[:k]
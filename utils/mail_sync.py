@@ -0,0 +1,565 @@
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from utils.embedding_providers import provider_name
+from utils.faiss_utils import (
+    EMBEDDING_TEXT_VERSION,
+    add_embeddings,
+    embed_emails,
+    generate_faiss_index,
+    load_faiss_index,
+    needs_upgrade,
+    save_faiss_index,
+    save_index_metadata,
+    update_faiss_index,
+)
+from utils.fetch_emails import (
+    LIST_FETCH_ITEMS,
+    PARTIAL_BODY_FETCH,
+    fetch_raw_messages_by_uid,
+    fetch_text_messages_by_uid,
+    list_folders,
+    parse_flags,
+    parse_list_response,
+    quote_mailbox,
+)
+from utils.imap_pool import MAX_CONNECTIONS_PER_ACCOUNT, get_imap_pool
+from utils.ingestion import STATE_FAILED, IngestionWorker
+from utils.keyword_index import KeywordIndex
+from utils.message_store import INBOX, MessageStore, message_key, split_message_key
+from utils.storage import get_cache_dir
+
+# Beim ersten Abgleich werden pro Ordner nur die neuesten Nachrichten übernommen
+INITIAL_SYNC_LIMIT = 200
+# Abgeglichene Ordner: "*" für alle per LIST gefundenen (ohne Papierkorb und Spam)
+# oder eine kommagetrennte Liste wie "INBOX,Gesendet"
+SYNC_FOLDERS = os.environ.get("MAIL_BOT_FOLDERS", "*")
+# Ordner werden parallel abgeglichen, jeder auf einer eigenen Verbindung aus dem Pool
+SYNC_WORKERS = MAX_CONNECTIONS_PER_ACCOUNT
+
+_UID_RE = re.compile(rb"UID (\d+)")
+
+
+def _response_code(mail, code):
+    """Liest einen Response-Code wie UIDVALIDITY aus der letzten SELECT-Antwort."""
+    _, data = mail.response(code)
+    return int(data[0]) if data and data[0] else None
+
+
+def parse_folders(value):
+    """Liest eine Ordnerangabe wie SYNC_FOLDERS: "*" oder ein Tupel von Ordnernamen."""
+    if value.strip() == "*":
+        return "*"
+    return tuple(name.strip() for name in value.split(",") if name.strip())
+
+
+class FolderSync:
+    """
+    Inkrementeller Abgleich eines Ordners über UIDs.
+
+    Gemerkt werden UIDVALIDITY, die höchste bekannte UID, die Anzahl der Nachrichten und
+    (bei CONDSTORE) HIGHESTMODSEQ. Ein Abgleich ruft nur neue Nachrichten ab und erkennt
+    geänderte Flags (CHANGEDSINCE) und gelöschte Nachrichten; die UIDs des Ordners werden nur
+    abgefragt, wenn er weniger Nachrichten enthält als erwartet. Die E-Mails liegen unter Schlüsseln aus
+    message_key im gemeinsamen MessageStore des Kontos und tragen den Ordner als "folder".
+    """
+
+    _STATE = ("uidvalidity", "last_uid", "exists", "highestmodseq")
+
+    def __init__(self, store, folder, initial_limit=INITIAL_SYNC_LIMIT):
+        self.store = store
+        self.folder = INBOX if folder.upper() == INBOX else folder
+        self.folder_id = store.folder_id(self.folder)
+        self.initial_limit = initial_limit
+        state = store.get_state()
+        self.uidvalidity = state.get(self._state_key("uidvalidity"))
+        self.last_uid = state.get(self._state_key("last_uid")) or 0
+        self.exists = state.get(self._state_key("exists")) or 0
+        self.highestmodseq = state.get(self._state_key("highestmodseq"))
+
+    def _state_key(self, name):
+        # Die Inbox verwendet die Schlüssel aus der Zeit vor dem Abgleich mehrerer Ordner
+        return name if self.folder_id == 0 else f"{name}:{self.folder_id}"
+
+    def _save_state(self):
+        self.store.set_state(**{self._state_key(name): getattr(self, name) for name in self._STATE})
+
+    def state(self):
+        """Der Abgleich-Stand, mit dem ein gespeicherter FAISS-Index verglichen wird."""
+        return [self.uidvalidity, self.last_uid, self.exists]
+
+    def reset(self):
+        """
+        Entfernt alle E-Mails des Ordners aus dem Store.
+
+        Returns:
+        - list: Die Schlüssel der entfernten E-Mails.
+        """
+        removed = self.store.uids(self.folder)
+        self.store.remove(removed)
+        self.uidvalidity = None
+        self.last_uid = 0
+        self.exists = 0
+        self.highestmodseq = None
+        self._save_state()
+        return removed
+
+    def _tag(self, emails):
+        for email_data in emails:
+            email_data["uid"] = message_key(self.folder_id, email_data["uid"])
+            email_data["folder"] = self.folder
+        return emails
+
+    def _fetch_new(self, mail, exists):
+        if self.last_uid:
+            _, msg_data = mail.uid("FETCH", f"{self.last_uid + 1}:*", LIST_FETCH_ITEMS)
+        elif exists:
+            start = max(exists - self.initial_limit + 1, 1)
+            _, msg_data = mail.fetch(f"{start}:*", LIST_FETCH_ITEMS)
+        else:
+            return []
+        # "n:*" liefert auch dann die letzte Nachricht, wenn n größer als die höchste UID ist
+        return self._tag([
+            email_data for email_data in parse_list_response(msg_data)
+            if email_data["uid"] is not None and email_data["uid"] > self.last_uid
+        ])
+
+    def _fetch_changed_flags(self, mail):
+        _, msg_data = mail.uid(
+            "FETCH", f"1:{self.last_uid}", "(UID FLAGS)", f"(CHANGEDSINCE {self.highestmodseq})"
+        )
+        changed = {}
+        for line in msg_data:
+            meta = line[0] if isinstance(line, tuple) else line
+            uid = _UID_RE.search(meta or b"")
+            if uid:
+                changed[message_key(self.folder_id, int(uid.group(1)))] = parse_flags(meta)
+        self.store.update_flags(changed)
+        return list(changed)
+
+    def _find_expunged(self, mail, known_uids):
+        if not known_uids:
+            return []
+        _, data = mail.uid("SEARCH", f"UID {min(known_uids)}:{self.last_uid}")
+        existing = {int(uid) for uid in data[0].split()}
+        return [message_key(self.folder_id, uid) for uid in known_uids if uid not in existing]
+
+    def sync(self, mail):
+        """
+        Gleicht den Ordner mit dem gemerkten Stand ab.
+
+        Args:
+        - mail (imaplib.IMAP4): Eine angemeldete Verbindung.
+
+        Returns:
+        - tuple: (list neue E-Mails, list Schlüssel gelöschter E-Mails, list Schlüssel mit geänderten Flags)
+        """
+        _, data = mail.select(quote_mailbox(self.folder), readonly=True)
+        exists = int(data[0])
+        uidvalidity = _response_code(mail, "UIDVALIDITY")
+        highestmodseq = _response_code(mail, "HIGHESTMODSEQ")
+
+        removed = []
+        if uidvalidity != self.uidvalidity:
+            # Neue UIDVALIDITY: alle gemerkten UIDs des Ordners sind ungültig
+            removed = self.reset()
+            self.uidvalidity = uidvalidity
+
+        previous_exists = self.exists
+        known_uids = [split_message_key(key)[1] for key in self.store.uids(self.folder)]
+        new_emails = self._fetch_new(mail, exists)
+
+        changed = []
+        if (
+            known_uids and highestmodseq is not None and self.highestmodseq is not None
+            and highestmodseq != self.highestmodseq
+        ):
+            # Mit CONDSTORE liefert CHANGEDSINCE nur die Nachrichten mit geänderten Flags
+            changed = self._fetch_changed_flags(mail)
+        if known_uids and exists < previous_exists + len(new_emails):
+            # Nur wenn weniger Nachrichten da sind als erwartet, wurden welche gelöscht; erst dann
+            # werden die gemerkten UIDs mit dem Ordner verglichen
+            expunged = self._find_expunged(mail, known_uids)
+            self.store.remove(expunged)
+            removed += expunged
+
+        self.store.add_headers(new_emails)
+        for email_data in new_emails:
+            self.last_uid = max(self.last_uid, split_message_key(email_data["uid"])[1])
+        self.exists = exists
+        self.highestmodseq = highestmodseq
+        self._save_state()
+        return new_emails, removed, changed
+
+    def load_bodies(self, mail, keys):
+        """
+        Lädt fehlende Inhalte des Ordners in den Store.
+
+        Mit PARTIAL_BODY_FETCH werden nur die Textteile geladen und Anhänge als Metadaten
+        gespeichert; Nachrichten mit nicht lesbarer BODYSTRUCTURE werden vollständig geladen.
+        """
+        missing = self.store.missing_bodies(keys)
+        if not missing:
+            return
+        mail.select(quote_mailbox(self.folder), readonly=True)
+        uids = [split_message_key(key)[1] for key in missing]
+        raw_messages, attachments = {}, {}
+        if PARTIAL_BODY_FETCH:
+            raw_messages, attachments = fetch_text_messages_by_uid(mail, uids)
+        rest = [uid for uid in uids if uid not in raw_messages]
+        if rest:
+            raw_messages.update(fetch_raw_messages_by_uid(mail, rest))
+        self.store.put_attachments({message_key(self.folder_id, uid): items for uid, items in attachments.items()})
+        self.store.put_raw_messages({message_key(self.folder_id, uid): raw for uid, raw in raw_messages.items()})
+
+
+class MailboxSync:
+    """
+    Inkrementeller Abgleich eines Kontos über einen oder mehrere Ordner.
+
+    Die Ordner (FolderSync) werden parallel auf je einer Verbindung aus dem IMAP Pool
+    abgeglichen, die Gesamtdauer richtet sich so nach dem größten Ordner. Die E-Mails aller
+    Ordner liegen in einem MessageStore, einem Stichwort- und einem FAISS-Index, der
+    inkrementell aktualisiert wird, auf Wunsch im Hintergrund (start_ingestion).
+    E-Mails und Abgleich-Stand überstehen einen Neustart, der FAISS-Index wird unter
+    index_path gespeichert und beim Start per Memory-Map geladen.
+    """
+
+    def __init__(self, store, folders=(INBOX,), initial_limit=INITIAL_SYNC_LIMIT, index_path=None):
+        self.store = store
+        # "*" für alle per LIST gefundenen Ordner oder eine Liste von Ordnernamen
+        self.folders = folders
+        self.initial_limit = initial_limit
+        self._folder_syncs = {}
+        # Fehler beim letzten Abgleich einzelner Ordner: Ordner -> Meldung
+        self.folder_errors = {}
+        self.index_path = index_path
+        self.faiss_index = None
+        # Name des Embedding-Anbieters, mit dem faiss_index erstellt wurde
+        self.index_provider = None
+        self._keyword_index = None
+        # Ein per Memory-Map geladener Index muss vor Änderungen vollständig eingelesen werden
+        self._index_mmapped = False
+        # Der Index weicht von der gespeicherten Datei ab und muss beim Abschluss geschrieben werden
+        self._index_dirty = False
+        # Schützt Indexe und Abgleich-Stand; Suchen sperren nur kurz, Embedden läuft ohne Sperre
+        self.lock = threading.RLock()
+        # Der laufende oder letzte Hintergrund-Abgleich (IngestionWorker)
+        self.worker = None
+        self._load_index()
+
+    def _folder_sync(self, folder):
+        folder = INBOX if folder.upper() == INBOX else folder
+        if folder not in self._folder_syncs:
+            self._folder_syncs[folder] = FolderSync(self.store, folder, self.initial_limit)
+        return self._folder_syncs[folder]
+
+    def _index_metadata(self):
+        return {
+            "embedding_provider": self.index_provider or provider_name(),
+            "embedding_text": EMBEDDING_TEXT_VERSION,
+            "folders": {name: folder_sync.state() for name, folder_sync in self._folder_syncs.items()},
+        }
+
+    def _load_index(self):
+        if not self.index_path:
+            return
+        try:
+            faiss_index, metadata = load_faiss_index(self.index_path)
+        except Exception:
+            # Beschädigte Datei: der Index wird beim nächsten Abgleich neu aufgebaut
+            return
+        if faiss_index is None:
+            return
+        # Nur einen Index verwenden, der zum gespeicherten Abgleich-Stand aller Ordner passt
+        folders = metadata.get("folders") or {}
+        if (
+            metadata.get("embedding_provider") == provider_name()
+            and metadata.get("embedding_text", 1) == EMBEDDING_TEXT_VERSION
+            and all(self._folder_sync(name).state() == state for name, state in folders.items())
+        ):
+            self.faiss_index = faiss_index
+            self.index_provider = metadata["embedding_provider"]
+            self._index_mmapped = True
+
+    @property
+    def keyword_index(self):
+        """Der Stichwort-Index über alle E-Mails im Store, wird beim ersten Zugriff aufgebaut."""
+        if self._keyword_index is None:
+            keyword_index = KeywordIndex()
+            keyword_index.add(self.store.get_headers(self.store.uids()))
+            self._keyword_index = keyword_index
+        return self._keyword_index
+
+    def _save_index(self):
+        if not self.index_path or self.faiss_index is None:
+            return
+        metadata = {"dimension": self.faiss_index.d, **self._index_metadata()}
+        if self._index_dirty:
+            save_faiss_index(self.faiss_index, self.index_path, **metadata)
+            self._index_dirty = False
+        else:
+            # Unveränderter Index: nur der Abgleich-Stand hat sich geändert
+            save_index_metadata(self.faiss_index, self.index_path, **metadata)
+
+    def _map_folders(self, fn, items, email_address, email_password, imap_server):
+        """
+        Führt fn(mail, item) pro Eintrag parallel auf je einer Verbindung aus dem Pool aus.
+
+        Returns:
+        - list: Pro Eintrag (item, Ergebnis, Exception oder None).
+        """
+        def run(item):
+            try:
+                with get_imap_pool().connection(email_address, email_password, imap_server) as mail:
+                    return item, fn(mail, item), None
+            except Exception as e:
+                return item, None, e
+
+        if len(items) <= 1:
+            return [run(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(SYNC_WORKERS, len(items))) as executor:
+            return list(executor.map(run, items))
+
+    def sync(self, email_address, email_password, imap_server):
+        """
+        Gleicht alle Ordner parallel mit dem gemerkten Stand ab.
+
+        Ordner, die auf dem Server nicht mehr existieren, werden aus dem Store entfernt.
+        Schlägt der Abgleich eines Ordners fehl, bleibt sein Stand erhalten (folder_errors).
+
+        Args:
+        - email_address (str): Die E-Mail-Adresse.
+        - email_password (str): Das Passwort.
+        - imap_server (str): Der IMAP Server.
+
+        Returns:
+        - tuple: (list neue E-Mails, list Schlüssel gelöschter E-Mails, list Schlüssel mit geänderten Flags)
+
+        Raises:
+        - Exception: Der Fehler des ersten Ordners, wenn kein Ordner abgeglichen werden konnte.
+        """
+        if self.folders == "*":
+            with get_imap_pool().connection(email_address, email_password, imap_server) as mail:
+                names = list_folders(mail)
+        else:
+            names = list(self.folders)
+        folder_syncs = [self._folder_sync(name) for name in names]
+
+        new_emails, removed, changed = [], [], []
+        current = {folder_sync.folder for folder_sync in folder_syncs}
+        for folder in set(self.store.folders()) - current:
+            removed += self._folder_sync(folder).reset()
+            del self._folder_syncs[folder]
+
+        results = self._map_folders(
+            lambda mail, folder_sync: folder_sync.sync(mail), folder_syncs,
+            email_address, email_password, imap_server,
+        )
+        self.folder_errors = {folder_sync.folder: str(error) for folder_sync, _, error in results if error}
+        if folder_syncs and len(self.folder_errors) == len(folder_syncs):
+            raise results[0][2]
+        for _, result, error in results:
+            if error is None:
+                new_emails += result[0]
+                removed += result[1]
+                changed += result[2]
+        return new_emails, removed, changed
+
+    def load_bodies(self, uids, email_address, email_password, imap_server):
+        """
+        Lädt fehlende Inhalte pro Ordner parallel mit je einem UID FETCH in den Store.
+
+        Geladene E-Mails werden mit ihrem Text in den Stichwort-Index aufgenommen.
+        """
+        missing = self.store.missing_bodies(uids)
+        by_folder = {}
+        for key in missing:
+            by_folder.setdefault(split_message_key(key)[0], []).append(key)
+        folder_syncs = {folder_sync.folder_id: folder_sync for folder_sync in self._folder_syncs.values()}
+        work = [(folder_syncs[folder_id], keys) for folder_id, keys in by_folder.items() if folder_id in folder_syncs]
+        results = self._map_folders(
+            lambda mail, item: item[0].load_bodies(mail, item[1]), work,
+            email_address, email_password, imap_server,
+        )
+        still_missing = set(self.store.missing_bodies(missing))
+        loaded = [key for key in missing if key not in still_missing]
+        with self.lock:
+            if loaded and self._keyword_index is not None:
+                self._keyword_index.add(self.store.get_headers(loaded))
+        for _, _, error in results:
+            if error is not None:
+                raise error
+
+    def load_message(self, uid, email_address, email_password, imap_server):
+        """
+        Liefert den Inhalt einer E-Mail und lädt ihn bei Bedarf vom Server nach.
+
+        Returns:
+        - email.message.Message: Die Nachricht oder None, wenn sie nicht mehr existiert.
+        """
+        message = self.store.get_message(uid)
+        if message is None:
+            self.load_bodies([uid], email_address, email_password, imap_server)
+            message = self.store.get_message(uid)
+        return message
+
+    def _ensure_writable(self):
+        # Ein per Memory-Map geladener Index muss vor Änderungen vollständig eingelesen werden
+        if self._index_mmapped:
+            self.faiss_index, _ = load_faiss_index(self.index_path, mmap=False)
+            self._index_mmapped = False
+
+    def _unindexed_uids(self):
+        value = self.store.get_state().get("unindexed_uids")
+        return [int(uid) for uid in value.split()] if value else []
+
+    def prepare(self, email_address, email_password, imap_server, openai_api_key, provider):
+        """
+        Gleicht die Header aller Ordner ab und entfernt gelöschte E-Mails aus den Indexen.
+
+        Danach sind alle E-Mails im Store sichtbar; die Inhalte werden mit load_bodies
+        nachgeladen und in den Stichwort-Index aufgenommen und mit index_emails embeddet.
+
+        Args:
+        - email_address (str): Die E-Mail-Adresse.
+        - email_password (str): Das Passwort.
+        - imap_server (str): Der IMAP Server.
+        - openai_api_key (str): Der API-Schlüssel für OpenAI.
+        - provider (EmbeddingProvider): Der Embedding-Anbieter.
+
+        Returns:
+        - tuple: (list neue E-Mails, list UIDs, die indexiert werden müssen, neueste zuerst)
+        """
+        with self.lock:
+            new_emails, removed, _ = self.sync(email_address, email_password, imap_server)
+            # Ein Index eines anderen Embedding-Anbieters wird neu aufgebaut, die Embeddings
+            # kommen dabei aus dem Cache
+            rebuild = self.faiss_index is None or self.index_provider != provider.name
+            # Neue E-Mails kommen mit ihrem Inhalt in den Stichwort-Index (load_bodies)
+            if self._keyword_index is not None:
+                self._keyword_index.remove(removed)
+            if rebuild:
+                self.faiss_index = None
+                self._index_mmapped = False
+                self.index_provider = provider.name
+                return new_emails, self.store.uids()
+            if removed:
+                try:
+                    self._ensure_writable()
+                    self.faiss_index = update_faiss_index(self.faiss_index, [], removed, openai_api_key)
+                    self._index_dirty = True
+                except Exception:
+                    # Beim nächsten Abgleich neu aufbauen, die Embeddings liegen dann im Cache
+                    self.faiss_index = None
+                    self._index_mmapped = False
+                    raise
+            # Beim letzten Abgleich fehlgeschlagene E-Mails erneut versuchen
+            wanted = {email_data["uid"] for email_data in new_emails} | set(self._unindexed_uids())
+            return new_emails, [uid for uid in self.store.uids() if uid in wanted]
+
+    def index_emails(self, emails, openai_api_key, provider):
+        """
+        Embeddet E-Mails und fügt sie zum FAISS-Index hinzu.
+
+        Das Embedden läuft ohne Sperre, Suchen sind währenddessen weiter möglich.
+
+        Args:
+        - emails (list): E-Mails mit geladenem Inhalt.
+        - openai_api_key (str): Der API-Schlüssel für OpenAI.
+        - provider (EmbeddingProvider): Der Embedding-Anbieter des Index.
+        """
+        embeddings = embed_emails(emails, openai_api_key, provider)
+        with self.lock:
+            self._ensure_writable()
+            self.faiss_index = add_embeddings(self.faiss_index, embeddings, emails, provider)
+            self._index_dirty = True
+
+    def finish_index(self, openai_api_key, provider, unindexed_uids):
+        """
+        Schließt einen Abgleich ab: stellt bei Bedarf den Index-Typ um und speichert den Index.
+
+        Die Index-Datei wird nur neu geschrieben, wenn E-Mails hinzugefügt oder entfernt wurden
+        oder der Index-Typ umgestellt wurde; sonst nur der Abgleich-Stand daneben.
+
+        Args:
+        - openai_api_key (str): Der API-Schlüssel für OpenAI.
+        - provider (EmbeddingProvider): Der Embedding-Anbieter des Index.
+        - unindexed_uids (list): UIDs, die nicht indexiert werden konnten.
+        """
+        with self.lock:
+            if self.faiss_index is not None and needs_upgrade(self.faiss_index):
+                # Ist das Postfach über eine Schwelle gewachsen, auf HNSW bzw. IVF-PQ umstellen;
+                # die Embeddings kommen dabei aus dem Cache
+                skipped = set(unindexed_uids) | set(self.store.missing_bodies(self.store.uids()))
+                emails = self.store.get_headers([uid for uid in self.store.uids() if uid not in skipped])
+                faiss_index, _ = generate_faiss_index(emails, openai_api_key, provider=provider)
+                if faiss_index is not None:
+                    self.faiss_index = faiss_index
+                    self._index_mmapped = False
+                    self._index_dirty = True
+            self.store.set_state(unindexed_uids=" ".join(str(uid) for uid in unindexed_uids))
+            self._save_index()
+
+    def start_ingestion(self, email_address, email_password, imap_server, openai_api_key):
+        """
+        Startet den Abgleich im Hintergrund, sofern nicht bereits einer läuft.
+
+        Returns:
+        - IngestionWorker: Der laufende Abgleich.
+        """
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = IngestionWorker(
+                    self, email_address, email_password, imap_server, openai_api_key
+                ).start()
+            return self.worker
+
+    def refresh(self, email_address, email_password, imap_server, openai_api_key):
+        """
+        Gleicht das Postfach ab und aktualisiert den FAISS-Index, ohne Hintergrund-Thread.
+
+        Args:
+        - email_address (str): Die E-Mail-Adresse.
+        - email_password (str): Das Passwort.
+        - imap_server (str): Der IMAP Server.
+        - openai_api_key (str): Der API-Schlüssel für OpenAI.
+
+        Returns:
+        - int: Anzahl neuer E-Mails.
+        """
+        if self.worker is not None:
+            self.worker.join()
+        worker = IngestionWorker(self, email_address, email_password, imap_server, openai_api_key)
+        worker.run()
+        progress = worker.progress()
+        if progress["state"] == STATE_FAILED:
+            raise RuntimeError(progress["error"])
+        return progress["new"]
+
+
+@st.cache_resource
+def _get_mailbox_sync(account_key, store_name, folders):
+    store = MessageStore(os.path.join(get_cache_dir("messages"), f"{store_name}.sqlite3"))
+    return MailboxSync(store, folders, index_path=os.path.join(get_cache_dir("indexes"), f"{store_name}.faiss"))
+
+
+def get_mailbox_sync(email_address, email_password, imap_server, folders=SYNC_FOLDERS):
+    """
+    Liefert den prozessweit geteilten Abgleich-Zustand eines Kontos.
+
+    Das Passwort fließt in den Schlüssel ein, damit nur angemeldete Nutzer den Zustand erhalten.
+
+    Args:
+    - folders (str): Die abgeglichenen Ordner, "*" oder eine kommagetrennte Liste.
+    """
+    # Wie vor dem Abgleich mehrerer Ordner, damit vorhandene Stores der Inbox weiterverwendet werden
+    account = f"{email_address.lower()}\0{imap_server}\0inbox"
+    account_key = hashlib.sha256(f"{account}\0{email_password}".encode("utf-8")).hexdigest()
+    store_name = hashlib.sha256(account.encode("utf-8")).hexdigest()
+    return _get_mailbox_sync(account_key, store_name, parse_folders(folders))
@@ -0,0 +1,447 @@
+import email
+import hashlib
+import sqlite3
+import threading
+import zlib
+from datetime import datetime, timezone
+
+from utils.threads import thread_root
+
+# Schlüssel einer E-Mail in Store und FAISS-Index: (Ordner-ID << 32) | UID.
+# IMAP-UIDs haben 32 Bit; die Inbox hat die Ordner-ID 0, ihr Schlüssel ist die UID selbst.
+FOLDER_SHIFT = 32
+INBOX = "INBOX"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS headers (
+    uid INTEGER PRIMARY KEY,
+    message_id TEXT,
+    subject TEXT,
+    sender TEXT,
+    date TEXT,
+    size INTEGER,
+    flags TEXT,
+    folder TEXT,
+    timestamp REAL,
+    thread TEXT
+);
+CREATE INDEX IF NOT EXISTS headers_timestamp ON headers (timestamp);
+CREATE INDEX IF NOT EXISTS headers_message_id ON headers (message_id);
+CREATE INDEX IF NOT EXISTS headers_thread ON headers (thread);
+CREATE TABLE IF NOT EXISTS folders (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bodies (
+    uid INTEGER PRIMARY KEY,
+    raw BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    uid INTEGER NOT NULL,
+    filename TEXT,
+    mime_type TEXT,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS attachments_uid ON attachments (uid);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+_HEADER_COLUMNS = "uid, message_id, subject, sender, date, size, flags, folder, thread"
+
+
+def message_key(folder_id, uid):
+    """Bildet den Schlüssel einer E-Mail aus Ordner-ID und IMAP-UID."""
+    return (folder_id << FOLDER_SHIFT) | uid
+
+
+def split_message_key(key):
+    """
+    Zerlegt einen Schlüssel aus message_key.
+
+    Returns:
+    - tuple: (int Ordner-ID, int IMAP-UID)
+    """
+    return key >> FOLDER_SHIFT, key & ((1 << FOLDER_SHIFT) - 1)
+
+
+def _timestamp(date):
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+class EmailHeader:
+    """
+    Kompakte Kopfzeile einer E-Mail aus dem MessageStore.
+
+    Unterstützt den Zugriff wie auf die bisherigen dicts (email_data["subject"]). Der Inhalt
+    unter "message" wird erst beim Zugriff aus dem Store gelesen und geparst, "body_hash"
+    liefert einen Hash des gespeicherten Inhalts (None, solange er fehlt).
+    """
+
+    __slots__ = ("uid", "message_id", "subject", "sender", "date", "size", "flags", "folder", "thread", "_store")
+
+    def __init__(self, store, uid, message_id, subject, sender, date, size, flags, folder, thread):
+        self._store = store
+        self.uid = uid
+        self.message_id = message_id
+        self.subject = subject
+        self.sender = sender
+        self.date = date
+        self.size = size
+        self.flags = flags
+        self.folder = folder
+        # Message-ID der ersten bekannten Nachricht des Verlaufs
+        self.thread = thread
+
+    def __getitem__(self, key):
+        if key == "message":
+            return self._store.get_message(self.uid)
+        if key == "body_hash":
+            return self._store.body_hash(self.uid)
+        if key.startswith("_") or key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class MessageStore:
+    """
+    Lokaler Speicher für die E-Mails eines Kontos in SQLite.
+
+    Header liegen als kompakte Zeilen vor, die Rohnachricht (RFC822) zlib-komprimiert als BLOB.
+    Zusätzlich wird der Stand des IMAP-Abgleichs (UIDVALIDITY usw.) gespeichert. E-Mails
+    mehrerer Ordner werden über Schlüssel aus message_key unterschieden.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self._db.executescript(_SCHEMA)
+
+    def _migrate(self):
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(headers)")}
+        if not columns:
+            return
+        with self._db:
+            if "folder" not in columns:
+                # Stores ohne Ordner enthalten nur die Inbox
+                self._db.execute("ALTER TABLE headers ADD COLUMN folder TEXT")
+                self._db.execute("ALTER TABLE headers ADD COLUMN timestamp REAL")
+                rows = self._db.execute("SELECT uid, date FROM headers").fetchall()
+                self._db.executemany(
+                    "UPDATE headers SET folder = ?, timestamp = ? WHERE uid = ?",
+                    [(INBOX, _timestamp(datetime.fromisoformat(date)), uid) for uid, date in rows],
+                )
+            if "thread" not in columns:
+                # References wurden nicht gespeichert: jede ältere E-Mail bildet einen eigenen Verlauf
+                self._db.execute("ALTER TABLE headers ADD COLUMN thread TEXT")
+                self._db.execute("UPDATE headers SET thread = COALESCE(message_id, CAST(uid AS TEXT))")
+
+    def _select_in(self, sql, uids):
+        # SQLite begrenzt die Anzahl der Parameter pro Abfrage
+        for start in range(0, len(uids), 500):
+            chunk = [int(uid) for uid in uids[start:start + 500]]
+            yield from self._db.execute(sql.format(",".join("?" * len(chunk))), chunk)
+
+    def _row_to_header(self, row):
+        uid, message_id, subject, sender, date, size, flags, folder, thread = row
+        return EmailHeader(
+            self, uid, message_id, subject, sender, datetime.fromisoformat(date), size,
+            tuple(flags.split()) if flags else (), folder, thread or message_id or str(uid),
+        )
+
+    def folder_id(self, name):
+        """
+        Liefert die feste ID eines Ordners und vergibt bei Bedarf eine neue (INBOX hat immer 0).
+
+        Args:
+        - name (str): Der Ordnername auf dem IMAP Server.
+
+        Returns:
+        - int: Die Ordner-ID.
+        """
+        if name.upper() == INBOX:
+            return 0
+        with self._lock, self._db:
+            row = self._db.execute("SELECT id FROM folders WHERE name = ?", (name,)).fetchone()
+            if row is not None:
+                return row[0]
+            # IDs werden nie wiederverwendet, damit alte Schlüssel keinem neuen Ordner zugeordnet werden
+            next_id = self._db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM folders").fetchone()[0]
+            self._db.execute("INSERT INTO folders (id, name) VALUES (?, ?)", (next_id, name))
+            return next_id
+
+    def folders(self):
+        """Liefert die Namen aller Ordner, aus denen E-Mails gespeichert sind."""
+        with self._lock:
+            return [name for (name,) in self._db.execute("SELECT DISTINCT folder FROM headers")]
+
+    def get_state(self):
+        """Liefert den gespeicherten Abgleich-Stand als dict."""
+        with self._lock:
+            return dict(self._db.execute("SELECT key, value FROM state"))
+
+    def set_state(self, **values):
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", values.items()
+            )
+
+    def _known_threads(self, message_ids):
+        """Liefert Message-ID -> Verlauf für bereits gespeicherte E-Mails."""
+        message_ids = list(message_ids)
+        threads = {}
+        with self._lock:
+            for start in range(0, len(message_ids), 500):
+                chunk = message_ids[start:start + 500]
+                threads.update(self._db.execute(
+                    f"SELECT message_id, thread FROM headers WHERE message_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ))
+        return threads
+
+    def _assign_threads(self, emails):
+        """
+        Ordnet E-Mails anhand von References und In-Reply-To einem Verlauf zu.
+
+        Ist eine der referenzierten Nachrichten bekannt, wird ihr Verlauf übernommen, auch wenn
+        References unvollständig ist. Sonst beginnt der Verlauf bei thread_root.
+        """
+        known = self._known_threads({
+            message_id for email_data in emails
+            for message_id in email_data.get("references", []) + email_data.get("in_reply_to", [])
+        })
+        threads = {}
+        # Ältere zuerst, damit Antworten innerhalb eines Abgleichs ihren Verlauf finden
+        for email_data in sorted(emails, key=lambda email_data: _timestamp(email_data["date"])):
+            message_id = (email_data["message_id"] or "").strip() or None
+            references = email_data.get("references", [])
+            in_reply_to = email_data.get("in_reply_to", [])
+            thread = next((known[ref] for ref in references + in_reply_to if ref in known), None)
+            thread = thread or thread_root(message_id, in_reply_to, references) or str(email_data["uid"])
+            if message_id:
+                known[message_id] = thread
+            threads[email_data["uid"]] = thread
+        return threads
+
+    def add_headers(self, emails):
+        """
+        Speichert die Header neuer E-Mails und ordnet sie ihrem Verlauf zu.
+
+        Args:
+        - emails (list): E-Mails als dict mit uid (Schlüssel aus message_key), message_id, subject,
+          sender, date, size, flags, folder und optional in_reply_to und references.
+        """
+        threads = self._assign_threads(emails)
+        rows = [
+            (
+                email_data["uid"], email_data["message_id"], email_data["subject"], email_data["sender"],
+                email_data["date"].isoformat(), email_data["size"], " ".join(email_data["flags"]),
+                email_data.get("folder") or INBOX, threads[email_data["uid"]], _timestamp(email_data["date"]),
+            )
+            for email_data in emails
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO headers ({_HEADER_COLUMNS}, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def thread_uids(self, thread):
+        """Liefert die Schlüssel aller E-Mails eines Verlaufs, neueste zuerst."""
+        with self._lock:
+            return [
+                uid for (uid,) in self._db.execute(
+                    "SELECT uid FROM headers WHERE thread = ? ORDER BY timestamp DESC, uid DESC", (thread,)
+                )
+            ]
+
+    def thread_sizes(self, threads):
+        """Liefert Verlauf -> Anzahl gespeicherter E-Mails für die angegebenen Verläufe."""
+        threads = list(set(threads))
+        sizes = {}
+        with self._lock:
+            for start in range(0, len(threads), 500):
+                chunk = threads[start:start + 500]
+                sizes.update(self._db.execute(
+                    f"SELECT thread, COUNT(*) FROM headers WHERE thread IN ({','.join('?' * len(chunk))}) GROUP BY thread",
+                    chunk,
+                ))
+        return sizes
+
+    def put_raw_messages(self, raw_messages):
+        """
+        Speichert Rohnachrichten komprimiert.
+
+        Args:
+        - raw_messages (dict): UID -> RFC822 bytes.
+        """
+        rows = [(uid, zlib.compress(raw)) for uid, raw in raw_messages.items()]
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO bodies VALUES (?, ?)", rows)
+
+    def put_attachments(self, attachments):
+        """
+        Speichert die Metadaten der Anhänge; die Anhänge selbst werden nicht geladen.
+
+        Args:
+        - attachments (dict): UID -> list von dicts mit filename, mime_type und size.
+        """
+        rows = [
+            (uid, item["filename"], item["mime_type"], item["size"])
+            for uid, items in attachments.items() for item in items
+        ]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM attachments WHERE uid = ?", [(uid,) for uid in attachments])
+            self._db.executemany("INSERT INTO attachments VALUES (?, ?, ?, ?)", rows)
+
+    def get_attachments(self, uid):
+        """Liefert die Metadaten der Anhänge einer E-Mail als dicts mit filename, mime_type und size."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT filename, mime_type, size FROM attachments WHERE uid = ? ORDER BY rowid", (int(uid),)
+            ).fetchall()
+        return [{"filename": filename, "mime_type": mime_type, "size": size} for filename, mime_type, size in rows]
+
+    def update_flags(self, flags):
+        """
+        Aktualisiert die Flags.
+
+        Args:
+        - flags (dict): UID -> Tupel der Flags.
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE headers SET flags = ? WHERE uid = ?",
+                [(" ".join(value), uid) for uid, value in flags.items()],
+            )
+
+    def remove(self, uids):
+        uids = [(uid,) for uid in uids]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM headers WHERE uid = ?", uids)
+            self._db.executemany("DELETE FROM bodies WHERE uid = ?", uids)
+            self._db.executemany("DELETE FROM attachments WHERE uid = ?", uids)
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM headers")
+            self._db.execute("DELETE FROM bodies")
+            self._db.execute("DELETE FROM attachments")
+            self._db.execute("DELETE FROM state")
+
+    def uids(self, folder=None):
+        """
+        Liefert die Schlüssel aller E-Mails, neueste zuerst.
+
+        Args:
+        - folder (str): Optional nur die E-Mails dieses Ordners.
+        """
+        sql = "SELECT uid FROM headers"
+        params = []
+        if folder is not None:
+            sql += " WHERE folder = ?"
+            params.append(folder)
+        with self._lock:
+            return [uid for (uid,) in self._db.execute(sql + " ORDER BY timestamp DESC, uid DESC", params)]
+
+    def missing_bodies(self, uids):
+        """Liefert die UIDs, deren Inhalt noch nicht gespeichert ist."""
+        uids = list(uids)
+        with self._lock:
+            stored = {uid for (uid,) in self._select_in("SELECT uid FROM bodies WHERE uid IN ({})", uids)}
+        return [uid for uid in uids if uid not in stored]
+
+    def get_headers(self, uids):
+        """
+        Liest Header für mehrere UIDs.
+
+        Args:
+        - uids (list): Die UIDs.
+
+        Returns:
+        - list: EmailHeader in der Reihenfolge von uids (unbekannte UIDs werden ausgelassen).
+        """
+        uids = list(uids)
+        with self._lock:
+            rows = {
+                row[0]: row
+                for row in self._select_in(f"SELECT {_HEADER_COLUMNS} FROM headers WHERE uid IN ({{}})", uids)
+            }
+        return [self._row_to_header(rows[uid]) for uid in uids if uid in rows]
+
+    def filter_uids(self, since=None, until=None, sender=None, folder=None):
+        """
+        Liefert die UIDs, deren Datum, Absender bzw. Ordner zu den Filtern passt.
+
+        Args:
+        - since (datetime): Frühestes Datum (einschließlich).
+        - until (datetime): Spätestes Datum (ausschließlich).
+        - sender (str): Teil des Absenders, Groß-/Kleinschreibung wird ignoriert.
+        - folder (str): Teil des Ordnernamens, Groß-/Kleinschreibung wird ignoriert.
+
+        Returns:
+        - set: Die passenden UIDs.
+        """
+        # Datumsfilter über die Spalte timestamp (Index headers_timestamp): Datumsangaben mit
+        # unterschiedlichen Zeitzonen lassen sich nicht als Text vergleichen
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(_timestamp(since))
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append(_timestamp(until))
+        for column, value in (("sender", sender), ("folder", folder)):
+            if value:
+                conditions.append(f"{column} LIKE ? ESCAPE '\\'")
+                escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                params.append(f"%{escaped}%")
+        sql = "SELECT uid FROM headers"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            return {uid for (uid,) in self._db.execute(sql, params)}
+
+    def get_message(self, uid):
+        """Liest und parst die gespeicherte Rohnachricht oder liefert None."""
+        with self._lock:
+            row = self._db.execute("SELECT raw FROM bodies WHERE uid = ?", (uid,)).fetchone()
+        if row is None:
+            return None
+        return email.message_from_bytes(zlib.decompress(row[0]))
+
+    def body_hash(self, uid):
+        """Liefert einen Hash der gespeicherten Rohnachricht oder None, wenn der Inhalt fehlt."""
+        with self._lock:
+            row = self._db.execute("SELECT raw FROM bodies WHERE uid = ?", (uid,)).fetchone()
+        if row is None:
+            return None
+        return hashlib.sha256(row[0]).hexdigest()
+
+    def __getitem__(self, uid):
+        headers = self.get_headers([int(uid)])
+        if not headers:
+            raise KeyError(uid)
+        return headers[0]
+
+    def __contains__(self, uid):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM headers WHERE uid = ?", (int(uid),)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM headers").fetchone()[0]
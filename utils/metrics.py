@@ -0,0 +1,168 @@
+import contextvars
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Anzahl der zuletzt aufgezeichneten Spans
+RECENT_SPANS = 500
+PROMETHEUS_PREFIX = "mail_bot"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """Eine gemessene Phase mit Dauer und Zählwerten wie bytes, prompt_tokens oder cache_hits."""
+
+    __slots__ = ("name", "labels", "values", "start", "duration", "error")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.values = {}
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def add(self, key, value=1):
+        self.values[key] = self.values.get(key, 0) + value
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "start": round(self.start, 3),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "error": self.error,
+            **self.labels,
+            **self.values,
+        }
+
+
+class MetricsRecorder:
+    """
+    Sammelt Spans prozessweit: die letzten RECENT_SPANS einzeln und Summen pro Span-Name.
+    """
+
+    def __init__(self, recent=RECENT_SPANS):
+        self._recent = deque(maxlen=recent)
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def _totals_for(self, name):
+        return self._totals.setdefault(name, {"count": 0, "errors": 0, "duration_seconds": 0.0})
+
+    def record(self, span):
+        with self._lock:
+            self._recent.append(span)
+            totals = self._totals_for(span.name)
+            totals["count"] += 1
+            totals["duration_seconds"] += span.duration
+            if span.error:
+                totals["errors"] += 1
+            for key, value in span.values.items():
+                totals[key] = totals.get(key, 0) + value
+
+    def count(self, name, **values):
+        """Zählt Werte ohne eigene Messung, z.B. Cache-Treffer bei häufigen, schnellen Aufrufen."""
+        with self._lock:
+            totals = self._totals_for(name)
+            for key, value in values.items():
+                totals[key] = totals.get(key, 0) + value
+
+    def recent(self):
+        with self._lock:
+            return [span.as_dict() for span in self._recent]
+
+    def summary(self):
+        """Liefert pro Span-Name Anzahl, mittlere Dauer und Summen der Zählwerte."""
+        with self._lock:
+            rows = []
+            for name, totals in sorted(self._totals.items()):
+                row = {"name": name, **totals}
+                if totals["count"]:
+                    row["avg_ms"] = round(totals["duration_seconds"] * 1000 / totals["count"], 2)
+                rows.append(row)
+            return rows
+
+    def reset(self):
+        with self._lock:
+            self._recent.clear()
+            self._totals.clear()
+
+    def to_jsonl(self):
+        """Exportiert die letzten Spans als JSON Lines."""
+        return "".join(json.dumps(span, ensure_ascii=False) + "\n" for span in self.recent())
+
+    def to_prometheus(self):
+        """Exportiert die Summen im Prometheus Text-Format."""
+        lines = []
+        with self._lock:
+            keys = sorted({key for totals in self._totals.values() for key in totals})
+            for key in keys:
+                metric = _prometheus_name(key)
+                lines.append(f"# TYPE {metric} counter")
+                for name, totals in sorted(self._totals.items()):
+                    if key in totals:
+                        lines.append(f'{metric}{{span="{name}"}} {totals[key]}')
+        return "\n".join(lines) + "\n"
+
+
+def _prometheus_name(key):
+    if key == "count":
+        return f"{PROMETHEUS_PREFIX}_spans_total"
+    return f"{PROMETHEUS_PREFIX}_span_{key}_total"
+
+
+_recorder = MetricsRecorder()
+
+
+def get_metrics():
+    """Liefert den prozessweit geteilten MetricsRecorder."""
+    return _recorder
+
+
+@contextmanager
+def span(name, **labels):
+    """
+    Misst eine Phase und zeichnet sie auf.
+
+    Innerhalb der Phase ergänzt add() Zählwerte des innersten Spans, auch aus aufgerufenen
+    Funktionen heraus.
+
+    Args:
+    - name (str): Name der Phase, z.B. "fetch_emails".
+    - labels: Zusätzliche Angaben wie das Modell.
+
+    Yields:
+    - Span: Der laufende Span.
+    """
+    current = Span(name, labels)
+    # Kein reset() per Token: Streaming-Generatoren können in einem anderen Kontext enden
+    parent = _current_span.get()
+    _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current_span.set(parent)
+        _recorder.record(current)
+
+
+def add(key, value=1):
+    """Ergänzt einen Zählwert im innersten laufenden Span (ohne laufenden Span wirkungslos)."""
+    current = _current_span.get()
+    if current is not None:
+        current.add(key, value)
+
+
+def add_usage(usage):
+    """Übernimmt prompt_tokens und completion_tokens aus response.usage der OpenAI-API."""
+    if usage is None:
+        return
+    add("prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+    add("completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
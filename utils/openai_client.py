@@ -0,0 +1,315 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import openai
+
+from utils import metrics
+
+# Kontingent des API-Schlüssels pro Minute (0 = unbegrenzt, 429-Antworten bremsen trotzdem)
+OPENAI_RPM = int(os.environ.get("MAIL_BOT_OPENAI_RPM", "0"))
+OPENAI_TPM = int(os.environ.get("MAIL_BOT_OPENAI_TPM", "0"))
+# Anteil des Kontingents, den Hintergrundanfragen für interaktive Anfragen frei lassen
+INTERACTIVE_RESERVE = 0.2
+# Gleichzeitig laufende Hintergrundanfragen pro Schlüssel
+MAX_BULK_IN_FLIGHT = 4
+
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# Prioritäten, kleinere Werte werden zuerst bedient
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+_priority = contextvars.ContextVar("openai_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def request_priority(priority):
+    """
+    Legt die Priorität der OpenAI-Anfragen im aktuellen Kontext fest.
+
+    Ohne Angabe gelten Anfragen als interaktiv; Hintergrundarbeit wie das Indexieren
+    läuft mit PRIORITY_BULK.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    """Liefert die Priorität des aktuellen Kontexts (z.B. um sie an Worker-Threads weiterzugeben)."""
+    return _priority.get()
+
+
+def _retry_after(error):
+    """Liest die vom Server empfohlene Wartezeit in Sekunden aus einer Fehlerantwort."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Wartezeit vor dem nächsten Versuch: exponentiell mit Zufallsanteil.
+
+    Der Zufallsanteil verhindert, dass alle wartenden Anfragen gleichzeitig wiederholen.
+    """
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+    if retry_after is not None:
+        return retry_after + random.uniform(0, delay / 2)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class _ReleasingStream:
+    """
+    Reicht die Chunks einer gestreamten Antwort durch und gibt die Anfrage erst frei, wenn der
+    Stream zu Ende gelesen, abgebrochen oder geschlossen ist.
+
+    Die tatsächliche Nutzung steht im letzten Chunk (stream_options={"include_usage": True}).
+    """
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._used_tokens = None
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    self._used_tokens = getattr(usage, "total_tokens", None)
+                yield chunk
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Schließt die Verbindung und gibt die Anfrage frei (mehrfacher Aufruf ist harmlos)."""
+        with self._lock:
+            release, self._release = self._release, None
+        if release is None:
+            return
+        try:
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            release(self._used_tokens)
+
+
+class RequestScheduler:
+    """
+    Teilt das Kontingent eines API-Schlüssels (Anfragen und Tokens pro Minute) auf.
+
+    Jede Anfrage bucht vorab ihre geschätzten Tokens aus einem Token Bucket und wartet,
+    bis genug Kontingent frei ist; nach der Antwort (bei Streams nach dem letzten Chunk) wird
+    mit der tatsächlichen Nutzung verrechnet. Interaktive Anfragen werden vor Hintergrundanfragen bedient, die zudem
+    einen Teil des Kontingents frei lassen und nur begrenzt parallel laufen. Auf eine
+    429-Antwort pausieren alle Anfragen des Schlüssels und wiederholen mit Zufallsanteil.
+    """
+
+    def __init__(self, requests_per_minute=OPENAI_RPM, tokens_per_minute=OPENAI_TPM,
+                 reserve=INTERACTIVE_RESERVE, max_bulk_in_flight=MAX_BULK_IN_FLIGHT):
+        self.limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.reserve = reserve
+        self.max_bulk_in_flight = max_bulk_in_flight
+        self._available = dict(self.limits)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0}
+        self._bulk_in_flight = 0
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        elapsed, self._updated = now - self._updated, now
+        for name, limit in self.limits.items():
+            if limit:
+                self._available[name] = min(limit, self._available[name] + elapsed * limit / 60)
+
+    def _wait_time(self, needed, priority, now):
+        """0, wenn die Anfrage starten darf, sonst die Wartezeit (None: bis zur nächsten Freigabe)."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if priority == PRIORITY_BULK and (
+            self._waiting[PRIORITY_INTERACTIVE] or self._bulk_in_flight >= self.max_bulk_in_flight
+        ):
+            return None
+        wait = 0.0
+        for name, limit in self.limits.items():
+            if not limit:
+                continue
+            reserve = limit * self.reserve if priority == PRIORITY_BULK else 0
+            # Anfragen über dem Limit würden sonst nie starten
+            required = min(needed[name] + reserve, limit)
+            if self._available[name] < required:
+                wait = max(wait, (required - self._available[name]) * 60 / limit)
+        return wait
+
+    def acquire(self, tokens, priority=PRIORITY_INTERACTIVE):
+        """Wartet, bis die Anfrage starten darf, und bucht sie."""
+        needed = {"requests": 1, "tokens": tokens}
+        started = time.monotonic()
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self._wait_time(needed, priority, now)
+                    if wait == 0:
+                        break
+                    self._condition.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+            for name, limit in self.limits.items():
+                if limit:
+                    self._available[name] -= needed[name]
+            if priority == PRIORITY_BULK:
+                self._bulk_in_flight += 1
+        metrics.add("queue_ms", (time.monotonic() - started) * 1000)
+
+    def release(self, priority=PRIORITY_INTERACTIVE, estimated_tokens=0, used_tokens=None):
+        """Gibt eine Anfrage frei und verrechnet die geschätzten mit den genutzten Tokens."""
+        with self._condition:
+            if priority == PRIORITY_BULK:
+                self._bulk_in_flight -= 1
+            limit = self.limits["tokens"]
+            if limit and used_tokens is not None:
+                self._available["tokens"] = min(limit, self._available["tokens"] + estimated_tokens - used_tokens)
+            self._condition.notify_all()
+
+    def pause(self, delay):
+        """Hält alle Anfragen des Schlüssels an, z.B. nach einer 429-Antwort."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def run(self, request, tokens=0, priority=None, stream=False):
+        """
+        Führt eine Anfrage im Rahmen des Kontingents aus und wiederholt sie bei temporären Fehlern.
+
+        Args:
+        - request (callable): Führt die Anfrage aus und liefert die Antwort.
+        - tokens (int): Geschätzte Tokens (Eingabe plus maximale Ausgabe).
+        - priority (int): PRIORITY_INTERACTIVE oder PRIORITY_BULK (Standard: aus dem Kontext).
+        - stream (bool): Die Antwort ist ein Stream; die Anfrage zählt dann bis zum Ende des
+          Streams als laufend.
+
+        Returns:
+        - Die Antwort von request, bei stream=True ein iterierbarer Stream mit close().
+        """
+        priority = current_priority() if priority is None else priority
+        for attempt in range(MAX_RETRIES):
+            self.acquire(tokens, priority)
+            used_tokens = None
+            released = False
+            try:
+                response = request()
+                if stream:
+                    released = True
+                    return _ReleasingStream(
+                        response, lambda used_tokens: self.release(priority, tokens, used_tokens)
+                    )
+                usage = getattr(response, "usage", None)
+                used_tokens = getattr(usage, "total_tokens", None)
+                return response
+            except _RETRYABLE_ERRORS as e:
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                delay = backoff_delay(attempt, _retry_after(e))
+                if isinstance(e, openai.RateLimitError):
+                    # Das Limit gilt für den ganzen Schlüssel, nicht nur für diese Anfrage
+                    self.pause(delay)
+                    metrics.get_metrics().count("openai_request", rate_limited=1)
+                else:
+                    time.sleep(delay)
+                metrics.get_metrics().count("openai_request", retries=1)
+            finally:
+                if not released:
+                    self.release(priority, tokens, used_tokens)
+
+
+_clients = {}
+_schedulers = {}
+_registry_lock = threading.Lock()
+
+
+def _registry_key(openai_api_key):
+    # Der Endpunkt kann per OPENAI_BASE_URL umgestellt werden (z.B. in den Benchmarks)
+    return openai_api_key, os.environ.get("OPENAI_BASE_URL")
+
+
+def get_openai_client(openai_api_key):
+    """
+    Liefert den prozessweit geteilten OpenAI Client eines API-Schlüssels.
+
+    Alle Anfragen mit dem Schlüssel teilen sich den HTTP-Verbindungspool (Keep-Alive).
+    Wiederholungen übernimmt der RequestScheduler, nicht der Client.
+    """
+    key = _registry_key(openai_api_key)
+    with _registry_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = openai.OpenAI(
+                api_key=openai_api_key, http_client=openai.DefaultHttpxClient(), max_retries=0
+            )
+            _clients[key] = client
+        return client
+
+
+def get_request_scheduler(openai_api_key):
+    """Liefert den prozessweit geteilten RequestScheduler eines API-Schlüssels."""
+    key = _registry_key(openai_api_key)
+    with _registry_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = RequestScheduler()
+        return scheduler
+
+
+def openai_request(openai_api_key, request, tokens=0, priority=None, stream=False):
+    """
+    Führt eine Anfrage mit dem geteilten Client über den Scheduler des Schlüssels aus.
+
+    Args:
+    - openai_api_key (str): Der API-Schlüssel für OpenAI.
+    - request (callable): Bekommt den openai.OpenAI Client und liefert die Antwort.
+    - tokens (int): Geschätzte Tokens (Eingabe plus maximale Ausgabe).
+    - priority (int): PRIORITY_INTERACTIVE oder PRIORITY_BULK (Standard: aus dem Kontext).
+    - stream (bool): Die Anfrage liefert einen Stream (siehe RequestScheduler.run).
+
+    Returns:
+    - Die Antwort der API.
+    """
+    client = get_openai_client(openai_api_key)
+    return get_request_scheduler(openai_api_key).run(lambda: request(client), tokens, priority, stream)
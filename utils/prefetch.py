@@ -0,0 +1,182 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+import streamlit as st
+
+from utils.email_body import get_email_text
+from utils.openai_client import PRIORITY_BULK, PRIORITY_INTERACTIVE, request_priority
+from utils.summarize_emails import summarize_email
+
+# Prioritäten, kleinere Werte werden zuerst bearbeitet
+PRIORITY_CLICKED = 0
+PRIORITY_VISIBLE = 1
+PRIORITY_NEXT_PAGE = 2
+
+PREFETCH_WORKERS = 4
+# So lange wartet die Detailansicht höchstens auf eine vorgezogene Zusammenfassung
+PREFETCH_WAIT_TIMEOUT = 5.0
+
+
+class _Task:
+    __slots__ = ("key", "fn", "priority", "owner", "generation", "future", "started")
+
+    def __init__(self, key, fn, priority, owner, generation):
+        self.key = key
+        self.fn = fn
+        self.priority = priority
+        self.owner = owner
+        self.generation = generation
+        self.future = Future()
+        self.started = False
+
+
+class PrefetchScheduler:
+    """
+    Arbeitet Hintergrundaufgaben mit einer begrenzten Anzahl Threads nach Priorität ab.
+
+    Aufgaben werden über einen Schlüssel dedupliziert. Jede Aufgabe gehört einem Besitzer
+    (z.B. einer Browser-Sitzung), dessen noch nicht gestartete Aufgaben mit cancel_stale
+    verworfen werden können.
+    """
+
+    def __init__(self, max_workers=PREFETCH_WORKERS):
+        self._queue = queue.PriorityQueue()
+        self._tasks = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        for _ in range(max_workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, key, fn, priority=PRIORITY_VISIBLE, owner=None):
+        """
+        Plant eine Aufgabe ein oder erhöht die Priorität einer bereits geplanten Aufgabe.
+
+        Returns:
+        - concurrent.futures.Future: Das Ergebnis der Aufgabe.
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is not None and not task.future.cancelled():
+                if not task.started and priority < task.priority:
+                    task.priority = priority
+                    self._queue.put((priority, next(self._sequence), task))
+                return task.future
+            task = _Task(key, fn, priority, owner, self._generations.get(owner, 0))
+            self._tasks[key] = task
+            self._queue.put((priority, next(self._sequence), task))
+            return task.future
+
+    def promote(self, key, priority=PRIORITY_CLICKED):
+        """Zieht eine geplante Aufgabe vor, z.B. wenn der Nutzer die E-Mail öffnet."""
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is not None and not task.started and priority < task.priority:
+                task.priority = priority
+                self._queue.put((priority, next(self._sequence), task))
+
+    def get(self, key):
+        """Liefert das Future einer geplanten oder laufenden Aufgabe oder None."""
+        with self._lock:
+            task = self._tasks.get(key)
+            return task.future if task is not None else None
+
+    def cancel(self, key):
+        """Verwirft eine noch nicht gestartete Aufgabe."""
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is not None and not task.started and task.future.cancel():
+                del self._tasks[key]
+
+    def cancel_stale(self, owner):
+        """Verwirft alle noch nicht gestarteten Aufgaben eines Besitzers, z.B. beim Blättern."""
+        with self._lock:
+            self._generations[owner] = self._generations.get(owner, 0) + 1
+            for key, task in list(self._tasks.items()):
+                if task.owner == owner and not task.started and task.priority != PRIORITY_CLICKED:
+                    task.future.cancel()
+                    del self._tasks[key]
+
+    def _worker(self):
+        while True:
+            _, _, task = self._queue.get()
+            with self._lock:
+                if task.started or not task.future.set_running_or_notify_cancel():
+                    continue
+                task.started = True
+            # Nur angeklickte E-Mails zählen als interaktive Anfragen an die API
+            api_priority = PRIORITY_INTERACTIVE if task.priority == PRIORITY_CLICKED else PRIORITY_BULK
+            try:
+                with request_priority(api_priority):
+                    task.future.set_result(task.fn())
+            except Exception as e:
+                task.future.set_exception(e)
+            finally:
+                with self._lock:
+                    if self._tasks.get(task.key) is task:
+                        del self._tasks[task.key]
+
+
+@st.cache_resource
+def get_prefetch_scheduler():
+    """Liefert den prozessweit geteilten Prefetch-Scheduler."""
+    return PrefetchScheduler()
+
+
+def summary_task_key(email_data, model, account):
+    """
+    Schlüssel der Zusammenfassungs-Aufgabe einer E-Mail.
+
+    Der Scheduler wird von allen Sitzungen geteilt; das Konto (z.B. der Pfad seines
+    MessageStore) trennt die Aufgaben verschiedener Konten, auch bei gleicher UID.
+    """
+    return ("summary", account, model, email_data["message_id"] or email_data["uid"])
+
+
+def _load_once(load_bodies, uids):
+    """Lädt die Inhalte beim ersten Aufruf, weitere Aufrufe warten darauf (ein FETCH pro Seite)."""
+    lock = threading.Lock()
+    loaded = []
+
+    def load():
+        with lock:
+            if not loaded:
+                loaded.append(True)
+                load_bodies(uids)
+    return load
+
+
+def prefetch_summaries(scheduler, emails, openai_api_key, model, account, priority=PRIORITY_VISIBLE, owner=None,
+                       load_bodies=None):
+    """
+    Plant die Zusammenfassungen mehrerer E-Mails im Hintergrund ein.
+
+    Die Texte werden erst im Worker extrahiert, bereits gecachte Zusammenfassungen kosten
+    keinen API-Aufruf. Fehlen Inhalte (z.B. direkt nach der Anmeldung), lädt die erste
+    gestartete Aufgabe die fehlenden Inhalte aller übergebenen E-Mails mit load_bodies.
+
+    Args:
+    - scheduler (PrefetchScheduler): Der Scheduler.
+    - emails (list): Die E-Mails, z.B. die sichtbare Seite.
+    - openai_api_key (str): Der API-Schlüssel für OpenAI.
+    - model (str): Das Modell für die Zusammenfassung.
+    - account (str): Das Konto der E-Mails, z.B. der Pfad des MessageStore (siehe summary_task_key).
+    - priority (int): Die Priorität.
+    - owner (str): Der Besitzer, z.B. die ID der Browser-Sitzung.
+    - load_bodies (callable): Lädt fehlende Inhalte zu einer Liste von UIDs in den Store,
+      z.B. MailboxSync.load_bodies mit den Zugangsdaten.
+    """
+    load = _load_once(load_bodies, [email_data["uid"] for email_data in emails]) if load_bodies else None
+    for email_data in emails:
+        def summarize(email_data=email_data):
+            content = get_email_text(email_data)
+            if content is None and load is not None:
+                load()
+                content = get_email_text(email_data)
+            if content is None:
+                return None
+            return summarize_email(content, openai_api_key, model=model)
+
+        scheduler.submit(summary_task_key(email_data, model, account), summarize, priority, owner)
@@ -0,0 +1,19 @@
+import os
+
+# Basisverzeichnis für lokale Caches, kann über MAIL_BOT_CACHE_DIR überschrieben werden
+CACHE_DIR = os.environ.get("MAIL_BOT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "mail-bot"))
+
+
+def get_cache_dir(*parts):
+    """
+    Liefert ein Unterverzeichnis des Cache-Verzeichnisses und legt es bei Bedarf an.
+
+    Args:
+    - parts (str): Pfadbestandteile unterhalb von CACHE_DIR.
+
+    Returns:
+    - str: Der absolute Pfad des Verzeichnisses.
+    """
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -1,135 +1,280 @@
-import openai
 import streamlit as st
-from typing import Optional
+from typing import Iterator, Optional
+
+from utils import metrics
+from utils.context_builder import build_search_context
+from utils.openai_client import openai_request
+from utils.summary_cache import get_summary_cache, summary_key
+from utils.tokens import count_tokens
+
+# Bei Änderungen an den Prompts erhöhen, damit gecachte Antworten nicht wiederverwendet werden
+SUMMARY_PROMPT_VERSION = 1
+QUERY_PROMPT_VERSION = 1
 
 
 def get_openai_model():
     """Get the selected OpenAI model from session state or set default"""
     return st.session_state.openai_model #todo cleanup dependency to session state
 
-def summarize_email(content, openai_api_key):
+def _summary_messages(content):
+    return [
+        {"role": "system", "content": "Du bist ein Assistent, der E-Mails zusammenfasst."},
+        {"role": "user", "content": f"Fasse die folgende E-Mail kurz und prägnant zusammen:\n\n{content}"}
+    ]
+
+
+def _query_prompt(query, search_results, model, openai_api_key):
+    # E-Mail-Inhalte innerhalb des Token-Budgets des Modells zusammenstellen
+    email_contents = build_search_context(query, search_results, model, openai_api_key, max_tokens=500)
+
+    # Create the prompt for OpenAI
+    return f"""
+        Sucheanfrage: {query}
+
+        Gefundene E-Mails:
+        {'***'.join(email_contents)}
+
+        Bitte fasse die wichtigsten Informationen aus den gefundenen E-Mails zusammen,
+        die relevant für die Suchanfrage sind. Bevorzuge Informationen aus Mail welche neueren Datums sind.
+        """
+
+
+def _query_cache_key(query, search_results, model):
+    """
+    Cache-Schlüssel einer Antwort auf eine Suchanfrage, ohne den Prompt aufzubauen.
+
+    Der Schlüssel enthält alles, woraus build_search_context den Prompt baut: pro Treffer in
+    ihrer Reihenfolge Message-ID, Betreff, Absender, Datum und den Hash der Rohnachricht. UIDs
+    allein reichen nicht, der Cache wird von allen Konten geteilt und eine UID kann nach einem
+    UIDVALIDITY-Wechsel eine andere E-Mail bezeichnen. Ein Treffer ohne geladenen Inhalt ergibt
+    einen anderen Schlüssel als nach dem Laden.
+    """
+    hits = "\0".join(
+        "\x1f".join(str(email_data.get(field) or "") for field in (
+            "message_id", "subject", "sender", "date", "body_hash"
+        ))
+        for email_data in search_results
+    )
+    return summary_key("query", QUERY_PROMPT_VERSION, model, f"{query}\0{hits}")
+
+
+def _query_messages(prompt):
+    return [
+        {"role": "system", "content": "Du bist ein hilfreicher Assistent, der E-Mails durchsucht und die Suchanfrage möglichst mit Informationen aus den E-Mails beantwortet."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _suggest_messages(email_body, suggest_keywords):
+    if suggest_keywords:
+        user_message = (
+            f"{email_body}\n\n"
+            f"Bitte berücksichtige die folgenden Schlüsselwörter in deiner Antwort: {suggest_keywords}"
+        )
+    else:
+        user_message = email_body
+    return [
+        {
+            "role": "system",
+            "content": "Du bist ein hilfreicher Assistent, der E-Mails im Namen des Empfängers beantwortet."
+        },
+        {"role": "user", "content": user_message}
+    ]
+
+
+def _chat_completion(openai_api_key, model, messages, max_tokens, **kwargs):
+    """Fragt das Chat-Modell über den geteilten Client und den Scheduler des Schlüssels an."""
+    # Für das Kontingent zählen Eingabe und maximale Ausgabe
+    tokens = sum(count_tokens(message["content"], model) for message in messages) + max_tokens
+    return openai_request(
+        openai_api_key,
+        lambda client: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0.3,
+            response_format={"type": "text"},
+            **kwargs
+        ),
+        tokens,
+        stream=kwargs.get("stream", False),
+    )
+
+
+def _stream_completion(openai_api_key, model, messages, max_tokens, cache_key=None, span_name="llm_stream"):
+    """Streamt die Antwort Token für Token und legt sie am Ende optional im Cache ab."""
+    with metrics.span(span_name, model=model, stream=True):
+        stream = _chat_completion(
+            openai_api_key, model, messages, max_tokens,
+            stream=True,
+            # Der letzte Chunk enthält dann die Token-Nutzung (ohne choices)
+            stream_options={"include_usage": True}
+        )
+        parts = []
+        # Bricht der Aufrufer ab, gibt das Schließen die Anfrage im Scheduler frei
+        with stream:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None) is not None:
+                    metrics.add_usage(chunk.usage)
+        if cache_key is not None:
+            get_summary_cache().put(cache_key, "".join(parts).strip())
+
+
+def _cache_hit(span_name):
+    metrics.get_metrics().count(span_name, cache_hits=1)
+
+
+def summarize_email(content, openai_api_key, model=None):
     try:
         if not openai_api_key or not openai_api_key.startswith("sk-"):
             return "⚠️ Kein gültiger OpenAI API Key vorhanden."
-        
-        client = openai.OpenAI(api_key=openai_api_key)
-        response = client.chat.completions.create(
-            model=get_openai_model(),
-            messages=[
-                {"role": "system", "content": "Du bist ein Assistent, der E-Mails zusammenfasst."},
-                {"role": "user", "content": f"Fasse die folgende E-Mail kurz und prägnant zusammen:\n\n{content}"}
-            ],
-            max_tokens=150,
-            temperature=0.3,
-            response_format={"type": "text"}
-        )
-        return response.choices[0].message.content.strip()
+
+        # Ohne explizites Modell (z.B. in Hintergrund-Threads) das Modell der Sitzung verwenden
+        model = model or get_openai_model()
+        cache_key = summary_key("summary", SUMMARY_PROMPT_VERSION, model, content)
+        cached = get_summary_cache().get(cache_key)
+        if cached is not None:
+            _cache_hit("summarize_email")
+            return cached
+
+        with metrics.span("summarize_email", model=model):
+            response = _chat_completion(openai_api_key, model, _summary_messages(content), 150)
+            metrics.add_usage(response.usage)
+        summary = response.choices[0].message.content.strip()
+        get_summary_cache().put(cache_key, summary)
+        return summary
     except Exception as e:
         return f"Fehler bei der KI-Zusammenfassung: {e}"
-    
+
+
+def summarize_email_stream(content, openai_api_key, model=None) -> Iterator[str]:
+    """
+    Streaming variant of summarize_email, yields the summary token by token.
+
+    A cached summary is yielded as a single chunk.
+    """
+    try:
+        if not openai_api_key or not openai_api_key.startswith("sk-"):
+            yield "⚠️ Kein gültiger OpenAI API Key vorhanden."
+            return
+
+        model = model or get_openai_model()
+        cache_key = summary_key("summary", SUMMARY_PROMPT_VERSION, model, content)
+        cached = get_summary_cache().get(cache_key)
+        if cached is not None:
+            _cache_hit("summarize_email")
+            yield cached
+            return
+
+        yield from _stream_completion(
+            openai_api_key, model, _summary_messages(content), 150, cache_key, "summarize_email"
+        )
+    except Exception as e:
+        yield f"Fehler bei der KI-Zusammenfassung: {e}"
+
 
 def llm_query_answer(query: str, search_results: list, openai_api_key) -> str:
     """
     Generate a summary of search results based on the query using OpenAI.
-    
+
     Args:
         query: The search query string
         search_results: List of email search results
-    
+
     Returns:
         str: Generated summary of the search results
     """
 
     try:
-        # Prepare the email content for the prompt
-        email_contents = []
-        for email in search_results:
-            message = email["message"]
-
-            # E-Mail-Inhalt dekodieren
-            if message.is_multipart():
-                for part in message.walk():
-                    content_type = part.get_content_type()
-                    try:
-                        if content_type == "text/plain":
-                            content = part.get_payload(decode=True).decode()
-                            break
-                    except:
-                        pass
-            else:
-                content = message.get_payload(decode=True).decode()
-
-            email_text = (
-                f"Datum: {email['date'].strftime('%d.%m.%Y')}\n"
-                f"Betreff: {email['subject']}\n"
-                f"Von: {email['sender']}\n"
-                f"Inhalt: {content}..."  # todo Limit content length
-            )
-            email_contents.append(email_text)
-
-        # Create the prompt for OpenAI
-        prompt = f"""
-        Sucheanfrage: {query}
-        
-        Gefundene E-Mails:
-        {'***'.join(email_contents)}
-        
-        Bitte fasse die wichtigsten Informationen aus den gefundenen E-Mails zusammen, 
-        die relevant für die Suchanfrage sind. Bevorzuge Informationen aus Mail welche neueren Datums sind.
-        """
+        model = get_openai_model()
+        # Vor dem Prompt nachsehen: der Kontext kostet Embeddings und Token-Zählungen
+        cache_key = _query_cache_key(query, search_results, model)
+        cached = get_summary_cache().get(cache_key)
+        if cached is not None:
+            _cache_hit("llm_query_answer")
+            return cached
 
-        client = openai.OpenAI(api_key=openai_api_key)
-        response = client.chat.completions.create(
-            model=get_openai_model(),
-            messages=[
-                {"role": "system", "content": "Du bist ein hilfreicher Assistent, der E-Mails durchsucht und die Suchanfrage möglichst mit Informationen aus den E-Mails beantwortet."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500,
-            temperature=0.3,
-            response_format={"type": "text"}
-        )
-        return response.choices[0].message.content.strip()
+        prompt = _query_prompt(query, search_results, model, openai_api_key)
+
+        with metrics.span("llm_query_answer", model=model):
+            response = _chat_completion(openai_api_key, model, _query_messages(prompt), 500)
+            metrics.add_usage(response.usage)
+        answer = response.choices[0].message.content.strip()
+        get_summary_cache().put(cache_key, answer)
+        return answer
 
     except Exception as e:
         return f"Fehler bei der Zusammenfassung: {str(e)}"
-    
+
+
+def llm_query_answer_stream(query: str, search_results: list, openai_api_key) -> Iterator[str]:
+    """
+    Streaming variant of llm_query_answer, yields the answer token by token.
+
+    Args:
+        query: The search query string
+        search_results: List of email search results
+
+    Yields:
+        str: Chunks of the generated answer
+    """
+    try:
+        model = get_openai_model()
+        cache_key = _query_cache_key(query, search_results, model)
+        cached = get_summary_cache().get(cache_key)
+        if cached is not None:
+            _cache_hit("llm_query_answer")
+            yield cached
+            return
+
+        prompt = _query_prompt(query, search_results, model, openai_api_key)
+
+        yield from _stream_completion(
+            openai_api_key, model, _query_messages(prompt), 500, cache_key, "llm_query_answer"
+        )
+    except Exception as e:
+        yield f"Fehler bei der Zusammenfassung: {str(e)}"
+
 
 def llm_suggest_email_response(email_body: str, suggest_keywords: Optional[str], openai_api_key) -> str:
     """
     Generate a response to an email based on the email body using OpenAI.
-    
+
     Args:
         email_body: The email body text.
         suggest_keywords: Keywords to suggest in the response.
-    
+
     Returns:
         Generated response to the email.
     """
     try:
-        client = openai.OpenAI(api_key=openai_api_key)
-        
-        if suggest_keywords:
-            user_message = (
-                f"{email_body}\n\n"
-                f"Bitte berücksichtige die folgenden Schlüsselwörter in deiner Antwort: {suggest_keywords}"
-            )
-        else:
-            user_message = email_body
-        
-        response = client.chat.completions.create(
-            model=get_openai_model(),
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Du bist ein hilfreicher Assistent, der E-Mails im Namen des Empfängers beantwortet."
-                },
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=350,
-            temperature=0.3,
-            response_format={"type": "text"}
-        )
+        model = get_openai_model()
+        with metrics.span("llm_suggest_email_response", model=model):
+            response = _chat_completion(openai_api_key, model, _suggest_messages(email_body, suggest_keywords), 350)
+            metrics.add_usage(response.usage)
         return response.choices[0].message.content.strip()
     except Exception as e:
-        return f"Fehler bei der KI-Antwort: {e}"
\ No newline at end of file
+        return f"Fehler bei der KI-Antwort: {e}"
+
+
+def llm_suggest_email_response_stream(email_body: str, suggest_keywords: Optional[str], openai_api_key) -> Iterator[str]:
+    """
+    Streaming variant of llm_suggest_email_response, yields the response token by token.
+
+    Args:
+        email_body: The email body text.
+        suggest_keywords: Keywords to suggest in the response.
+
+    Yields:
+        str: Chunks of the generated response
+    """
+    try:
+        yield from _stream_completion(
+            openai_api_key, get_openai_model(), _suggest_messages(email_body, suggest_keywords), 350,
+            span_name="llm_suggest_email_response"
+        )
+    except Exception as e:
+        yield f"Fehler bei der KI-Antwort: {e}"
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from utils.storage import get_cache_dir
+
+# Anzahl der im Speicher gehaltenen Antworten
+MEMORY_CACHE_SIZE = 2048
+# Zusätzlicher, sitzungsübergreifender Cache auf der Festplatte (MAIL_BOT_SUMMARY_DISK_CACHE=0 schaltet ihn ab)
+DISK_CACHE_ENABLED = os.environ.get("MAIL_BOT_SUMMARY_DISK_CACHE", "1") != "0"
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def summary_key(kind, prompt_version, model, content):
+    """
+    Erzeugt den Cache-Schlüssel für eine LLM-Antwort.
+
+    Args:
+    - kind (str): Art der Antwort, z.B. "summary" oder "query".
+    - prompt_version (int): Version des Prompts, bei Änderungen am Prompt erhöhen.
+    - model (str): Das verwendete Modell.
+    - content (str): Der Inhalt, aus dem die Antwort erzeugt wird.
+
+    Returns:
+    - str: Hex-Schlüssel.
+    """
+    content_hash = hashlib.sha256(content.encode("utf-8", "surrogatepass")).hexdigest()
+    return hashlib.sha256(f"{kind}\0{prompt_version}\0{model}\0{content_hash}".encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """
+    Zweistufiger Cache für LLM-Antworten: LRU im Speicher und optional SQLite auf der Festplatte.
+    """
+
+    def __init__(self, path=None, max_size=MEMORY_CACHE_SIZE):
+        self.max_size = max_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Liefert die gespeicherte Antwort oder None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT value FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?)", (key, value))
+
+
+def get_summary_cache():
+    """Liefert den prozessweit geteilten Cache für LLM-Antworten."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            path = os.path.join(get_cache_dir(), "summaries.sqlite3") if DISK_CACHE_ENABLED else None
+            _cache = SummaryCache(path)
+        return _cache
@@ -0,0 +1,56 @@
+import hashlib
+import re
+
+_MESSAGE_ID_RE = re.compile(r"<[^<>\s]+>")
+
+
+def parse_message_ids(value):
+    """
+    Liest die Message-IDs aus einem Header wie References oder In-Reply-To.
+
+    Args:
+    - value (str): Der Header oder None.
+
+    Returns:
+    - list: Die Message-IDs mit spitzen Klammern, in der Reihenfolge im Header.
+    """
+    return _MESSAGE_ID_RE.findall(str(value or ""))
+
+
+def thread_root(message_id, in_reply_to=(), references=()):
+    """
+    Bestimmt die Message-ID, die einen Verlauf kennzeichnet.
+
+    References beginnt mit der ersten Nachricht des Verlaufs (RFC 5322), ersatzweise wird die
+    beantwortete Nachricht verwendet. Eine Nachricht ohne beides beginnt einen neuen Verlauf.
+
+    Returns:
+    - str: Die Message-ID der ersten bekannten Nachricht des Verlaufs oder None.
+    """
+    if references:
+        return references[0]
+    if in_reply_to:
+        return in_reply_to[0]
+    return message_id
+
+
+def find_duplicates(texts):
+    """
+    Ordnet jedem Text den ersten Text mit gleichem Inhalt zu.
+
+    Verglichen wird der Inhalt mit vereinheitlichten Leerzeichen. Fast gleiche Texte bleiben
+    getrennt: Rechnungen, Versandbestätigungen oder Newsletter unterscheiden sich oft nur in
+    Beträgen, Daten und Nummern.
+
+    Args:
+    - texts (list): Die Texte.
+
+    Returns:
+    - list: Pro Text die Position seines Vertreters (bei eindeutigen Texten die eigene).
+    """
+    representatives = []
+    first = {}
+    for i, text in enumerate(texts):
+        digest = hashlib.sha256(" ".join(text.split()).encode("utf-8", "surrogatepass")).digest()
+        representatives.append(first.setdefault(digest, i))
+    return representatives
@@ -0,0 +1,59 @@
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    """
+    Liefert das tiktoken-Encoding für ein Modell.
+
+    Ist das Modell unbekannt, wird cl100k_base verwendet. Kann das Encoding
+    nicht geladen werden (z.B. ohne Netzwerk beim ersten Start), wird None
+    zurückgegeben und die Token-Zahl nur geschätzt.
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text, model):
+    """
+    Zählt die Tokens eines Textes für das angegebene Modell.
+
+    Args:
+    - text (str): Der zu zählende Text.
+    - model (str): Der Modellname, z.B. "text-embedding-ada-002".
+
+    Returns:
+    - int: Anzahl der Tokens (Schätzung mit ~4 Zeichen pro Token, falls kein Encoding verfügbar ist).
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens, model):
+    """
+    Kürzt einen Text auf höchstens max_tokens Tokens.
+
+    Args:
+    - text (str): Der zu kürzende Text.
+    - max_tokens (int): Maximale Anzahl an Tokens.
+    - model (str): Der Modellname.
+
+    Returns:
+    - str: Der (ggf. gekürzte) Text.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[: max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])